@@ -73,6 +73,16 @@ BEGIN
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
   );
 
+  -- Class roster (students expected in each subject/time slot)
+  CREATE TABLE IF NOT EXISTS public.class_roster (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    subject_id VARCHAR(255) NOT NULL,
+    time_slot VARCHAR(255) NOT NULL,
+    student_id VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(subject_id, time_slot, student_id)
+  );
+
   -- Insert default subjects
   INSERT INTO public.subjects (id, name, code) VALUES
     ('sub_001', 'Computer Science', 'CS101'),
@@ -106,8 +116,49 @@ BEGIN
   CREATE UNIQUE INDEX IF NOT EXISTS idx_faculty_attendance_unique 
     ON public.faculty_attendance(faculty_id, date);
 
+  -- Idempotency key written by the backend's attendance journal, so a
+  -- retried flush never inserts the same mark twice
+  ALTER TABLE public.student_attendance ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255);
+  ALTER TABLE public.faculty_attendance ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255);
+  CREATE UNIQUE INDEX IF NOT EXISTS idx_student_attendance_idempotency
+    ON public.student_attendance(idempotency_key);
+  CREATE UNIQUE INDEX IF NOT EXISTS idx_faculty_attendance_idempotency
+    ON public.faculty_attendance(idempotency_key);
+
+  -- Session tokens revoked before their expiry (logout, refresh rotation);
+  -- every backend worker polls this into its in-memory revocation list
+  CREATE TABLE IF NOT EXISTS public.revoked_tokens (
+    jti VARCHAR(64) PRIMARY KEY,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  );
+  CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON public.revoked_tokens(expires_at);
+
 END;
 $$ LANGUAGE plpgsql;
 
 -- Execute the function to create tables
-SELECT create_python_attendance_tables(); 
\ No newline at end of file
+SELECT create_python_attendance_tables(); 
+
+-- The face change feed reads rows by updated_at, so it is stamped by the
+-- database on every write instead of by each backend worker's clock
+CREATE OR REPLACE FUNCTION public.set_face_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS student_faces_updated_at ON public.student_faces;
+CREATE TRIGGER student_faces_updated_at
+  BEFORE INSERT OR UPDATE ON public.student_faces
+  FOR EACH ROW EXECUTE FUNCTION public.set_face_updated_at();
+
+DROP TRIGGER IF EXISTS faculty_faces_updated_at ON public.faculty_faces;
+CREATE TRIGGER faculty_faces_updated_at
+  BEFORE INSERT OR UPDATE ON public.faculty_faces
+  FOR EACH ROW EXECUTE FUNCTION public.set_face_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_student_faces_updated_at ON public.student_faces(updated_at);
+CREATE INDEX IF NOT EXISTS idx_faculty_faces_updated_at ON public.faculty_faces(updated_at);
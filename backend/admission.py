@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Shed(Exception):
+    """Raised when a request is turned away; callers should answer 429"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """``rate`` requests per second with bursts of up to ``burst``"""
+
+    def __init__(self, rate, burst, clock=None):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.clock = clock or time.monotonic
+        self._tokens = self.burst
+        self._updated = self.clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token; returns 0, or the seconds until one is available"""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class Lane:
+    def __init__(self, name, priority, max_queue, timeout):
+        self.name = name
+        self.priority = priority
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = {'rate_limited': 0, 'queue_full': 0, 'timeout': 0}
+
+    def stats(self):
+        return {
+            'priority': self.priority,
+            'running': self.running,
+            'queue_depth': self.waiting,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': dict(self.shed),
+        }
+
+
+class AdmissionController:
+    """Priority scheduler for the CPU-heavy endpoints of one process
+
+    At most ``capacity`` requests run at once. Lanes are added with a
+    priority (0 is highest); only priority-0 lanes may use the last
+    ``reserved`` slots, so lower lanes can never take all of them (each
+    lane still gets at least one). A request that finds no free slot
+    waits in its lane's queue, and freed slots go to the highest-priority
+    waiter, FIFO within a priority. A request is shed instead when its
+    lane already has ``max_queue`` waiters, when it waits longer than the
+    lane's ``timeout``, or when the token bucket of its endpoint (see
+    ``limit``) is empty. ``on_shed(lane, endpoint, reason)`` is called for
+    every shed request.
+    """
+
+    def __init__(self, capacity, reserved=0, retry_after=1, on_shed=None):
+        self.capacity = max(1, capacity)
+        self.reserved = max(0, min(reserved, self.capacity - 1))
+        self.retry_after = retry_after
+        self.on_shed = on_shed
+        self.running = 0
+        self.lanes = {}
+        self.buckets = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_lane(self, name, priority, max_queue=0, timeout=5):
+        self.lanes[name] = Lane(name, priority, max_queue, timeout)
+        return self.lanes[name]
+
+    def limit(self, endpoint, rate, burst=None):
+        """Rate-limit ``endpoint`` to ``rate`` requests per second (0 = unlimited)"""
+        if rate > 0:
+            self.buckets[endpoint] = TokenBucket(rate, burst if burst is not None else rate)
+        else:
+            self.buckets.pop(endpoint, None)
+
+    def _slots_for(self, lane):
+        return self.capacity if lane.priority == 0 else self.capacity - self.reserved
+
+    def _waiting_ahead(self, lane):
+        return any(waiter[2] is not None and waiter[0] <= lane.priority for waiter in self._queue)
+
+    def _grant(self, lane):
+        self.running += 1
+        lane.running += 1
+        lane.admitted += 1
+
+    def _dispatch(self):
+        while self._queue:
+            priority, _, lane, granted = self._queue[0]
+            if lane is None:
+                heapq.heappop(self._queue)
+                continue
+            if self.running >= self._slots_for(lane):
+                # Lower lanes have no more slots than the head's lane
+                return
+            heapq.heappop(self._queue)
+            lane.waiting -= 1
+            self._grant(lane)
+            granted.set()
+
+    def _shed(self, lane, endpoint, reason, message, retry_after):
+        lane.shed[reason] += 1
+        if self.on_shed is not None:
+            self.on_shed(lane.name, endpoint, reason)
+        raise Shed(message, retry_after, reason)
+
+    def acquire(self, lane_name, endpoint=None):
+        """Wait for a slot in ``lane_name``; raises Shed when turned away"""
+        lane = self.lanes[lane_name]
+        bucket = self.buckets.get(endpoint)
+        if bucket is not None:
+            wait = bucket.take()
+            if wait:
+                with self._lock:
+                    self._shed(lane, endpoint, 'rate_limited', 'Too many requests, retry later',
+                               max(1, math.ceil(wait)))
+
+        with self._lock:
+            if self.running < self._slots_for(lane) and not self._waiting_ahead(lane):
+                self._grant(lane)
+                return
+            if lane.waiting >= lane.max_queue:
+                self._shed(lane, endpoint, 'queue_full', 'Server is busy, retry later', self.retry_after)
+            waiter = [lane.priority, next(self._seq), lane, threading.Event()]
+            heapq.heappush(self._queue, waiter)
+            lane.waiting += 1
+            lane.queued += 1
+
+        if waiter[3].wait(lane.timeout):
+            return
+        with self._lock:
+            if waiter[3].is_set():
+                # Granted between the timeout and taking the lock
+                return
+            # Left in the heap and skipped by _dispatch
+            waiter[2] = None
+            lane.waiting -= 1
+            self._shed(lane, endpoint, 'timeout', 'Server is busy, retry later', self.retry_after)
+
+    def release(self, lane_name):
+        with self._lock:
+            lane = self.lanes[lane_name]
+            self.running -= 1
+            lane.running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, lane_name, endpoint=None):
+        self.acquire(lane_name, endpoint)
+        try:
+            yield
+        finally:
+            self.release(lane_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'reserved': self.reserved,
+                'running': self.running,
+                'queue_depth': sum(lane.waiting for lane in self.lanes.values()),
+                'lanes': {name: lane.stats() for name, lane in self.lanes.items()},
+                'rate_limits': {
+                    endpoint: {'rate': bucket.rate, 'burst': bucket.burst}
+                    for endpoint, bucket in self.buckets.items()
+                },
+            }
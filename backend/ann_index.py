@@ -0,0 +1,231 @@
+import argparse
+import math
+import time
+
+import numpy as np
+
+
+def _sq_distances(points, centroids, centroid_sq_norms):
+    """Squared euclidean distances between two sets of row vectors"""
+    dist = centroid_sq_norms[None, :] - 2.0 * (points @ centroids.T)
+    dist += np.einsum('ij,ij->i', points, points)[:, None]
+    return dist
+
+
+def _assign(points, centroids, chunk_size=16384):
+    """Index of the nearest centroid for every point, computed in chunks"""
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(points), dtype=np.int32)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(
+            _sq_distances(chunk, centroids, centroid_sq_norms), axis=1
+        )
+    return labels
+
+
+def kmeans(points, n_clusters, n_iter=10, seed=0):
+    """Plain Lloyd's k-means returning an (n_clusters x dim) float32 array"""
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype=np.float32)
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(points, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        # Re-seed empty clusters on random points so every list stays useful
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+    return centroids
+
+
+def list_layout(vectors, centroids):
+    """Nearest-centroid lists of ``vectors`` as flat arrays ``(offsets, rows)``
+
+    List ``i`` holds rows ``rows[offsets[i]:offsets[i + 1]]``. Built with a
+    sort instead of per-row dicts, so it is cheap to share between processes.
+    """
+    labels = _assign(np.asarray(vectors, dtype=np.float32), centroids)
+    rows = np.argsort(labels, kind='stable').astype(np.int64)
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=len(centroids)))
+    return offsets, rows
+
+
+class IVFIndex:
+    """Inverted-file index over gallery rows.
+
+    Gallery rows are partitioned by their nearest k-means centroid. A query
+    only scans the rows in the ``nprobe`` lists whose centroids are closest to
+    it, so ``nprobe`` is the recall/latency knob: 1 is fastest, ``n_lists``
+    is equivalent to exact search.
+
+    An index made by ``from_lists`` serves lists published with a shared
+    gallery as they are and cannot be changed.
+    """
+
+    def __init__(self, n_lists=None, nprobe=8, n_iter=10, train_sample_per_list=64, seed=0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.train_sample_per_list = train_sample_per_list
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+        self._list_arrays = {}
+        self._row_labels = {}
+        self._offsets = None
+        self._rows = None
+
+    @classmethod
+    def from_lists(cls, centroids, offsets, rows, nprobe=8, trained_size=None):
+        """Read-only index over lists laid out by ``list_layout``"""
+        index = cls(n_lists=len(centroids), nprobe=nprobe)
+        index.centroids = centroids
+        index.trained_size = len(rows) if trained_size is None else trained_size
+        index._offsets = offsets
+        index._rows = rows
+        return index
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, matrix, rows=None):
+        """Learn the coarse centroids from ``matrix`` and index its rows
+
+        ``rows`` restricts training and indexing to those row numbers, e.g.
+        the live rows of a gallery with free slots.
+        """
+        rows = np.arange(len(matrix)) if rows is None else np.asarray(rows)
+        size = len(rows)
+        self.centroids = self.train_centroids(matrix, rows)
+        n_lists = len(self.centroids)
+        self._lists = [{} for _ in range(n_lists)]
+        self._list_arrays = {}
+        self._row_labels = {}
+        self.trained_size = size
+        self.add(rows, matrix[rows])
+
+    def train_centroids(self, matrix, rows=None):
+        """k-means centroids for ``matrix`` (or its ``rows``) without indexing it"""
+        rows = np.arange(len(matrix)) if rows is None else np.asarray(rows)
+        size = len(rows)
+        n_lists = self.n_lists or max(1, int(round(math.sqrt(size))))
+        n_lists = min(n_lists, size)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(size, n_lists * self.train_sample_per_list)
+        sample = np.asarray(matrix[rng.choice(rows, sample_size, replace=False)], dtype=np.float32)
+        return kmeans(sample, n_lists, self.n_iter, self.seed)
+
+    def add(self, rows, vectors):
+        """Put gallery rows into the list of their nearest centroid"""
+        if self._rows is not None:
+            raise ValueError('A published index is read-only')
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(rows), -1)
+        labels = _assign(vectors, self.centroids)
+        for row, label in zip(np.asarray(rows).tolist(), labels.tolist()):
+            self.remove(row)
+            self._lists[label][row] = None
+            self._row_labels[row] = label
+            self._list_arrays.pop(label, None)
+
+    def remove(self, row):
+        """Drop a gallery row from whichever list holds it"""
+        if self._rows is not None:
+            raise ValueError('A published index is read-only')
+        label = self._row_labels.pop(row, None)
+        if label is not None:
+            del self._lists[label][row]
+            self._list_arrays.pop(label, None)
+
+    def _list_array(self, label):
+        if self._rows is not None:
+            return self._rows[self._offsets[label]:self._offsets[label + 1]]
+        rows = self._list_arrays.get(label)
+        if rows is None:
+            members = self._lists[label]
+            rows = np.fromiter(members, dtype=np.int64, count=len(members))
+            self._list_arrays[label] = rows
+        return rows
+
+    def candidates(self, probe, nprobe=None):
+        """Gallery rows stored in the lists nearest to ``probe``"""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = np.asarray(probe, dtype=np.float32).reshape(1, -1)
+        centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        dist = _sq_distances(probe, self.centroids, centroid_sq_norms)[0]
+        if nprobe < len(dist):
+            labels = np.argpartition(dist, nprobe - 1)[:nprobe]
+        else:
+            labels = range(len(dist))
+        return np.concatenate([self._list_array(label) for label in labels])
+
+
+def recall_report(gallery, queries, k=1, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Compare IVF search against brute force on ``gallery``
+
+    Returns one dict per ``nprobe`` with recall@k and mean per-query latency,
+    plus the brute-force latency for reference.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, gallery.dim)
+    started = time.perf_counter()
+    exact = [gallery.exact_top_k(query[None, :], k)[0][0] for query in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    index = gallery.index
+    if index is None or not index.is_trained:
+        raise ValueError('Gallery has no trained ANN index')
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        started = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            rows, _ = gallery.ann_top_k(query, k, nprobe)
+            hits += len(np.intersect1d(rows, truth))
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        report.append({
+            'nprobe': nprobe,
+            'recall': hits / (len(queries) * k),
+            'ann_ms': elapsed_ms,
+            'exact_ms': exact_ms,
+        })
+    return report
+
+
+def main():
+    from face_gallery import FaceGallery, ENCODING_DIM
+
+    parser = argparse.ArgumentParser(description='IVF recall/latency report on a synthetic gallery')
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=1)
+    parser.add_argument('--noise', type=float, default=0.05)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(size=(args.size, ENCODING_DIM)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    gallery = FaceGallery(ann_min_size=0)
+    started = time.perf_counter()
+    gallery.upsert_many([('student', str(i)) for i in range(args.size)], encodings)
+    print(f"Built gallery of {args.size} in {time.perf_counter() - started:.2f}s")
+
+    # Probes are noisy copies of enrolled faces, like a fresh camera capture
+    picks = rng.choice(args.size, args.queries, replace=False)
+    queries = encodings[picks] + rng.normal(scale=args.noise, size=(args.queries, ENCODING_DIM))
+    for row in recall_report(gallery, queries, k=args.k):
+        print(
+            f"nprobe={row['nprobe']:>3}  recall@{args.k}={row['recall']:.3f}  "
+            f"ann={row['ann_ms']:.2f}ms  exact={row['exact_ms']:.2f}ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,144 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-import cv2
 import numpy as np
-import face_recognition
 import os
 import json
 import requests
 from datetime import datetime, timedelta
-import base64
+import functools
+import itertools
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-import geopy.distance
 from dotenv import load_dotenv
 from werkzeug.security import check_password_hash
+try:
+    import bcrypt
+except ImportError:  # only needed for bcrypt hashes written by the web app
+    bcrypt = None
+from face_gallery import FaceGallery, ReadOnlyGallery
+from gallery_snapshot import SnapshotSyncer
+from gallery_sync import GallerySync, checked_rows
+from gallery_shm import SharedGallerySyncer
+from encoding_engine import EncodingEngine, EngineBusy, frame_quality, result_size
+from result_cache import ResultCache
+from image_input import ImageRejected, read_burst_frames, read_image_bytes, request_fields
+from geofence import GeofenceIndex
+import face_codec
+from attendance_journal import AttendanceJournal, LocalTableClient, idempotency_key
+from marked_index import MarkedIndex, marked_query, stored_marked_keys
+from attendance_rollups import AttendanceRollups
+from session_tokens import RevocationList, TokenError, TokenIssuer
+from attendance_export import InvalidCursor, csv_lines, fetch_page, iter_rows, ndjson_lines, parse_fields
+from roster_index import RosterIndexes
+from admission import AdmissionController, Shed
+from metrics import Registry, end_request, instrument_httpx, server_timing, start_request
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
 
+# Uploads larger than MAX_IMAGE_BYTES, or wider/taller than MAX_IMAGE_SIDE
+# pixels, are rejected before any decode. Requests may be up to twice the
+# image size to leave room for base64 JSON bodies.
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', '6000'))
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_BYTES * 2
+# /api/mark-attendance-burst takes up to MAX_BURST_FRAMES frames of at most
+# MAX_BURST_BYTES together
+MAX_BURST_FRAMES = int(os.getenv('MAX_BURST_FRAMES', '8'))
+MAX_BURST_BYTES = int(os.getenv('MAX_BURST_BYTES', str(MAX_IMAGE_BYTES)))
+
 # Supabase Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Prometheus metrics served on /metrics. METRICS_TIMING_HEADER=true also
+# returns each request's stage timings in a Server-Timing header.
+METRICS_TIMING_HEADER = os.getenv('METRICS_TIMING_HEADER', 'false').lower() == 'true'
+METRICS = Registry()
+STAGE_SECONDS = METRICS.histogram(
+    'attendance_stage_seconds', 'Time spent in each hot-path stage', ['stage'], timing_prefix=''
+)
+FACE_RESULTS = METRICS.counter(
+    'attendance_face_results_total', 'Face recognition/verification outcomes', ['function', 'outcome']
+)
+GEOFENCE_RESULTS = METRICS.counter('attendance_geofence_results_total', 'Geofence check outcomes', ['outcome'])
+SUPABASE_SECONDS = METRICS.histogram(
+    'attendance_supabase_request_seconds', 'Supabase REST call latency', ['table', 'method'], timing_prefix='db_'
+)
+SUPABASE_ERRORS = METRICS.counter(
+    'attendance_supabase_errors_total', 'Supabase REST calls answered with status >= 400', ['table', 'method']
+)
+HTTP_SECONDS = METRICS.histogram(
+    'attendance_http_request_seconds', 'API request latency', ['endpoint', 'method', 'status']
+)
+BURST_FRAMES = METRICS.histogram(
+    'attendance_burst_frames_consumed', 'Frames matched before a burst was decided', ['outcome'],
+    buckets=range(1, 9)
+)
+METRICS.gauge('attendance_gallery_faces', 'Encodings in the face gallery', function=lambda: len(FACE_GALLERY))
+METRICS.gauge('attendance_engine_in_flight', 'Face engine jobs running or queued',
+              function=lambda: FACE_ENGINE.status()['in_flight'])
+METRICS.gauge('attendance_journal_pending', 'Journaled marks not yet flushed',
+              function=lambda: ATTENDANCE_JOURNAL.stats()['pending'])
+METRICS.gauge('attendance_journal_dead_letters', 'Journaled marks the database rejected and that were parked',
+              function=lambda: ATTENDANCE_JOURNAL.stats()['dead_letters'])
+METRICS.gauge('attendance_marked_index_entries', 'Keys in the duplicate-check index',
+              function=lambda: len(MARKED_INDEX))
+METRICS.gauge('attendance_gallery_sync_lag_seconds', 'Seconds since the last successful face change poll',
+              function=lambda: GALLERY_SYNC.stats()['sync_lag_seconds'] or 0)
+METRICS.gauge('attendance_gallery_sync_rows_applied', 'Changed face rows applied by the change feed',
+              function=lambda: GALLERY_SYNC.rows_applied)
+METRICS.gauge('attendance_gallery_sync_rows_removed', 'Deleted face rows removed by reconciliation',
+              function=lambda: GALLERY_SYNC.rows_removed)
+METRICS.gauge('attendance_roster_index_sessions', 'Cached class-session roster indexes',
+              function=lambda: len(ROSTER_INDEXES))
+instrument_httpx(supabase.postgrest.session, SUPABASE_SECONDS, SUPABASE_ERRORS)
+
+# Attendance marks are acknowledged once they are fsynced to a local SQLite
+# journal and flushed to Supabase in batches. ATTENDANCE_FLUSH_TARGET=
+# local:<path> flushes into a local stand-in of the table API instead.
+ATTENDANCE_JOURNAL_PATH = os.getenv('ATTENDANCE_JOURNAL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attendance_journal.db'))
+ATTENDANCE_FLUSH_TARGET = os.getenv('ATTENDANCE_FLUSH_TARGET', 'supabase')
+ATTENDANCE_JOURNAL = AttendanceJournal(
+    ATTENDANCE_JOURNAL_PATH,
+    LocalTableClient(ATTENDANCE_FLUSH_TARGET.split(':', 1)[1])
+    if ATTENDANCE_FLUSH_TARGET.startswith('local:') else supabase,
+    batch_size=int(os.getenv('ATTENDANCE_FLUSH_BATCH', '500')),
+    interval=float(os.getenv('ATTENDANCE_FLUSH_INTERVAL', '1')),
+    max_backoff=float(os.getenv('ATTENDANCE_FLUSH_MAX_BACKOFF', '60')),
+    # Rows the database rejects this many times are parked in dead_letters
+    max_attempts=int(os.getenv('ATTENDANCE_FLUSH_MAX_ATTEMPTS', '5'))
+)
+
+# /api/login issues short-lived signed access tokens (plus a refresh token)
+# that the attendance endpoints verify locally. Without SESSION_TOKEN_SECRET
+# a random secret is used and tokens do not survive a restart or work across
+# workers. AUTH_REQUIRED=true rejects attendance requests that carry none.
+SESSION_TOKEN_SECRET = os.getenv('SESSION_TOKEN_SECRET') or secrets.token_hex(32)
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', 'false').lower() == 'true'
+REVOKED_TOKENS_TABLE = os.getenv('REVOKED_TOKENS_TABLE', 'revoked_tokens')
+# Token user types that may act on other users' records: class-wide
+# attendance reads, class photos, face enrollment and deletion, analytics
+STAFF_USER_TYPES = ('faculty', 'admin')
+# Tables /api/login looks users up in (by PRN) for each token user type
+LOGIN_TABLES = {
+    'student': os.getenv('STUDENT_LOGIN_TABLE', 'students'),
+    'faculty': os.getenv('FACULTY_LOGIN_TABLE', 'faculty'),
+}
+REVOCATION_SYNC_SECONDS = float(os.getenv('REVOCATION_SYNC_SECONDS', '30'))
+TOKEN_ISSUER = TokenIssuer(
+    SESSION_TOKEN_SECRET,
+    access_ttl=int(os.getenv('SESSION_ACCESS_TTL', '900')),
+    refresh_ttl=int(os.getenv('SESSION_REFRESH_TTL', str(7 * 86400))),
+    revoked=RevocationList()
+)
+
 # Sanjivani College of Engineering, Kopargaon Coordinates
 CAMPUS_CENTER = {
     'latitude': 19.90194,  # Sanjivani College latitude
@@ -30,32 +146,434 @@ CAMPUS_CENTER = {
     'radius_meters': 500   # Campus radius in meters
 }
 
+# Campuses with optional building/hostel polygons can be listed in a JSON
+# file (see GeofenceIndex.from_file); otherwise the single circle above is used
+CAMPUS_GEOFENCE_FILE = os.getenv('CAMPUS_GEOFENCE_FILE')
+if CAMPUS_GEOFENCE_FILE:
+    GEOFENCE = GeofenceIndex.from_file(CAMPUS_GEOFENCE_FILE)
+else:
+    GEOFENCE = GeofenceIndex([{
+        'id': 'sanjivani',
+        'name': 'Sanjivani College of Engineering',
+        'center': [CAMPUS_CENTER['latitude'], CAMPUS_CENTER['longitude']],
+        'radius_meters': CAMPUS_CENTER['radius_meters']
+    }])
+MAX_GEOFENCE_BATCH = int(os.getenv('MAX_GEOFENCE_BATCH', '100000'))
+
 # Face recognition settings
-KNOWN_FACE_ENCODINGS = []
-KNOWN_FACE_NAMES = []
+FACE_RECOGNITION_TOLERANCE = float(os.getenv('FACE_RECOGNITION_TOLERANCE', '0.6'))
+# Galleries at least FACE_ANN_MIN_SIZE large are searched through an IVF
+# index; FACE_ANN_NPROBE trades recall for latency
+FACE_GALLERY = FaceGallery(
+    ann_min_size=int(os.getenv('FACE_ANN_MIN_SIZE', '20000')),
+    nprobe=int(os.getenv('FACE_ANN_NPROBE', '16'))
+)
+# 'verify' checks the probe against the claimed user's own encoding only,
+# 'identify' searches the whole gallery
+FACE_MATCH_MODE = os.getenv('FACE_MATCH_MODE', 'verify')
+FACE_VERIFY_TOLERANCE = float(os.getenv('FACE_VERIFY_TOLERANCE', str(FACE_RECOGNITION_TOLERANCE)))
+# Optionally re-run a 1:N search after a successful 1:1 verification, off the
+# request path, to flag probes that sit closer to somebody else
+FACE_IMPOSTOR_CHECK = os.getenv('FACE_IMPOSTOR_CHECK', 'false').lower() == 'true'
+IMPOSTOR_CHECK_EXECUTOR = ThreadPoolExecutor(max_workers=1)
 
-def load_known_faces():
-    """Load known faces from Supabase"""
+# A class-photo match closer than this to the runner-up is reported as
+# ambiguous instead of being marked
+FACE_MIN_MARGIN = float(os.getenv('FACE_MIN_MARGIN', '0.05'))
+# A burst stops at the first frame that verifies this far inside
+# FACE_VERIFY_TOLERANCE, or (identify mode) beats the runner-up identity by
+# this much; otherwise the closest passing frame is used
+FACE_BURST_MIN_MARGIN = float(os.getenv('FACE_BURST_MIN_MARGIN', '0.1'))
+# Table listing the students expected in each subject_id/time_slot
+CLASS_ROSTER_TABLE = os.getenv('CLASS_ROSTER_TABLE', 'class_roster')
+# Identify-mode marks with a subject_id are matched against that session's
+# roster only; FACE_ROSTER_FALLBACK=true retries the whole gallery when no
+# roster student matches
+FACE_ROSTER_INDEXES = os.getenv('FACE_ROSTER_INDEXES', 'true').lower() == 'true'
+FACE_ROSTER_FALLBACK = os.getenv('FACE_ROSTER_FALLBACK', 'false').lower() == 'true'
+
+FACE_CACHE_SIZE = int(os.getenv('FACE_CACHE_SIZE', '1024'))
+# Serving processes on this host, each with its own engine pool and
+# admission slots (gunicorn.conf.py sets it to the gunicorn worker count).
+# Pools default to an equal share of the cores so the host is not
+# oversubscribed
+SERVER_PROCESSES = max(1, int(os.getenv('SERVER_PROCESSES', '1')))
+FACE_ENGINE_WORKERS = int(os.getenv('FACE_ENGINE_WORKERS') or max(1, (os.cpu_count() or 1) // SERVER_PROCESSES))
+if FACE_ENGINE_WORKERS * SERVER_PROCESSES > (os.cpu_count() or 1):
+    print(f"Warning: {SERVER_PROCESSES} processes x FACE_ENGINE_WORKERS={FACE_ENGINE_WORKERS} "
+          f"exceeds the {os.cpu_count()} cores of this host")
+# Decode/detect/encode run on a pool of worker processes; requests beyond
+# workers + queue are rejected with 429 instead of queueing unboundedly
+FACE_ENGINE = EncodingEngine(
+    workers=FACE_ENGINE_WORKERS,
+    max_queue=int(os.getenv('FACE_ENGINE_MAX_QUEUE', '8')),
+    timeout=float(os.getenv('FACE_ENGINE_TIMEOUT', '30')),
+    retry_after=int(os.getenv('FACE_ENGINE_RETRY_AFTER', '1')),
+    # Faces are detected on a copy scaled to this short side (0 = full size)
+    # and encoded from the original pixels
+    detect_short_side=int(os.getenv('FACE_DETECT_SHORT_SIDE', '640')),
+    # Identical frames (client retries, detect_face followed by
+    # mark-attendance) reuse earlier results for FACE_CACHE_TTL seconds
+    cache=ResultCache(
+        max_entries=FACE_CACHE_SIZE,
+        max_bytes=int(os.getenv('FACE_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+        ttl=float(os.getenv('FACE_CACHE_TTL', '120')),
+        size_of=result_size
+    ) if FACE_CACHE_SIZE > 0 else None
+)
+# Admission control for the endpoints that run the face pipeline: at most
+# ADMISSION_CAPACITY requests use the engine at once (default: one per
+# worker), and the last ADMISSION_RESERVED slots are kept for attendance
+# marking. Requests without a free slot queue by priority (marking, then
+# face detection, then enrollment) for up to ADMISSION_QUEUE_TIMEOUT
+# seconds and are shed with 429 beyond their lane's queue length.
+# ADMISSION_*_RATE caps each endpoint of a lane in requests per second per
+# process (0 = unlimited), with bursts of ADMISSION_BURST_SECONDS worth.
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_BURST_SECONDS = float(os.getenv('ADMISSION_BURST_SECONDS', '2'))
+ADMISSION_RATES = {
+    'mark': float(os.getenv('ADMISSION_MARK_RATE', '0')),
+    'detect': float(os.getenv('ADMISSION_DETECT_RATE', '10')),
+    'enroll': float(os.getenv('ADMISSION_ENROLL_RATE', '2')),
+}
+ADMISSION_SHED = METRICS.counter(
+    'attendance_admission_shed_total', 'Requests shed by admission control', ['lane', 'endpoint', 'reason']
+)
+ADMISSION = AdmissionController(
+    # Per process, like the engine pool it guards
+    capacity=int(os.getenv('ADMISSION_CAPACITY') or max(1, FACE_ENGINE.workers)),
+    reserved=int(os.getenv('ADMISSION_RESERVED', '1')),
+    retry_after=FACE_ENGINE.retry_after,
+    on_shed=lambda lane, endpoint, reason: ADMISSION_SHED.inc(lane=lane, endpoint=endpoint, reason=reason)
+)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '10'))
+ADMISSION.add_lane('mark', 0, int(os.getenv('ADMISSION_MARK_QUEUE', '32')), ADMISSION_QUEUE_TIMEOUT)
+ADMISSION.add_lane('detect', 1, int(os.getenv('ADMISSION_DETECT_QUEUE', '4')), ADMISSION_QUEUE_TIMEOUT)
+ADMISSION.add_lane('enroll', 2, int(os.getenv('ADMISSION_ENROLL_QUEUE', '8')), ADMISSION_QUEUE_TIMEOUT)
+METRICS.gauge('attendance_admission_queue_depth', 'Requests waiting for an admission slot', ['lane'],
+              function=lambda: {name: lane['queue_depth'] for name, lane in ADMISSION.stats()['lanes'].items()})
+METRICS.gauge('attendance_admission_running', 'Requests holding an admission slot', ['lane'],
+              function=lambda: {name: lane['running'] for name, lane in ADMISSION.stats()['lanes'].items()})
+
+def admitted(lane):
+    """Run a view under admission control in ``lane``, rate-limited per endpoint"""
+    def decorator(view):
+        ADMISSION.limit(view.__name__, ADMISSION_RATES[lane], ADMISSION_RATES[lane] * ADMISSION_BURST_SECONDS)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return view(*args, **kwargs)
+            with ADMISSION.slot(lane, view.__name__):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Classroom photos hold many small faces, so they get a larger copy
+CLASS_PHOTO_DETECT_SHORT_SIDE = int(os.getenv('CLASS_PHOTO_DETECT_SHORT_SIDE', '1600'))
+
+# (user_type, table, id column) of every table holding face encodings
+FACE_TABLES = [
+    ('student', 'student_faces', 'student_id'),
+    ('faculty', 'faculty_faces', 'faculty_id'),
+]
+FACE_PAGE_SIZE = int(os.getenv('FACE_PAGE_SIZE', '1000'))
+# Format new encodings are written in: 'f16' (4x smaller than the legacy
+# float64 text), 'i8' (8x) or 'f64'; every format is readable
+FACE_ENCODING_FORMAT = os.getenv('FACE_ENCODING_FORMAT', 'f16')
+
+# (user_type, table, id column) of the attendance tables
+ATTENDANCE_TABLES = [
+    ('student', 'student_attendance', 'student_id'),
+    ('faculty', 'faculty_attendance', 'faculty_id'),
+]
+# get-attendance: largest JSON page, and the page size used when streaming
+ATTENDANCE_MAX_PAGE_SIZE = int(os.getenv('ATTENDANCE_MAX_PAGE_SIZE', '1000'))
+ATTENDANCE_EXPORT_PAGE_SIZE = int(os.getenv('ATTENDANCE_EXPORT_PAGE_SIZE', '1000'))
+
+# Versioned on-disk gallery snapshot that every worker memory-maps; leave
+# FACE_SNAPSHOT_DIR empty to always load straight from Supabase. One process
+# per host polls the change feed into new snapshots every
+# FACE_SNAPSHOT_SYNC_SECONDS (0 disables), or at once when a worker changes
+# a face
+FACE_SNAPSHOT_DIR = os.getenv('FACE_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'face_snapshot'))
+FACE_SNAPSHOT_SYNC_SECONDS = float(os.getenv('FACE_SNAPSHOT_SYNC_SECONDS', '5'))
+
+def face_key(user_type, user_id):
+    """Gallery key for a user; the faces tables only know students and faculty"""
+    return ('student' if user_type == 'student' else 'faculty', user_id)
+
+def decode_face_encoding(encoded):
+    """Decode a stored face encoding (legacy float64 or compact fe2 format)"""
+    return face_codec.decode_face_encoding(encoded)
+
+def fetch_face_rows(since=None):
+    """Yield (key, encoding, updated_at) for face rows updated at or after `since`
+
+    Rows are read page by page in updated_at order so large galleries are not
+    truncated by the PostgREST row limit. updated_at is stamped by a database
+    trigger (see create_python_attendance_tables.sql), never by a worker's
+    clock; the syncers re-read a window before their watermark so late
+    commits are not lost. Rows whose encoding does not decode are yielded
+    with None in its place.
+    """
+    for user_type, table_name, id_field in FACE_TABLES:
+        start = 0
+        while True:
+            query = supabase.table(table_name).select(f'{id_field}, face_encoding, updated_at')
+            if since:
+                query = query.gte('updated_at', since)
+            response = query.order('updated_at').range(start, start + FACE_PAGE_SIZE - 1).execute()
+            for face_data in response.data:
+                try:
+                    encoding = decode_face_encoding(face_data['face_encoding'])
+                except Exception:
+                    # Logged and stepped over by gallery_sync.checked_rows
+                    encoding = None
+                yield ((user_type, face_data[id_field]), encoding, face_data.get('updated_at'))
+            if len(response.data) < FACE_PAGE_SIZE:
+                break
+            start += FACE_PAGE_SIZE
+
+def fetch_face_keys():
+    """Yield the gallery key of every face row"""
+    for user_type, table_name, id_field in FACE_TABLES:
+        start = 0
+        while True:
+            response = supabase.table(table_name).select(id_field) \
+                .order(id_field).range(start, start + FACE_PAGE_SIZE - 1).execute()
+            for face_data in response.data:
+                yield (user_type, face_data[id_field])
+            if len(response.data) < FACE_PAGE_SIZE:
+                break
+            start += FACE_PAGE_SIZE
+
+# Faces enrolled or changed elsewhere (admin panel, other workers) are
+# polled by updated_at every FACE_SYNC_SECONDS (0 disables) and applied row
+# by row; deletions are picked up every FACE_SYNC_RECONCILE_SECONDS
+FACE_SYNC_SECONDS = float(os.getenv('FACE_SYNC_SECONDS', '5'))
+# Every poll re-reads this many seconds before its watermark, so rows whose
+# transaction committed late are not skipped
+FACE_SYNC_OVERLAP_SECONDS = float(os.getenv('FACE_SYNC_OVERLAP_SECONDS', '30'))
+GALLERY_SYNC = GallerySync(
+    FACE_GALLERY, fetch_face_rows, fetch_face_keys,
+    interval=FACE_SYNC_SECONDS,
+    reconcile_interval=float(os.getenv('FACE_SYNC_RECONCILE_SECONDS', '600')),
+    batch_size=FACE_PAGE_SIZE,
+    overlap=FACE_SYNC_OVERLAP_SECONDS
+)
+
+# With FACE_SHM_NAME set, prefork workers share one gallery per host: a
+# single publisher process applies the change feed into a new shared-memory
+# generation and every worker attaches it read-only. This replaces both the
+# snapshot and the per-worker change feed.
+FACE_SHM_NAME = os.getenv('FACE_SHM_NAME', '')
+SHARED_GALLERY_SYNCER = SharedGallerySyncer(
+    FACE_SHM_NAME, FACE_GALLERY, fetch_face_rows, fetch_face_keys,
+    interval=FACE_SYNC_SECONDS,
+    reconcile_interval=GALLERY_SYNC.reconcile_interval,
+    overlap=FACE_SYNC_OVERLAP_SECONDS
+) if FACE_SHM_NAME else None
+
+# The snapshot publisher replaces the per-worker change feed, which would
+# otherwise copy the shared matrix into every worker on its first change
+SNAPSHOT_SYNCER = SnapshotSyncer(
+    FACE_SNAPSHOT_DIR, FACE_GALLERY, fetch_face_rows, fetch_face_keys,
+    interval=FACE_SNAPSHOT_SYNC_SECONDS,
+    reconcile_interval=GALLERY_SYNC.reconcile_interval,
+    overlap=FACE_SYNC_OVERLAP_SECONDS
+) if FACE_SNAPSHOT_DIR and not FACE_SHM_NAME else None
+# Whichever of the two publishes the gallery this process attaches
+GALLERY_PUBLISHER = SHARED_GALLERY_SYNCER or SNAPSHOT_SYNCER
+
+def start_gallery_sync():
+    """Start whichever background gallery syncers are configured"""
+    if SHARED_GALLERY_SYNCER is not None:
+        if FACE_SYNC_SECONDS > 0:
+            SHARED_GALLERY_SYNCER.start()
+        return
+    if SNAPSHOT_SYNCER is not None:
+        if FACE_SNAPSHOT_SYNC_SECONDS > 0:
+            SNAPSHOT_SYNCER.start()
+        return
+    if FACE_SYNC_SECONDS > 0:
+        GALLERY_SYNC.start()
+
+def apply_face_change(key, encoding=None):
+    """Reflect an enrollment (or, without an encoding, a removal) in the gallery
+
+    The face row is already written. A gallery attached to a published
+    snapshot is read-only, so the publisher is asked to pick the change up
+    (at once, when this process is the publisher and its syncer is not
+    running) rather than this worker copying the shared matrix.
+    """
+    if GALLERY_PUBLISHER is not None:
+        GALLERY_PUBLISHER.request_sync(reconcile=encoding is None)
+        if not GALLERY_PUBLISHER.is_alive():
+            GALLERY_PUBLISHER.sync_once(reconcile=encoding is None)
     try:
-        response = supabase.table('student_faces').select('*').execute()
-        for face_data in response.data:
-            # Decode base64 face encoding
-            face_encoding = np.frombuffer(
-                base64.b64decode(face_data['face_encoding']), 
-                dtype=np.float64
-            )
-            KNOWN_FACE_ENCODINGS.append(face_encoding)
-            KNOWN_FACE_NAMES.append(face_data['student_id'])
-        
-        # Load faculty faces
-        faculty_response = supabase.table('faculty_faces').select('*').execute()
-        for face_data in faculty_response.data:
-            face_encoding = np.frombuffer(
-                base64.b64decode(face_data['face_encoding']), 
-                dtype=np.float64
+        if encoding is None:
+            FACE_GALLERY.remove(*key)
+        else:
+            FACE_GALLERY.upsert(*key, encoding)
+    except ReadOnlyGallery:
+        pass
+
+def fetch_marked_keys(date):
+    """Yield the idempotency key of every attendance mark made on `date`"""
+    yield from stored_marked_keys(supabase, ATTENDANCE_TABLES, date, FACE_PAGE_SIZE)
+    # Marks still waiting in the journal are not in Supabase yet
+    yield from ATTENDANCE_JOURNAL.keys_for_date(date)
+
+# Per-student/subject/day counters behind the /api/analytics endpoints;
+# students below ATTENDANCE_DEFAULTER_THRESHOLD percent are defaulters.
+# Each worker only records its own marks, so every worker rebuilds its
+# counters from Supabase every ATTENDANCE_ROLLUP_REBUILD_SECONDS
+ATTENDANCE_ROLLUPS = AttendanceRollups(float(os.getenv('ATTENDANCE_DEFAULTER_THRESHOLD', '75')))
+ATTENDANCE_ROLLUP_REBUILD_SECONDS = float(os.getenv('ATTENDANCE_ROLLUP_REBUILD_SECONDS', '300'))
+
+MARKED_INDEX = MarkedIndex(fetch_marked_keys, int(os.getenv('MARKED_INDEX_MAX_ENTRIES', '200000')))
+
+def already_marked_query(client, user_type, user_id, date, subject_id=None):
+    """Supabase query for an existing mark (sync or async client)"""
+    table_name, id_field = ('student_attendance', 'student_id') if user_type == 'student' \
+        else ('faculty_attendance', 'faculty_id')
+    return marked_query(client, table_name, id_field, user_id, date, subject_id)
+
+def is_already_marked(user_type, user_id, date, subject_id=None, time_slot=None):
+    """Duplicate check from the in-memory index, querying Supabase only when
+    the index cannot answer (not warmed for `date`, or over its size cap)"""
+    key = idempotency_key(user_type, user_id, date, subject_id, time_slot)
+    marked = MARKED_INDEX.is_marked(key, date)
+    if marked is None:
+        marked = bool(already_marked_query(supabase, user_type, user_id, date, subject_id).execute().data) \
+            or ATTENDANCE_JOURNAL.contains(key)
+    return marked
+
+def session_claims(headers=None):
+    """Claims of the request's bearer token, or None when it has none
+
+    ``headers`` default to the current Flask request's.
+    """
+    header = (request.headers if headers is None else headers).get('Authorization', '')
+    if not header.startswith('Bearer '):
+        if AUTH_REQUIRED:
+            raise TokenError('Authentication required')
+        return None
+    return TOKEN_ISSUER.verify(header[len('Bearer '):].strip())
+
+def authorize(user_type, user_id, headers=None):
+    """Make sure a token, if any, belongs to the user being acted on"""
+    claims = session_claims(headers)
+    if claims is not None:
+        if claims.get('user_type') != user_type or str(user_id) not in (claims.get('sub'), claims.get('prn')):
+            raise TokenError('Token does not belong to this user', 403)
+    return claims
+
+def authorize_staff(headers=None):
+    """Make sure a token, if any, belongs to faculty or an admin
+
+    With AUTH_REQUIRED a staff token is mandatory.
+    """
+    claims = session_claims(headers)
+    if claims is not None and claims.get('user_type') not in STAFF_USER_TYPES:
+        raise TokenError('Faculty or admin token required', 403)
+    return claims
+
+def authorize_user_or_staff(user_type, user_id, headers=None):
+    """Make sure a token, if any, belongs to the user being acted on or to staff"""
+    claims = session_claims(headers)
+    if claims is not None and claims.get('user_type') in STAFF_USER_TYPES:
+        return claims
+    return authorize(user_type, user_id, headers)
+
+def authorize_reader(user_type, user_id, headers=None):
+    """One user's records may be read by that user or by staff; reads
+    without a user_id (whole classes) need staff"""
+    if not user_id:
+        return authorize_staff(headers)
+    return authorize_user_or_staff(user_type, user_id, headers)
+
+def password_matches(pwhash, password):
+    """Check a login password against a werkzeug hash, or a bcrypt one
+    written by the web app's sign-up"""
+    if pwhash.startswith('$2'):
+        return bcrypt is not None and bcrypt.checkpw(password.encode(), pwhash.encode())
+    return check_password_hash(pwhash, password)
+
+def revoke_token(claims):
+    """Revoke locally and record it so the other workers pick it up"""
+    TOKEN_ISSUER.revoke(claims)
+    supabase.table(REVOKED_TOKENS_TABLE).insert({
+        'jti': claims['jti'],
+        'expires_at': datetime.utcfromtimestamp(claims['exp']).isoformat() + 'Z'
+    }).execute()
+
+def sync_revocations():
+    """Periodically pull revocations made by other workers"""
+    while True:
+        try:
+            response = supabase.table(REVOKED_TOKENS_TABLE).select('jti, expires_at') \
+                .gt('expires_at', datetime.utcnow().isoformat() + 'Z').execute()
+            TOKEN_ISSUER.revoked.update(
+                (row['jti'], datetime.fromisoformat(row['expires_at'].replace('Z', '+00:00')).timestamp())
+                for row in response.data
             )
-            KNOWN_FACE_ENCODINGS.append(face_encoding)
-            KNOWN_FACE_NAMES.append(face_data['faculty_id'])
+        except Exception as e:
+            print(f"Error syncing revoked tokens: {e}")
+        time.sleep(REVOCATION_SYNC_SECONDS)
+
+def journal_mark(attendance_data):
+    """Journal one mark and update the in-memory views of it
+
+    Returns False when the same mark was already journaled.
+    """
+    user_type, user_id, today = attendance_data['user_type'], attendance_data['user_id'], attendance_data['date']
+    subject_id, time_slot = attendance_data['subject_id'], attendance_data['time_slot']
+    table = 'student_attendance' if user_type == 'student' else 'faculty_attendance'
+    key = idempotency_key(user_type, user_id, today, subject_id, time_slot)
+    added = ATTENDANCE_JOURNAL.append(table, attendance_data, key)
+    MARKED_INDEX.add(key, today)
+    if added and user_type == 'student':
+        ATTENDANCE_ROLLUPS.record(user_id, subject_id, today, time_slot, key)
+    return added
+
+def load_known_faces():
+    """Load known faces, from the on-disk snapshot when there is one"""
+    try:
+        # Attach the host's shared gallery (publishing it first if this
+        # process is the publisher)
+        if SHARED_GALLERY_SYNCER is not None:
+            SHARED_GALLERY_SYNCER.sync_once()
+            if SHARED_GALLERY_SYNCER.attached_generation:
+                return
+        
+        # Bring the snapshot up to date and map it; only fall back to a full
+        # download when no snapshot could be attached
+        if SNAPSHOT_SYNCER is not None:
+            SNAPSHOT_SYNCER.sync_once()
+            if SNAPSHOT_SYNCER.attached_version:
+                return
+        
+        keys = []
+        encodings = []
+        watermark = None
+        skipped = 0
+        for key, face_encoding, updated_at in checked_rows(fetch_face_rows(), FACE_GALLERY.dim):
+            if face_encoding is None:
+                skipped += 1
+            else:
+                keys.append(key)
+                encodings.append(face_encoding)
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+        if skipped:
+            print(f"Skipped {skipped} unusable face rows")
+        GALLERY_SYNC.rows_skipped += skipped
+        
+        # Copy everything into the gallery matrix in one go
+        FACE_GALLERY.load(keys, encodings)
+        GALLERY_SYNC.prime(watermark)
             
     except Exception as e:
         print(f"Error loading known faces: {e}")
@@ -63,116 +581,374 @@ def load_known_faces():
 def verify_geo_location(latitude, longitude):
     """Verify if user is within campus boundaries"""
     try:
-        # Calculate distance from campus center
-        user_coords = (latitude, longitude)
-        campus_coords = (CAMPUS_CENTER['latitude'], CAMPUS_CENTER['longitude'])
-        
-        distance = geopy.distance.geodesic(user_coords, campus_coords).meters
-        
-        return {
-            'is_within_campus': distance <= CAMPUS_CENTER['radius_meters'],
-            'distance': distance,
-            'campus_radius': CAMPUS_CENTER['radius_meters']
-        }
+        # Grid lookup plus haversine/point-in-polygon against nearby fences
+        with STAGE_SECONDS.time(stage='geofence'):
+            result = GEOFENCE.locate(float(latitude), float(longitude))
+        result['campus_radius'] = CAMPUS_CENTER['radius_meters']
+        GEOFENCE_RESULTS.inc(outcome='inside' if result['is_within_campus'] else 'outside')
+        return result
     except Exception as e:
         print(f"Error verifying geo-location: {e}")
+        GEOFENCE_RESULTS.inc(outcome='error')
         return {'is_within_campus': False, 'distance': 0, 'campus_radius': CAMPUS_CENTER['radius_meters']}
 
-def recognize_face(image_data):
-    """Recognize face from image data"""
+# Errors that endpoints let through to their app-level error handlers
+PASSTHROUGH_ERRORS = (EngineBusy, ImageRejected, TokenError)
+
+def get_image_bytes(data, field):
+    """Image bytes from a multipart upload, raw image body or base64 data URL"""
+    with STAGE_SECONDS.time(stage='image_read'):
+        return read_image_bytes(request, data, field, MAX_IMAGE_BYTES, MAX_IMAGE_SIDE)
+
+def observe_engine_timings(timings):
+    """Feed the engine's own per-stage timings into the stage histogram"""
+    for name, ms in timings.items():
+        if name != 'total_ms':
+            STAGE_SECONDS.observe(ms / 1000, stage='engine_' + name[:-3])
+
+def encode_faces(image_bytes, detect_short_side=None):
+    """Return the encodings of every face in an encoded image"""
+    result = FACE_ENGINE.run(image_bytes, 'encode', detect_short_side)
+    observe_engine_timings(result['timings'])
+    return result['encodings']
+
+def recognize_face(image_bytes, candidates=None):
+    """Recognize face from image data
+
+    With a RosterIndex as ``candidates`` only that class session's students
+    are searched, plus the whole gallery afterwards if FACE_ROSTER_FALLBACK
+    is set.
+    """
     try:
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert BGR to RGB
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Find faces in the image
-        face_locations = face_recognition.face_locations(rgb_image)
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        face_encodings = encode_faces(image_bytes)
         
         if not face_encodings:
+            FACE_RESULTS.inc(function='recognize', outcome='no_face')
             return {'success': False, 'message': 'No face detected in image'}
         
-        # Check each face found
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(KNOWN_FACE_ENCODINGS, face_encoding, tolerance=0.6)
-            
-            if True in matches:
-                first_match_index = matches.index(True)
-                user_id = KNOWN_FACE_NAMES[first_match_index]
-                
-                # Calculate face distance for confidence
-                face_distances = face_recognition.face_distance(KNOWN_FACE_ENCODINGS, face_encoding)
-                confidence = 1 - face_distances[first_match_index]
-                
+        # Match every face found against the candidates in a single pass and
+        # keep the nearest identity for each
+        matches = []
+        if candidates is not None:
+            with STAGE_SECONDS.time(stage='roster_match'):
+                matches = candidates.match_many(face_encodings, FACE_RECOGNITION_TOLERANCE)
+        if candidates is None or (FACE_ROSTER_FALLBACK and not any(match['matched'] for match in matches)):
+            with STAGE_SECONDS.time(stage='gallery_match'):
+                matches = FACE_GALLERY.match_many(face_encodings, FACE_RECOGNITION_TOLERANCE)
+        for match in matches:
+            if match['matched']:
+                FACE_RESULTS.inc(function='recognize', outcome='matched')
                 return {
                     'success': True,
-                    'user_id': user_id,
-                    'confidence': float(confidence),
+                    'user_id': match['user_id'],
+                    'confidence': 1 - match['distance'],
+                    'margin': match['margin'],
                     'message': 'Face recognized successfully'
                 }
         
+        FACE_RESULTS.inc(function='recognize', outcome='no_match')
         return {'success': False, 'message': 'Face not recognized'}
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error recognizing face: {e}")
+        FACE_RESULTS.inc(function='recognize', outcome='error')
+        return {'success': False, 'message': f'Error processing image: {str(e)}'}
+
+def impostor_check(user_type, user_id, face_encoding, claimed_distance):
+    """Warn when a verified probe is nearer to another enrolled identity"""
+    try:
+        match = FACE_GALLERY.match(face_encoding, FACE_RECOGNITION_TOLERANCE)
+        key = (match['user_type'], match['user_id'])
+        if match['matched'] and key != (user_type, user_id) and match['distance'] < claimed_distance:
+            print(
+                f"Possible impostor: {user_type} {user_id} verified at {claimed_distance:.3f} "
+                f"but nearest face is {key[0]} {key[1]} at {match['distance']:.3f}"
+            )
+    except Exception as e:
+        print(f"Error in impostor check: {e}")
+
+def verify_face(image_bytes, user_type, user_id):
+    """Verify that the image shows the claimed user (1:1 match)"""
+    try:
+        face_encodings = encode_faces(image_bytes)
+        
+        if not face_encodings:
+            FACE_RESULTS.inc(function='verify', outcome='no_face')
+            return {'success': False, 'message': 'No face detected in image'}
+        
+        key = face_key(user_type, user_id)
+        with STAGE_SECONDS.time(stage='gallery_verify'):
+            result = FACE_GALLERY.verify(*key, face_encodings, FACE_VERIFY_TOLERANCE)
+        if not result['enrolled']:
+            FACE_RESULTS.inc(function='verify', outcome='not_enrolled')
+            return {'success': False, 'message': 'No face registered for this user'}
+        if not result['verified']:
+            FACE_RESULTS.inc(function='verify', outcome='no_match')
+            return {'success': False, 'message': 'Face does not match registered user'}
+        
+        if FACE_IMPOSTOR_CHECK:
+            IMPOSTOR_CHECK_EXECUTOR.submit(
+                impostor_check, *key, face_encodings[result['probe_index']], result['distance']
+            )
+        
+        FACE_RESULTS.inc(function='verify', outcome='matched')
+        return {
+            'success': True,
+            'user_id': user_id,
+            'confidence': 1 - result['distance'],
+            'message': 'Face verified successfully'
+        }
+        
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error verifying face: {e}")
+        FACE_RESULTS.inc(function='verify', outcome='error')
         return {'success': False, 'message': f'Error processing image: {str(e)}'}
 
+def match_burst(frames, user_type, user_id, match_mode, candidates=None):
+    """Match the frames of a burst sharpest first until one is confident
+
+    Frames are ordered by ``frame_quality`` and matched one at a time, so
+    a sharp first frame costs a single encode. A frame is confident when it
+    verifies at least FACE_BURST_MIN_MARGIN inside FACE_VERIFY_TOLERANCE, or
+    in identify mode when it is the claimed user by at least that margin
+    over the runner-up. Without a confident frame the closest passing one
+    is used. Returns the face result with ``frame_index`` plus the number
+    of frames consumed.
+    """
+    with STAGE_SECONDS.time(stage='frame_quality'):
+        scores = [frame_quality(frame)['score'] for frame in frames]
+    order = sorted(range(len(frames)), key=lambda index: scores[index], reverse=True)
+
+    best = None
+    face_result = {'success': False, 'message': 'No face detected in image'}
+    consumed = 0
+    confident = False
+    for index in order:
+        consumed += 1
+        if match_mode == 'identify':
+            with STAGE_SECONDS.time(stage='recognize'):
+                face_result = recognize_face(frames[index], candidates)
+            if face_result['success'] and face_result['user_id'] != user_id:
+                face_result = {'success': False, 'message': 'Face does not match registered user'}
+            margin = face_result.get('margin')
+            confident = face_result['success'] and (margin is None or margin >= FACE_BURST_MIN_MARGIN)
+        else:
+            with STAGE_SECONDS.time(stage='verify'):
+                face_result = verify_face(frames[index], user_type, user_id)
+            if not face_result['success'] and face_result['message'] == 'No face registered for this user':
+                break
+            confident = face_result['success'] and (
+                FACE_VERIFY_TOLERANCE - (1 - face_result['confidence']) >= FACE_BURST_MIN_MARGIN
+            )
+        if face_result['success'] and (best is None or face_result['confidence'] > best['confidence']):
+            best = dict(face_result, frame_index=index)
+        if confident:
+            break
+
+    outcome = 'confident' if confident else 'accepted' if best is not None else 'rejected'
+    FACE_RESULTS.inc(function='burst', outcome=outcome)
+    BURST_FRAMES.observe(consumed, outcome=outcome)
+    return best or face_result, consumed
+
+def fetch_class_roster(subject_id, time_slot):
+    """Student ids enrolled in a subject/time slot"""
+    query = supabase.table(CLASS_ROSTER_TABLE).select('student_id').eq('subject_id', subject_id)
+    if time_slot:
+        query = query.eq('time_slot', time_slot)
+    return [row['student_id'] for row in query.execute().data]
+
+# Per class session candidate sets for identify-mode matching; an empty
+# roster means the whole gallery is searched
+ROSTER_INDEXES = RosterIndexes(
+    FACE_GALLERY, fetch_class_roster,
+    max_sessions=int(os.getenv('FACE_ROSTER_MAX_SESSIONS', '256')),
+    ttl=float(os.getenv('FACE_ROSTER_TTL', '900'))
+)
+
+def session_candidates(user_type, subject_id, time_slot):
+    """RosterIndex to search for a student's mark, or None for the whole gallery"""
+    if not (FACE_ROSTER_INDEXES and user_type == 'student' and subject_id):
+        return None
+    try:
+        return ROSTER_INDEXES.get(subject_id, time_slot)
+    except Exception as e:
+        print(f"Error loading class roster: {e}")
+        return None
+
+def rebuild_rollups():
+    """Recompute the attendance rollups from the whole student history"""
+    pending = ATTENDANCE_JOURNAL.pending_payloads('student_attendance')
+    recent_since = min([row['date'] for row in pending] + [datetime.now().strftime('%Y-%m-%d')])
+    history = iter_rows(
+        lambda select: supabase.table('student_attendance').select(select),
+        ['student_id', 'subject_id', 'date', 'time_slot', 'idempotency_key'],
+        ATTENDANCE_EXPORT_PAGE_SIZE
+    )
+    # Journaled marks carry the student in user_id (see attendance_journal.table_row)
+    history = (dict(row, user_id=row['student_id']) for row in history)
+    ATTENDANCE_ROLLUPS.rebuild(itertools.chain(history, pending), recent_since)
+
+def resolve_class_photo(face_encodings, roster, candidates=None):
+    """Assign faces in a class photo to roster students
+
+    Every face is matched against the roster (or its prebuilt RosterIndex)
+    in one vectorized call. A face is ambiguous when its best and
+    second-best students are within FACE_MIN_MARGIN of each other, or when
+    another face claimed the same student with a smaller distance.
+    """
+    if candidates is not None:
+        matches = candidates.match_many(face_encodings, FACE_RECOGNITION_TOLERANCE)
+    else:
+        roster_keys = [('student', student_id) for student_id in roster]
+        matches = FACE_GALLERY.match_subset(face_encodings, roster_keys, FACE_RECOGNITION_TOLERANCE)
+    
+    best_face = {}
+    ambiguous = []
+    unknown_faces = 0
+    for face_index, match in enumerate(matches):
+        if not match['matched']:
+            unknown_faces += 1
+            continue
+        if match['margin'] is not None and match['margin'] < FACE_MIN_MARGIN:
+            ambiguous.append({'face_index': face_index, 'user_id': match['user_id'], 'margin': match['margin']})
+            continue
+        current = best_face.get(match['user_id'])
+        if current is None or match['distance'] < matches[current]['distance']:
+            if current is not None:
+                ambiguous.append({'face_index': current, 'user_id': match['user_id'], 'margin': None})
+            best_face[match['user_id']] = face_index
+        else:
+            ambiguous.append({'face_index': face_index, 'user_id': match['user_id'], 'margin': None})
+    
+    recognized = [
+        {'user_id': user_id, 'face_index': face_index, 'confidence': 1 - matches[face_index]['distance']}
+        for user_id, face_index in best_face.items()
+    ]
+    missing = [student_id for student_id in roster if student_id not in best_face]
+    return recognized, ambiguous, missing, unknown_faces
+
+@app.errorhandler(ImageRejected)
+def image_rejected(e):
+    """Report unusable uploads"""
+    return jsonify({'success': False, 'message': str(e)}), e.status_code
+
+@app.errorhandler(TokenError)
+def token_error(e):
+    """Reject requests with a bad or missing session token"""
+    return jsonify({'success': False, 'message': str(e)}), e.status_code
+
+@app.errorhandler(Shed)
+@app.errorhandler(EngineBusy)
+def engine_busy(e):
+    """Shed load when the face engine or an admission lane is full"""
+    response = jsonify({'success': False, 'message': str(e)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.before_request
+def start_request_timer():
+    """Start collecting stage timings for this request"""
+    request.metrics_started = time.perf_counter()
+    request.metrics_token = start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe request latency and optionally expose its stage timings"""
+    started = getattr(request, 'metrics_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    stages = end_request(request.metrics_token)
+    if request.endpoint != 'metrics':
+        HTTP_SECONDS.observe(
+            elapsed, endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code
+        )
+    if METRICS_TIMING_HEADER:
+        response.headers['Server-Timing'] = server_timing(stages, elapsed)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'Attendance API is running'})
 
+@app.route('/api/engine-stats', methods=['GET'])
+def engine_stats():
+    """Queue depth, rejections and per-stage timings of the face engine, and
+    the admission lanes' queue depths and shed counts"""
+    return jsonify({'success': True, 'data': {
+        **FACE_ENGINE.status(),
+        'roster_indexes': ROSTER_INDEXES.stats(),
+        'admission': ADMISSION.stats()
+    }})
+
+@app.route('/api/gallery-stats', methods=['GET'])
+def gallery_stats():
+    """Gallery size and how far the face change feed is behind"""
+    if SHARED_GALLERY_SYNCER is not None:
+        return jsonify({'success': True, 'data': {'shared_memory': SHARED_GALLERY_SYNCER.stats()}})
+    if SNAPSHOT_SYNCER is not None and FACE_GALLERY.shared:
+        return jsonify({'success': True, 'data': {'snapshot': SNAPSHOT_SYNCER.stats()}})
+    return jsonify({'success': True, 'data': GALLERY_SYNC.stats()})
+
+@app.route('/api/journal-stats', methods=['GET'])
+def journal_stats():
+    """Pending attendance rows and how far the Supabase flush is behind"""
+    return jsonify({'success': True, 'data': {**ATTENDANCE_JOURNAL.stats(), 'marked_index': MARKED_INDEX.stats()}})
+
 @app.route('/detect_face', methods=['POST'])
+@admitted('detect')
 def detect_face():
     """Detect if a face is present in the image"""
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_fields(request)
+        image_bytes = get_image_bytes(data, 'image')
         
-        if not image_data:
-            return jsonify({'face_detected': False, 'message': 'No image provided'})
-        
-        # Process image
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Detect faces
-        face_locations = face_recognition.face_locations(rgb_image)
+        # Detect faces on the engine's worker processes
+        result = FACE_ENGINE.run(image_bytes, 'detect')
+        observe_engine_timings(result['timings'])
+        face_locations = result['locations']
         
         return jsonify({
             'face_detected': len(face_locations) > 0,
             'face_count': len(face_locations)
         })
         
+    except ImageRejected as e:
+        return jsonify({'face_detected': False, 'message': str(e)})
+    except EngineBusy:
+        raise
     except Exception as e:
         print(f"Error detecting face: {e}")
         return jsonify({'face_detected': False, 'message': f'Error: {str(e)}'})
 
 @app.route('/register_face', methods=['POST'])
+@admitted('enroll')
 def register_face_endpoint():
     """Register a new face for a user"""
     try:
-        data = request.get_json()
+        data = request_fields(request)
         user_id = data.get('user_id')
         user_type = data.get('user_type')  # 'student' or 'faculty'
-        image_data = data.get('image')
         
-        if not all([user_id, user_type, image_data]):
+        if not all([user_id, user_type]):
             return jsonify({'success': False, 'message': 'Missing required fields'})
+
+        # Users enroll their own face; staff may enroll anyone
+        authorize_user_or_staff(user_type, user_id)
         
         # Process image and get face encoding
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        face_encodings = face_recognition.face_encodings(rgb_image)
+        face_encodings = encode_faces(get_image_bytes(data, 'image'))
         
         if not face_encodings:
             return jsonify({'success': False, 'message': 'No face detected in image'})
@@ -180,9 +956,8 @@ def register_face_endpoint():
         # Use the first face found
         face_encoding = face_encodings[0]
         
-        # Convert to base64 for storage
-        encoding_bytes = face_encoding.tobytes()
-        encoding_base64 = base64.b64encode(encoding_bytes).decode('utf-8')
+        # Store in the compact versioned text format
+        encoding_base64 = face_codec.encode_face_encoding(face_encoding, FACE_ENCODING_FORMAT)
         
         # Store in Supabase
         table_name = 'student_faces' if user_type == 'student' else 'faculty_faces'
@@ -204,8 +979,8 @@ def register_face_endpoint():
             # Insert new
             supabase.table(table_name).insert(face_data).execute()
         
-        # Reload known faces
-        load_known_faces()
+        # Apply just this enrollment to the in-memory gallery
+        apply_face_change(face_key(user_type, user_id), face_encoding)
         
         return jsonify({
             'success': True,
@@ -213,29 +988,29 @@ def register_face_endpoint():
             'user_name': user_id
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error registering face: {e}")
         return jsonify({'success': False, 'message': f'Error registering face: {str(e)}'})
 
 @app.route('/api/register-face', methods=['POST'])
+@admitted('enroll')
 def register_face():
     """Register a new face for a user (legacy endpoint)"""
     try:
-        data = request.get_json()
+        data = request_fields(request)
         user_id = data.get('user_id')
         user_type = data.get('user_type')  # 'student' or 'faculty'
-        image_data = data.get('image_data')
         
-        if not all([user_id, user_type, image_data]):
+        if not all([user_id, user_type]):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+
+        # Users enroll their own face; staff may enroll anyone
+        authorize_user_or_staff(user_type, user_id)
         
         # Process image and get face encoding
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        face_encodings = face_recognition.face_encodings(rgb_image)
+        face_encodings = encode_faces(get_image_bytes(data, 'image_data'))
         
         if not face_encodings:
             return jsonify({'success': False, 'message': 'No face detected in image'}), 400
@@ -243,9 +1018,8 @@ def register_face():
         # Use the first face found
         face_encoding = face_encodings[0]
         
-        # Convert to base64 for storage
-        encoding_bytes = face_encoding.tobytes()
-        encoding_base64 = base64.b64encode(encoding_bytes).decode('utf-8')
+        # Store in the compact versioned text format
+        encoding_base64 = face_codec.encode_face_encoding(face_encoding, FACE_ENCODING_FORMAT)
         
         # Store in Supabase
         table_name = 'student_faces' if user_type == 'student' else 'faculty_faces'
@@ -267,34 +1041,116 @@ def register_face():
             # Insert new
             supabase.table(table_name).insert(face_data).execute()
         
-        # Reload known faces
-        load_known_faces()
+        # Apply just this enrollment to the in-memory gallery
+        apply_face_change(face_key(user_type, user_id), face_encoding)
         
         return jsonify({
             'success': True,
             'message': 'Face registered successfully'
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
         print(f"Error registering face: {e}")
         return jsonify({'success': False, 'message': f'Error registering face: {str(e)}'}), 500
 
+@app.route('/api/delete-face', methods=['POST'])
+def delete_face():
+    """Remove a user's registered face"""
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        user_type = data.get('user_type')
+        
+        if not all([user_id, user_type]):
+            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        authorize_staff()
+        
+        table_name = 'student_faces' if user_type == 'student' else 'faculty_faces'
+        id_field = 'student_id' if user_type == 'student' else 'faculty_id'
+        supabase.table(table_name).delete().eq(id_field, user_id).execute()
+        
+        key = face_key(user_type, user_id)
+        removed = key in FACE_GALLERY
+        apply_face_change(key)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Face removed successfully' if removed else 'No face registered for user'
+        })
+        
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error deleting face: {e}")
+        return jsonify({'success': False, 'message': f'Error deleting face: {str(e)}'}), 500
+
+def record_mark(user_id, user_type, latitude, longitude, subject_id, time_slot, face_result, geo_verified,
+                extra=None):
+    """Journal a mark whose face and location checks passed; returns the response
+
+    ``extra`` is merged into the response's ``data``.
+    """
+    # Check if attendance already marked for today
+    today = datetime.now().strftime('%Y-%m-%d')
+    with STAGE_SECONDS.time(stage='duplicate_check'):
+        already_marked = is_already_marked(user_type, user_id, today, subject_id, time_slot)
+    if already_marked:
+        return jsonify({'success': False, 'message': 'Attendance already marked for today'}), 400
+    
+    # Mark attendance
+    attendance_data = {
+        'user_id': user_id,
+        'user_type': user_type,
+        'date': today,
+        'time': datetime.now().strftime('%H:%M:%S'),
+        'latitude': latitude,
+        'longitude': longitude,
+        'face_confidence': face_result['confidence'],
+        'geo_verified': geo_verified,
+        'subject_id': subject_id,
+        'time_slot': time_slot
+    }
+    
+    # Journal the mark; the background flusher stores it in the
+    # appropriate table
+    with STAGE_SECONDS.time(stage='journal_append'):
+        added = journal_mark(attendance_data)
+    if not added:
+        return jsonify({'success': False, 'message': 'Attendance already marked for today'}), 400
+
+    return jsonify({
+        'success': True,
+        'message': 'Attendance marked successfully',
+        'data': {
+            'date': today,
+            'time': attendance_data['time'],
+            'confidence': face_result['confidence'],
+            'geo_verified': attendance_data['geo_verified'],
+            **(extra or {})
+        }
+    })
+
 @app.route('/api/mark-attendance', methods=['POST'])
+@admitted('mark')
 def mark_attendance():
     """Mark attendance for a user"""
     try:
-        data = request.get_json()
+        data = request_fields(request)
         user_id = data.get('user_id')
         user_type = data.get('user_type')
-        image_data = data.get('image_data')
         latitude = data.get('latitude')
         longitude = data.get('longitude')
         subject_id = data.get('subject_id')  # For students
         time_slot = data.get('time_slot')    # For students
         date = data.get('date')
+        match_mode = data.get('match_mode', FACE_MATCH_MODE)
         
-        if not all([user_id, user_type, image_data, date]):
+        if not all([user_id, user_type, date]):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        authorize(user_type, user_id)
+        image_bytes = get_image_bytes(data, 'image_data')
         
         # Verify geo-location
         if latitude and longitude:
@@ -305,94 +1161,401 @@ def mark_attendance():
                     'message': f'You are outside campus area. Distance: {geo_result["distance"]:.0f}m from campus center.'
                 }), 400
         
-        # Recognize face
-        face_result = recognize_face(image_data)
+        if match_mode == 'identify':
+            # Recognize face against the whole gallery
+            candidates = session_candidates(user_type, subject_id, time_slot)
+            with STAGE_SECONDS.time(stage='recognize'):
+                face_result = recognize_face(image_bytes, candidates)
+            if not face_result['success']:
+                return jsonify({'success': False, 'message': face_result['message']}), 400
+            
+            # Verify user ID matches
+            if face_result['user_id'] != user_id:
+                return jsonify({'success': False, 'message': 'Face does not match registered user'}), 400
+        else:
+            # Compare only against the claimed user's registered face
+            with STAGE_SECONDS.time(stage='verify'):
+                face_result = verify_face(image_bytes, user_type, user_id)
+            if not face_result['success']:
+                return jsonify({'success': False, 'message': face_result['message']}), 400
+        
+        return record_mark(
+            user_id, user_type, latitude, longitude, subject_id, time_slot, face_result,
+            geo_result['is_within_campus'] if latitude and longitude else True
+        )
+        
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error marking attendance: {e}")
+        return jsonify({'success': False, 'message': f'Error marking attendance: {str(e)}'}), 500
+
+@app.route('/api/mark-attendance-burst', methods=['POST'])
+@admitted('mark')
+def mark_attendance_burst():
+    """Mark attendance from a short burst of frames
+
+    Takes the fields of /api/mark-attendance with up to MAX_BURST_FRAMES
+    images in ``frames`` (repeated multipart files or a JSON list of data
+    URLs). Frames are matched sharpest first and matching stops at the
+    first confident one (see match_burst), so a blurry frame no longer
+    costs the client a retry round-trip.
+    """
+    try:
+        data = request_fields(request)
+        user_id = data.get('user_id')
+        user_type = data.get('user_type')
+        latitude = data.get('latitude')
+        longitude = data.get('longitude')
+        subject_id = data.get('subject_id')
+        time_slot = data.get('time_slot')
+        date = data.get('date')
+        match_mode = data.get('match_mode', FACE_MATCH_MODE)
+        
+        if not all([user_id, user_type, date]):
+            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        authorize(user_type, user_id)
+        with STAGE_SECONDS.time(stage='image_read'):
+            frames = read_burst_frames(
+                request, data, 'frames', MAX_BURST_FRAMES, MAX_IMAGE_BYTES, MAX_IMAGE_SIDE, MAX_BURST_BYTES
+            )
+        
+        # Verify geo-location before spending any face work
+        if latitude and longitude:
+            geo_result = verify_geo_location(latitude, longitude)
+            if not geo_result['is_within_campus']:
+                return jsonify({
+                    'success': False,
+                    'message': f'You are outside campus area. Distance: {geo_result["distance"]:.0f}m from campus center.'
+                }), 400
+        
+        candidates = session_candidates(user_type, subject_id, time_slot) if match_mode == 'identify' else None
+        face_result, consumed = match_burst(frames, user_type, user_id, match_mode, candidates)
+        burst = {'frames_received': len(frames), 'frames_consumed': consumed}
         if not face_result['success']:
-            return jsonify({'success': False, 'message': face_result['message']}), 400
+            return jsonify({'success': False, 'message': face_result['message'], 'data': burst}), 400
         
-        # Verify user ID matches
-        if face_result['user_id'] != user_id:
-            return jsonify({'success': False, 'message': 'Face does not match registered user'}), 400
+        return record_mark(
+            user_id, user_type, latitude, longitude, subject_id, time_slot, face_result,
+            geo_result['is_within_campus'] if latitude and longitude else True,
+            dict(burst, frame_index=face_result['frame_index'])
+        )
         
-        # Check if attendance already marked for today
-        today = datetime.now().strftime('%Y-%m-%d')
+    except PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error marking attendance from burst: {e}")
+        return jsonify({'success': False, 'message': f'Error marking attendance: {str(e)}'}), 500
+
+@app.route('/api/mark-class-attendance', methods=['POST'])
+@admitted('mark')
+def mark_class_attendance():
+    """Mark attendance for every recognized student in one classroom photo"""
+    try:
+        data = request_fields(request)
+        subject_id = data.get('subject_id')
+        time_slot = data.get('time_slot')
+        latitude = data.get('latitude')
+        longitude = data.get('longitude')
+        roster = data.get('roster')  # Optional explicit list of student ids
         
-        if user_type == 'student':
-            # Check existing student attendance
-            existing = supabase.table('student_attendance').select('*').eq('student_id', user_id).eq('session_date', today).execute()
-        else:
-            # Check existing faculty attendance
-            existing = supabase.table('faculty_attendance').select('*').eq('faculty_id', user_id).eq('session_date', today).execute()
+        if not all([subject_id, time_slot]):
+            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        authorize_staff()
+        image_bytes = get_image_bytes(data, 'image_data')
+        if isinstance(roster, str):
+            # Form uploads send the roster as a comma-separated list
+            roster = [student_id for student_id in roster.split(',') if student_id]
         
-        if existing.data:
-            return jsonify({'success': False, 'message': 'Attendance already marked for today'}), 400
+        # Verify geo-location of the faculty device
+        geo_verified = True
+        if latitude and longitude:
+            geo_result = verify_geo_location(latitude, longitude)
+            if not geo_result['is_within_campus']:
+                return jsonify({
+                    'success': False,
+                    'message': f'You are outside campus area. Distance: {geo_result["distance"]:.0f}m from campus center.'
+                }), 400
+            geo_verified = geo_result['is_within_campus']
         
-        # Mark attendance
-        attendance_data = {
-            'user_id': user_id,
-            'user_type': user_type,
+        candidates = None
+        if roster is None:
+            candidates = ROSTER_INDEXES.get(subject_id, time_slot)
+            roster = candidates.roster if candidates is not None else []
+        if not roster:
+            return jsonify({'success': False, 'message': 'No students found for this class'}), 400
+        
+        # Detect and encode every face in the photo once
+        face_encodings = encode_faces(image_bytes, CLASS_PHOTO_DETECT_SHORT_SIDE)
+        if not face_encodings:
+            return jsonify({'success': False, 'message': 'No face detected in image'}), 400
+        
+        recognized, ambiguous, missing, unknown_faces = resolve_class_photo(face_encodings, roster, candidates)
+        
+        # Skip students who already have attendance for this class today
+        today = datetime.now().strftime('%Y-%m-%d')
+        already_marked = []
+        if recognized:
+            marked = {
+                r['user_id']: MARKED_INDEX.is_marked(
+                    idempotency_key('student', r['user_id'], today, subject_id, time_slot), today
+                ) for r in recognized
+            }
+            marked_ids = {student_id for student_id, is_marked in marked.items() if is_marked}
+            unknown = [student_id for student_id, is_marked in marked.items() if is_marked is None]
+            if unknown:
+                # Index not warmed or over its cap: ask Supabase in one query
+                existing = supabase.table('student_attendance').select('student_id') \
+                    .in_('student_id', unknown) \
+                    .eq('date', today).eq('subject_id', subject_id).execute()
+                marked_ids.update(row['student_id'] for row in existing.data)
+            already_marked = [r['user_id'] for r in recognized if r['user_id'] in marked_ids]
+            recognized = [r for r in recognized if r['user_id'] not in marked_ids]
+        
+        # Insert every new row in a single round-trip
+        now = datetime.now().strftime('%H:%M:%S')
+        rows = [{
+            'user_id': r['user_id'],
+            'user_type': 'student',
             'date': today,
-            'time': datetime.now().strftime('%H:%M:%S'),
+            'time': now,
             'latitude': latitude,
             'longitude': longitude,
-            'face_confidence': face_result['confidence'],
-            'geo_verified': geo_result['is_within_campus'] if latitude and longitude else True,
+            'face_confidence': r['confidence'],
+            'geo_verified': geo_verified,
             'subject_id': subject_id,
             'time_slot': time_slot
-        }
-        
-        # Store in appropriate table
-        if user_type == 'student':
-            supabase.table('student_attendance').insert(attendance_data).execute()
-        else:
-            supabase.table('faculty_attendance').insert(attendance_data).execute()
-        
+        } for r in recognized]
+        if rows:
+            # One journal transaction for the whole class
+            added = ATTENDANCE_JOURNAL.append_many('student_attendance', [
+                (row, idempotency_key('student', row['user_id'], today, subject_id, time_slot)) for row in rows
+            ])
+            already_marked += [r['user_id'] for r, new in zip(recognized, added) if not new]
+            recognized = [r for r, new in zip(recognized, added) if new]
+            rows = [row for row, new in zip(rows, added) if new]
+            for row in rows:
+                key = idempotency_key('student', row['user_id'], today, subject_id, time_slot)
+                MARKED_INDEX.add(key, today)
+                ATTENDANCE_ROLLUPS.record(row['user_id'], subject_id, today, time_slot, key)
+
         return jsonify({
             'success': True,
-            'message': 'Attendance marked successfully',
+            'message': f'Attendance marked for {len(rows)} students',
             'data': {
                 'date': today,
-                'time': attendance_data['time'],
-                'confidence': face_result['confidence'],
-                'geo_verified': attendance_data['geo_verified']
+                'time': now,
+                'faces_detected': len(face_encodings),
+                'recognized': recognized,
+                'already_marked': already_marked,
+                'ambiguous': ambiguous,
+                'missing': missing,
+                'unknown_faces': unknown_faces
             }
         })
         
+    except PASSTHROUGH_ERRORS:
+        raise
     except Exception as e:
-        print(f"Error marking attendance: {e}")
-        return jsonify({'success': False, 'message': f'Error marking attendance: {str(e)}'}), 500
+        print(f"Error marking class attendance: {e}")
+        return jsonify({'success': False, 'message': f'Error marking class attendance: {str(e)}'}), 500
+
+@app.route('/api/geofence/validate', methods=['POST'])
+def validate_geofence():
+    """Check many coordinates against the campus geofences at once (audits)"""
+    try:
+        data = request.get_json()
+        points = data.get('points') or []
+        
+        if not points:
+            return jsonify({'success': False, 'message': 'No points provided'}), 400
+        if len(points) > MAX_GEOFENCE_BATCH:
+            return jsonify({'success': False, 'message': f'At most {MAX_GEOFENCE_BATCH} points per request'}), 400
+        
+        latitudes = np.array([float(point['latitude']) for point in points])
+        longitudes = np.array([float(point['longitude']) for point in points])
+        campus_index, zone_ids, distances = GEOFENCE.locate_many(latitudes, longitudes)
+        
+        results = []
+        for index, zone_id, distance in zip(campus_index.tolist(), zone_ids, distances.tolist()):
+            results.append({
+                'is_within_campus': index >= 0,
+                'campus_id': GEOFENCE.campuses[index].get('id') if index >= 0 else None,
+                'zone_id': zone_id,
+                'distance': distance
+            })
+        
+        return jsonify({
+            'success': True,
+            'data': results,
+            'summary': {
+                'total': len(results),
+                'within_campus': int((campus_index >= 0).sum())
+            }
+        })
+        
+    except ValueError as e:
+        # Unparseable, NaN, infinite or out-of-range coordinates
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error validating geofence: {e}")
+        return jsonify({'success': False, 'message': f'Error validating geofence: {str(e)}'}), 500
+
+def parse_attendance_args(args):
+    """Validated get-attendance parameters; raises ValueError on bad input"""
+    params = {
+        'user_id': args.get('user_id'),
+        'user_type': args.get('user_type', 'student'),
+        'subject_id': args.get('subject_id'),
+        'time_slot': args.get('time_slot'),
+        'date': args.get('date'),
+        'date_from': args.get('from'),
+        'date_to': args.get('to'),
+        'format': args.get('format', 'json'),
+        'cursor': args.get('cursor'),
+    }
+    if not params['user_type'] or not (params['user_id'] or params['subject_id']):
+        raise ValueError('Missing required parameters')
+    if params['format'] not in ('json', 'ndjson', 'csv'):
+        raise ValueError('format must be json, ndjson or csv')
+    params['columns'] = parse_fields(args.get('fields'))
+    for value in (params['date'], params['date_from'], params['date_to']):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+    params['limit'] = min(max(int(args.get('limit', '100')), 1), ATTENDANCE_MAX_PAGE_SIZE)
+    params['table_name'] = 'student_attendance' if params['user_type'] == 'student' else 'faculty_attendance'
+    return params
+
+def filter_attendance(query, params):
+    """Apply get-attendance filters to a (sync or async) PostgREST query"""
+    for column, key in (('user_id', 'user_id'), ('subject_id', 'subject_id'),
+                        ('time_slot', 'time_slot'), ('date', 'date')):
+        if params[key]:
+            query = query.eq(column, params[key])
+    if params['date_from']:
+        query = query.gte('date', params['date_from'])
+    if params['date_to']:
+        query = query.lte('date', params['date_to'])
+    return query
 
 @app.route('/api/get-attendance', methods=['GET'])
 def get_attendance():
-    """Get attendance records for a user"""
+    """Get attendance records for a user or a whole class
+
+    Filters: user_id, subject_id, time_slot, date or from/to (inclusive).
+    `fields` projects columns. JSON responses are paged with `limit` and the
+    returned `next_cursor`; format=ndjson or format=csv streams every
+    matching row instead.
+    """
     try:
-        user_id = request.args.get('user_id')
-        user_type = request.args.get('user_type')
-        date = request.args.get('date')
+        try:
+            params = parse_attendance_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        authorize_reader(params['user_type'], params['user_id'])
         
-        if not all([user_id, user_type]):
-            return jsonify({'success': False, 'message': 'Missing required parameters'}), 400
+        columns = params['columns']
         
-        # Get attendance records
-        if user_type == 'student':
-            query = supabase.table('student_attendance').select('*').eq('user_id', user_id)
-        else:
-            query = supabase.table('faculty_attendance').select('*').eq('user_id', user_id)
+        def make_query(select):
+            return filter_attendance(supabase.table(params['table_name']).select(select), params)
         
-        if date:
-            query = query.eq('date', date)
+        if params['format'] != 'json':
+            # Stream pages straight through; nothing is buffered per request
+            rows = iter_rows(make_query, columns, ATTENDANCE_EXPORT_PAGE_SIZE)
+            if params['format'] == 'csv':
+                body, mimetype = csv_lines(rows, columns), 'text/csv'
+            else:
+                body, mimetype = ndjson_lines(rows), 'application/x-ndjson'
+            response = Response(stream_with_context(body), mimetype=mimetype)
+            response.headers['Content-Disposition'] = f"attachment; filename=attendance.{params['format']}"
+            return response
         
-        response = query.execute()
+        rows, next_cursor = fetch_page(make_query, columns, params['limit'], params['cursor'])
         
         return jsonify({
             'success': True,
-            'data': response.data
+            'data': [{column: row.get(column) for column in columns} for row in rows],
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except TokenError:
+        raise
     except Exception as e:
         print(f"Error getting attendance: {e}")
         return jsonify({'success': False, 'message': f'Error getting attendance: {str(e)}'}), 500
 
+@app.route('/api/analytics/student', methods=['GET'])
+def analytics_student():
+    """Attendance percentage of a student in each subject"""
+    try:
+        authorize_staff()
+        student_id = request.args.get('student_id')
+        if not student_id:
+            return jsonify({'success': False, 'message': 'Missing required parameters'}), 400
+        return jsonify({'success': True, 'data': ATTENDANCE_ROLLUPS.student_summary(student_id)})
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error getting student analytics: {e}")
+        return jsonify({'success': False, 'message': f'Error getting student analytics: {str(e)}'}), 500
+
+@app.route('/api/analytics/defaulters', methods=['GET'])
+def analytics_defaulters():
+    """Students of a subject below the attendance threshold"""
+    try:
+        authorize_staff()
+        subject_id = request.args.get('subject_id')
+        if not subject_id:
+            return jsonify({'success': False, 'message': 'Missing required parameters'}), 400
+        threshold = request.args.get('threshold')
+        threshold = float(threshold) if threshold else None
+        # The roster adds students who have not attended a single session
+        roster = fetch_class_roster(subject_id, request.args.get('time_slot'))
+        return jsonify({
+            'success': True,
+            'data': ATTENDANCE_ROLLUPS.defaulters(subject_id, threshold, roster)
+        })
+    except ValueError:
+        return jsonify({'success': False, 'message': 'threshold must be a number'}), 400
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error getting defaulters: {e}")
+        return jsonify({'success': False, 'message': f'Error getting defaulters: {str(e)}'}), 500
+
+@app.route('/api/analytics/trend', methods=['GET'])
+def analytics_trend():
+    """Daily attendance of a subject between `from` and `to`"""
+    try:
+        authorize_staff()
+        subject_id = request.args.get('subject_id')
+        if not subject_id:
+            return jsonify({'success': False, 'message': 'Missing required parameters'}), 400
+        return jsonify({
+            'success': True,
+            'data': ATTENDANCE_ROLLUPS.trend(subject_id, request.args.get('from'), request.args.get('to'))
+        })
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error getting attendance trend: {e}")
+        return jsonify({'success': False, 'message': f'Error getting attendance trend: {str(e)}'}), 500
+
+@app.route('/api/analytics/rebuild', methods=['POST'])
+def analytics_rebuild():
+    """Recompute this worker's rollups from history now"""
+    try:
+        authorize_staff()
+        rebuild_rollups()
+        return jsonify({'success': True, 'data': ATTENDANCE_ROLLUPS.stats()})
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error rebuilding rollups: {e}")
+        return jsonify({'success': False, 'message': f'Error rebuilding rollups: {str(e)}'}), 500
+
 @app.route('/api/subjects', methods=['GET'])
 def get_subjects():
     """Get available subjects for students"""
@@ -439,32 +1602,102 @@ def get_time_slots():
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    """Login endpoint for students using PRN and password"""
+    """Login endpoint for students and faculty using PRN and password"""
     try:
         data = request.get_json()
         prn = data.get('prn')
         password = data.get('password')
+        user_type = data.get('user_type', 'student')
         if not prn or not password:
             return jsonify({'success': False, 'message': 'PRN and password are required'}), 400
+        if user_type not in LOGIN_TABLES:
+            return jsonify({'success': False, 'message': 'user_type must be student or faculty'}), 400
 
-        # Fetch student by PRN from Supabase
-        response = supabase.table('students').select('*').eq('prn', prn).execute()
+        # Fetch the user by PRN from Supabase
+        response = supabase.table(LOGIN_TABLES[user_type]).select('*').eq('prn', prn).execute()
         if not response.data:
             return jsonify({'success': False, 'message': 'Invalid PRN or password'}), 401
-        student = response.data[0]
+        user = response.data[0]
         # Check password (assuming password is stored as a hash in 'password_hash' field)
-        if not check_password_hash(student.get('password_hash', ''), password):
+        if not password_matches(user.get('password_hash') or '', password):
             return jsonify({'success': False, 'message': 'Invalid PRN or password'}), 401
-        # Success: return student info (omit sensitive fields)
-        student_info = {k: v for k, v in student.items() if k not in ['password_hash']}
-        return jsonify({'success': True, 'message': 'Login successful', 'student': student_info})
+        # Success: return user info (omit sensitive fields) and a token pair
+        # so later requests skip the lookup and the password hash. Faculty
+        # tokens carry the staff role
+        user_info = {k: v for k, v in user.items() if k not in ['password_hash']}
+        tokens = TOKEN_ISSUER.issue(user.get('id', prn), user_type, prn=prn)
+        return jsonify({'success': True, 'message': 'Login successful', user_type: user_info, **tokens})
     except Exception as e:
         print(f"Error in login: {e}")
         return jsonify({'success': False, 'message': f'Error during login: {str(e)}'}), 500
 
+@app.route('/api/token/refresh', methods=['POST'])
+def refresh_token():
+    """Exchange a refresh token for a new token pair"""
+    data = request.get_json() or {}
+    if not data.get('refresh_token'):
+        return jsonify({'success': False, 'message': 'refresh_token is required'}), 400
+    claims = TOKEN_ISSUER.verify(data['refresh_token'], 'refresh')
+    # Rotate: the refresh token that was just used stops working
+    try:
+        revoke_token(claims)
+    except Exception as e:
+        print(f"Error recording revoked token: {e}")
+    return jsonify({'success': True, **TOKEN_ISSUER.reissue(claims)})
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    """Revoke the bearer token and, if given, the refresh token"""
+    try:
+        data = request.get_json(silent=True) or {}
+        revoked = []
+        claims = session_claims()
+        if claims is not None:
+            revoked.append(claims)
+        if data.get('refresh_token'):
+            revoked.append(TOKEN_ISSUER.verify(data['refresh_token'], 'refresh'))
+        for token_claims in revoked:
+            revoke_token(token_claims)
+        return jsonify({'success': True, 'message': f'{len(revoked)} token(s) revoked'})
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error in logout: {e}")
+        return jsonify({'success': False, 'message': f'Error during logout: {str(e)}'}), 500
+
+def init_app():
+    """Load the gallery and start this process's background jobs
+
+    Safe to call more than once. Threads do not survive a fork, so every
+    serving process runs it: __main__ below, gunicorn workers from the
+    post_fork hook in gunicorn.conf.py, and async_app.py on startup.
+    """
+    global APP_INITIALIZED
+    with APP_INIT_LOCK:
+        if APP_INITIALIZED:
+            return
+        APP_INITIALIZED = True
+        load_known_faces()
+        print("Known faces loaded:", len(FACE_GALLERY))
+        start_gallery_sync()
+        ATTENDANCE_JOURNAL.start()
+        threading.Thread(target=sync_revocations, daemon=True, name='revocation-sync').start()
+        try:
+            MARKED_INDEX.warm()
+            print("Attendance marks indexed for today:", len(MARKED_INDEX))
+        except Exception as e:
+            print(f"Error warming attendance index: {e}")
+        MARKED_INDEX.start()
+        try:
+            rebuild_rollups()
+            print("Attendance rollups built:", ATTENDANCE_ROLLUPS.stats()['marks'], "marks")
+        except Exception as e:
+            print(f"Error rebuilding rollups: {e}")
+        ATTENDANCE_ROLLUPS.start(rebuild_rollups, ATTENDANCE_ROLLUP_REBUILD_SECONDS)
+
+APP_INITIALIZED = False
+APP_INIT_LOCK = threading.Lock()
+
 if __name__ == '__main__':
-    # Load known faces on startup
-    load_known_faces()
-    print("Known faces loaded:", len(KNOWN_FACE_NAMES))
-    
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    init_app()
+    app.run(debug=True, host='0.0.0.0', port=5000) 
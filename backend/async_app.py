@@ -0,0 +1,346 @@
+"""Asyncio-served variant of the attendance API.
+
+Serves mark-attendance, get-attendance, register-face and login with the
+same request/response contract as app.py, but on one event loop: Supabase
+calls go through an async PostgREST client backed by a pooled keep-alive
+httpx connection pool, and CPU work (face encoding, password hashing, the
+journal fsync) runs on a thread pool, so a single process can hold hundreds
+of requests that are waiting on the database.
+
+    python async_app.py            # or: hypercorn async_app:app --bind 0.0.0.0:5001
+
+Everything else (gallery, engine, journal, indexes, tokens, configuration)
+is shared with app.py, which is imported but not served.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+import app as sync_app
+import face_codec
+from attendance_export import InvalidCursor, afetch_page, aiter_rows, csv_line, ndjson_line
+from encoding_engine import EngineBusy
+from image_input import RAW_IMAGE_TYPES, ImageRejected, read_image_bytes
+from metrics import instrument_httpx
+from session_tokens import TokenError
+
+ASYNC_DB_MAX_CONNECTIONS = int(os.getenv('ASYNC_DB_MAX_CONNECTIONS', '100'))
+ASYNC_DB_MAX_KEEPALIVE = int(os.getenv('ASYNC_DB_MAX_KEEPALIVE', '20'))
+ASYNC_DB_TIMEOUT = float(os.getenv('ASYNC_DB_TIMEOUT', '10'))
+ASYNC_DB_CONNECT_TIMEOUT = float(os.getenv('ASYNC_DB_CONNECT_TIMEOUT', '3'))
+# Threads for blocking work; face encoding itself runs on FACE_ENGINE's
+# process pool, these threads only wait on it
+ASYNC_CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', '32'))
+ASYNC_PORT = int(os.getenv('ASYNC_PORT', '5001'))
+
+CPU_EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix='async-cpu')
+
+
+def pooled_postgrest_client():
+    """Async PostgREST client on a bounded keep-alive connection pool"""
+    limits = httpx.Limits(max_connections=ASYNC_DB_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_DB_MAX_KEEPALIVE)
+    timeout = httpx.Timeout(ASYNC_DB_TIMEOUT, connect=ASYNC_DB_CONNECT_TIMEOUT)
+
+    class PooledClient(AsyncPostgrestClient):
+        def create_session(self, base_url, headers, timeout, verify=True):
+            session = httpx.AsyncClient(
+                base_url=base_url, headers=headers, timeout=timeout, verify=verify,
+                limits=limits, follow_redirects=True
+            )
+            # Same Supabase latency/error metrics as app.py's client
+            return instrument_httpx(session, sync_app.SUPABASE_SECONDS, sync_app.SUPABASE_ERRORS)
+
+    return PooledClient(
+        f'{sync_app.SUPABASE_URL}/rest/v1',
+        headers={'apikey': sync_app.SUPABASE_KEY, 'Authorization': f'Bearer {sync_app.SUPABASE_KEY}'},
+        timeout=timeout
+    )
+
+
+app = cors(Quart(__name__))
+app.config['MAX_CONTENT_LENGTH'] = sync_app.MAX_IMAGE_BYTES * 2
+db = None
+
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(CPU_EXECUTOR, fn, *args)
+
+
+async def request_fields():
+    """Form fields of a JSON body, a multipart form or a raw-body query string"""
+    if request.is_json:
+        return await request.get_json() or {}
+    data = request.args.to_dict()
+    data.update((await request.form).to_dict())
+    return data
+
+
+async def image_payload():
+    """The request's files or raw body, awaited for image_input.read_image_bytes"""
+    payload = {}
+    if request.mimetype == 'multipart/form-data':
+        payload['files'] = await request.files
+    elif request.mimetype in RAW_IMAGE_TYPES and (request.content_length or 0) <= sync_app.MAX_IMAGE_BYTES:
+        payload['body'] = await request.get_data(cache=False)
+    return payload
+
+
+@app.before_serving
+async def startup():
+    global db
+    db = pooled_postgrest_client()
+    # Same warm-up and background jobs as app.py, off the event loop
+    await run_blocking(sync_app.init_app)
+
+
+@app.after_serving
+async def shutdown():
+    await db.aclose()
+
+
+@app.errorhandler(ImageRejected)
+async def image_rejected(e):
+    return jsonify({'success': False, 'message': str(e)}), e.status_code
+
+
+@app.errorhandler(TokenError)
+async def token_error(e):
+    return jsonify({'success': False, 'message': str(e)}), e.status_code
+
+
+@app.errorhandler(EngineBusy)
+async def engine_busy(e):
+    return jsonify({'success': False, 'message': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    return jsonify({'status': 'healthy', 'message': 'Attendance API is running (async)'})
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus metrics (shared registry with app.py)"""
+    return Response(sync_app.METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/mark-attendance', methods=['POST'])
+async def mark_attendance():
+    """Mark attendance for a user"""
+    try:
+        data = await request_fields()
+        user_id = data.get('user_id')
+        user_type = data.get('user_type')
+        latitude = data.get('latitude')
+        longitude = data.get('longitude')
+        subject_id = data.get('subject_id')
+        time_slot = data.get('time_slot')
+        date = data.get('date')
+        match_mode = data.get('match_mode', sync_app.FACE_MATCH_MODE)
+
+        if not all([user_id, user_type, date]):
+            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        sync_app.authorize(user_type, user_id, request.headers)
+        image_bytes = read_image_bytes(
+            request, data, 'image_data', sync_app.MAX_IMAGE_BYTES, sync_app.MAX_IMAGE_SIDE, **await image_payload()
+        )
+
+        geo_verified = True
+        if latitude and longitude:
+            geo_result = sync_app.verify_geo_location(latitude, longitude)
+            if not geo_result['is_within_campus']:
+                return jsonify({
+                    'success': False,
+                    'message': f'You are outside campus area. Distance: {geo_result["distance"]:.0f}m from campus center.'
+                }), 400
+            geo_verified = geo_result['is_within_campus']
+
+        if match_mode == 'identify':
+            candidates = await run_blocking(sync_app.session_candidates, user_type, subject_id, time_slot)
+            face_result = await run_blocking(sync_app.recognize_face, image_bytes, candidates)
+            if not face_result['success']:
+                return jsonify({'success': False, 'message': face_result['message']}), 400
+            if face_result['user_id'] != user_id:
+                return jsonify({'success': False, 'message': 'Face does not match registered user'}), 400
+        else:
+            face_result = await run_blocking(sync_app.verify_face, image_bytes, user_type, user_id)
+            if not face_result['success']:
+                return jsonify({'success': False, 'message': face_result['message']}), 400
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        key = sync_app.idempotency_key(user_type, user_id, today, subject_id, time_slot)
+        marked = sync_app.MARKED_INDEX.is_marked(key, today)
+        if marked is None:
+            existing = await sync_app.already_marked_query(db, user_type, user_id, today, subject_id).execute()
+            marked = bool(existing.data) or sync_app.ATTENDANCE_JOURNAL.contains(key)
+        if marked:
+            return jsonify({'success': False, 'message': 'Attendance already marked for today'}), 400
+
+        attendance_data = {
+            'user_id': user_id,
+            'user_type': user_type,
+            'date': today,
+            'time': datetime.now().strftime('%H:%M:%S'),
+            'latitude': latitude,
+            'longitude': longitude,
+            'face_confidence': face_result['confidence'],
+            'geo_verified': geo_verified,
+            'subject_id': subject_id,
+            'time_slot': time_slot
+        }
+        # The journal append waits for an fsync
+        if not await run_blocking(sync_app.journal_mark, attendance_data):
+            return jsonify({'success': False, 'message': 'Attendance already marked for today'}), 400
+
+        return jsonify({
+            'success': True,
+            'message': 'Attendance marked successfully',
+            'data': {
+                'date': today,
+                'time': attendance_data['time'],
+                'confidence': face_result['confidence'],
+                'geo_verified': geo_verified
+            }
+        })
+
+    except sync_app.PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error marking attendance: {e}")
+        return jsonify({'success': False, 'message': f'Error marking attendance: {str(e)}'}), 500
+
+
+@app.route('/api/get-attendance', methods=['GET'])
+async def get_attendance():
+    """Get attendance records for a user or a whole class (see app.py)"""
+    try:
+        try:
+            params = sync_app.parse_attendance_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        sync_app.authorize_reader(params['user_type'], params['user_id'], request.headers)
+
+        columns = params['columns']
+
+        def make_query(select):
+            return sync_app.filter_attendance(db.table(params['table_name']).select(select), params)
+
+        if params['format'] != 'json':
+            async def body():
+                if params['format'] == 'csv':
+                    yield csv_line(columns)
+                async for row in aiter_rows(make_query, columns, sync_app.ATTENDANCE_EXPORT_PAGE_SIZE):
+                    if params['format'] == 'csv':
+                        yield csv_line([row.get(column) for column in columns])
+                    else:
+                        yield ndjson_line(row)
+
+            mimetype = 'text/csv' if params['format'] == 'csv' else 'application/x-ndjson'
+            return Response(body(), mimetype=mimetype, headers={
+                'Content-Disposition': f"attachment; filename=attendance.{params['format']}"
+            })
+
+        rows, next_cursor = await afetch_page(make_query, columns, params['limit'], params['cursor'])
+        return jsonify({
+            'success': True,
+            'data': [{column: row.get(column) for column in columns} for row in rows],
+            'next_cursor': next_cursor
+        })
+
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except TokenError:
+        raise
+    except Exception as e:
+        print(f"Error getting attendance: {e}")
+        return jsonify({'success': False, 'message': f'Error getting attendance: {str(e)}'}), 500
+
+
+@app.route('/api/register-face', methods=['POST'])
+async def register_face():
+    """Register a new face for a user"""
+    try:
+        data = await request_fields()
+        user_id = data.get('user_id')
+        user_type = data.get('user_type')
+
+        if not all([user_id, user_type]):
+            return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+        # Users enroll their own face; staff may enroll anyone
+        sync_app.authorize_user_or_staff(user_type, user_id, request.headers)
+
+        image_bytes = read_image_bytes(
+            request, data, 'image_data', sync_app.MAX_IMAGE_BYTES, sync_app.MAX_IMAGE_SIDE, **await image_payload()
+        )
+        face_encodings = await run_blocking(sync_app.encode_faces, image_bytes)
+        if not face_encodings:
+            return jsonify({'success': False, 'message': 'No face detected in image'}), 400
+        face_encoding = face_encodings[0]
+
+        table_name = 'student_faces' if user_type == 'student' else 'faculty_faces'
+        id_field = 'student_id' if user_type == 'student' else 'faculty_id'
+        face_data = {
+            id_field: user_id,
+            'face_encoding': face_codec.encode_face_encoding(face_encoding, sync_app.FACE_ENCODING_FORMAT),
+            'is_verified': True
+        }
+
+        existing = await db.table(table_name).select(id_field).eq(id_field, user_id).execute()
+        if existing.data:
+            await db.table(table_name).update(face_data).eq(id_field, user_id).execute()
+        else:
+            await db.table(table_name).insert(face_data).execute()
+
+        await run_blocking(sync_app.apply_face_change, sync_app.face_key(user_type, user_id), face_encoding)
+
+        return jsonify({'success': True, 'message': 'Face registered successfully'})
+
+    except sync_app.PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Error registering face: {e}")
+        return jsonify({'success': False, 'message': f'Error registering face: {str(e)}'}), 500
+
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    """Login endpoint for students and faculty using PRN and password"""
+    try:
+        data = await request.get_json() or {}
+        prn = data.get('prn')
+        password = data.get('password')
+        user_type = data.get('user_type', 'student')
+        if not prn or not password:
+            return jsonify({'success': False, 'message': 'PRN and password are required'}), 400
+        if user_type not in sync_app.LOGIN_TABLES:
+            return jsonify({'success': False, 'message': 'user_type must be student or faculty'}), 400
+
+        response = await db.table(sync_app.LOGIN_TABLES[user_type]).select('*').eq('prn', prn).execute()
+        if not response.data:
+            return jsonify({'success': False, 'message': 'Invalid PRN or password'}), 401
+        user = response.data[0]
+        # The password hash is a deliberately slow KDF
+        if not await run_blocking(sync_app.password_matches, user.get('password_hash') or '', password):
+            return jsonify({'success': False, 'message': 'Invalid PRN or password'}), 401
+
+        user_info = {k: v for k, v in user.items() if k not in ['password_hash']}
+        tokens = sync_app.TOKEN_ISSUER.issue(user.get('id', prn), user_type, prn=prn)
+        return jsonify({'success': True, 'message': 'Login successful', user_type: user_info, **tokens})
+    except Exception as e:
+        print(f"Error in login: {e}")
+        return jsonify({'success': False, 'message': f'Error during login: {str(e)}'}), 500
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f'0.0.0.0:{ASYNC_PORT}']
+    asyncio.run(serve(app, config))
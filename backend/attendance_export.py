@@ -0,0 +1,152 @@
+import base64
+import csv
+import io
+import json
+import re
+import uuid
+from datetime import date as Date
+
+# Columns clients may project; anything else in `fields` is rejected so it
+# never reaches the PostgREST select string
+ATTENDANCE_COLUMNS = (
+    'id', 'user_id', 'user_type', 'date', 'time', 'subject_id', 'time_slot',
+    'latitude', 'longitude', 'face_confidence', 'geo_verified', 'created_at',
+)
+# Keyset pagination orders by (date, id), so both are always fetched
+CURSOR_COLUMNS = ('date', 'id')
+# Cursor values are interpolated into a PostgREST filter, so only plain
+# dates and integer or UUID ids are accepted
+CURSOR_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+CURSOR_INT_ID = re.compile(r'\d{1,19}')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_fields(fields):
+    """Validated projection from a comma-separated `fields` parameter"""
+    if not fields:
+        return list(ATTENDANCE_COLUMNS)
+    columns = [column.strip() for column in fields.split(',') if column.strip()]
+    unknown = [column for column in columns if column not in ATTENDANCE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past `row`"""
+    raw = json.dumps([row['date'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def cursor_id(value):
+    """Canonical text of an integer or UUID row id, or None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return str(value) if value >= 0 else None
+    if not isinstance(value, str):
+        return None
+    if CURSOR_INT_ID.fullmatch(value):
+        return value
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
+
+def decode_cursor(cursor):
+    """(date, id) of a cursor; anything but a real date and id is rejected"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date, row_id = json.loads(raw)
+    except Exception:
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(date, str) or not CURSOR_DATE.fullmatch(date):
+        raise InvalidCursor('Invalid cursor')
+    try:
+        Date.fromisoformat(date)
+    except ValueError:
+        raise InvalidCursor('Invalid cursor')
+    row_id = cursor_id(row_id)
+    if row_id is None:
+        raise InvalidCursor('Invalid cursor')
+    return date, row_id
+
+
+def after_cursor(query, cursor):
+    """Restrict a query ordered by (date, id) to rows after `cursor`"""
+    if not cursor:
+        return query
+    date, row_id = decode_cursor(cursor)
+    return query.or_(f'date.gt.{date},and(date.eq.{date},id.gt.{row_id})')
+
+
+def page_query(make_query, columns, limit, cursor=None):
+    """Query for one page ordered by (date, id)
+
+    ``make_query(select)`` returns a fresh filtered query selecting ``select``.
+    One extra row is requested to learn whether another page follows.
+    """
+    select = ', '.join(dict.fromkeys(list(columns) + list(CURSOR_COLUMNS)))
+    return after_cursor(make_query(select), cursor).order('date').order('id').limit(limit + 1)
+
+
+def split_page(rows, limit):
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def fetch_page(make_query, columns, limit, cursor=None):
+    """One page of rows plus the cursor of the next page (None at the end)"""
+    return split_page(page_query(make_query, columns, limit, cursor).execute().data, limit)
+
+
+async def afetch_page(make_query, columns, limit, cursor=None):
+    """fetch_page for the async PostgREST client"""
+    response = await page_query(make_query, columns, limit, cursor).execute()
+    return split_page(response.data, limit)
+
+
+def iter_rows(make_query, columns, page_size):
+    """Every matching row, fetched page by page so memory stays flat"""
+    cursor = None
+    while True:
+        rows, cursor = fetch_page(make_query, columns, page_size, cursor)
+        for row in rows:
+            yield {column: row.get(column) for column in columns}
+        if cursor is None:
+            break
+
+
+async def aiter_rows(make_query, columns, page_size):
+    cursor = None
+    while True:
+        rows, cursor = await afetch_page(make_query, columns, page_size, cursor)
+        for row in rows:
+            yield {column: row.get(column) for column in columns}
+        if cursor is None:
+            break
+
+
+def ndjson_line(row):
+    return json.dumps(row, default=str) + '\n'
+
+
+def csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield ndjson_line(row)
+
+
+def csv_lines(rows, columns):
+    yield csv_line(columns)
+    for row in rows:
+        yield csv_line([row.get(column) for column in columns])
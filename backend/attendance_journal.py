@@ -0,0 +1,397 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+# SQLSTATE classes of errors caused by the row itself: data exceptions
+# and constraint violations. Everything else (permissions, missing tables
+# or columns, PostgREST schema-cache errors) is a configuration problem
+# that no row can fix, so it backs off and retries like an outage
+ROW_ERROR_CODES = ('22', '23')
+
+# Id column and other columns of each attendance table. Marks are journaled
+# with ``user_id`` and ``user_type``; the tables store the id in their own
+# column and only faculty_attendance lacks subject_id and time_slot
+ATTENDANCE_COLUMNS = {
+    'student_attendance': ('student_id', ('date', 'time', 'subject_id', 'time_slot', 'latitude', 'longitude',
+                                          'face_confidence', 'geo_verified', 'idempotency_key')),
+    'faculty_attendance': ('faculty_id', ('date', 'time', 'latitude', 'longitude', 'face_confidence',
+                                          'geo_verified', 'idempotency_key')),
+}
+
+
+def row_rejected(error):
+    """Whether the database refused the rows themselves, as opposed to the
+    request failing (network, timeouts, 5xx) and being worth retrying as is"""
+    if isinstance(error, sqlite3.IntegrityError):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, str) and code.startswith(ROW_ERROR_CODES)
+
+
+def table_row(table_name, payload):
+    """Map a journaled mark onto the columns of its attendance table"""
+    if table_name not in ATTENDANCE_COLUMNS:
+        return payload
+    id_column, columns = ATTENDANCE_COLUMNS[table_name]
+    row = {id_column: payload.get('user_id', payload.get(id_column))}
+    row.update((column, payload[column]) for column in columns if column in payload)
+    return row
+
+
+def idempotency_key(user_type, user_id, date, subject_id=None, time_slot=None):
+    """One mark per user, day, subject and slot"""
+    return f"{user_type}:{user_id}:{date}:{subject_id or ''}:{time_slot or ''}"
+
+
+class AttendanceJournal:
+    """Durable local write-behind log for attendance rows
+
+    ``append`` commits the row to a SQLite database in WAL mode with
+    ``synchronous=FULL``, so once it returns the mark survives a crash and
+    the request can be acknowledged without waiting for Supabase. A
+    background thread then upserts pending rows in batches into the columns
+    of their target tables (see ``table_row``), keyed by ``idempotency_key``
+    so a retried batch can never insert a mark twice. Flushed rows are kept
+    for ``retention`` seconds.
+
+    When the database rejects a batch (see ``row_rejected``) its rows are
+    retried one at a time, so one bad row cannot hold back the marks behind
+    it. A row rejected ``max_attempts`` times is moved to the
+    ``dead_letters`` table of the journal database for an operator to fix
+    and replay. Other failures back off and retry the whole batch.
+    """
+
+    def __init__(self, path, client, batch_size=500, interval=1.0, max_backoff=60, retention=2 * 86400,
+                 max_attempts=5):
+        self.path = path
+        self.client = client
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self.flushed_total = 0
+        self.rejected_total = 0
+        self.dead_lettered_total = 0
+        self.failures = 0
+        self.last_flush_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                table_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                flushed_at REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS journal_pending ON journal (flushed_at, id)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY,
+                idempotency_key TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                dead_at REAL NOT NULL
+            )
+        """)
+
+    def append(self, table_name, row, key):
+        """Durably record one row; returns False if ``key`` is already journaled"""
+        return self.append_many(table_name, [(row, key)])[0]
+
+    def append_many(self, table_name, rows_with_keys):
+        """Record several rows in one transaction (one fsync)
+
+        Returns a list of booleans, False where the key was already present.
+        """
+        now = time.time()
+        added = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for row, key in rows_with_keys:
+                    payload = json.dumps(dict(row, idempotency_key=key))
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO journal (idempotency_key, table_name, payload, created_at) '
+                        'VALUES (?, ?, ?, ?)',
+                        (key, table_name, payload, now)
+                    )
+                    added.append(cursor.rowcount == 1)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._wakeup.set()
+        return added
+
+    def contains(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM journal WHERE idempotency_key = ?', (key,)).fetchone()
+        return row is not None
+
+    def keys_for_date(self, date):
+        """Journaled idempotency keys for one day, flushed or not"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT idempotency_key FROM journal WHERE idempotency_key LIKE ?', (f'%:{date}:%',)
+            ).fetchall()
+        return [key for (key,) in rows]
+
+    def pending_payloads(self, table_name):
+        """Rows of a table that have not reached Supabase yet"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT payload FROM journal WHERE flushed_at IS NULL AND table_name = ? ORDER BY id', (table_name,)
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def flush_once(self):
+        """Push one batch of pending rows; returns how many were flushed"""
+        with self._lock:
+            pending = self._conn.execute(
+                'SELECT id, table_name, payload FROM journal WHERE flushed_at IS NULL ORDER BY id LIMIT ?',
+                (self.batch_size,)
+            ).fetchall()
+        if not pending:
+            return 0
+
+        by_table = {}
+        for row_id, table_name, payload in pending:
+            by_table.setdefault(table_name, []).append((row_id, json.loads(payload)))
+
+        flushed = 0
+        for table_name, rows in by_table.items():
+            done = []
+            try:
+                try:
+                    self._upsert(table_name, [payload for _, payload in rows])
+                    done = [row_id for row_id, _ in rows]
+                except Exception as e:
+                    self._record_error(e)
+                    if not row_rejected(e):
+                        raise
+                    # Something in the batch was refused: find out which rows
+                    for row_id, payload in rows:
+                        try:
+                            self._upsert(table_name, [payload])
+                            done.append(row_id)
+                        except Exception as row_error:
+                            self._record_error(row_error)
+                            if not row_rejected(row_error):
+                                raise
+                            self._reject(row_id, row_error)
+            finally:
+                if done:
+                    marks = ','.join('?' * len(done))
+                    with self._lock:
+                        self._conn.execute(
+                            f'UPDATE journal SET flushed_at = ? WHERE id IN ({marks})', [time.time()] + done
+                        )
+                    flushed += len(done)
+                    self.flushed_total += len(done)
+        self.last_flush_at = time.time()
+        return flushed
+
+    def _upsert(self, table_name, payloads):
+        self.client.table(table_name).upsert(
+            [table_row(table_name, payload) for payload in payloads], on_conflict='idempotency_key', ignore_duplicates=True
+        ).execute()
+
+    def _record_error(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+
+    def _reject(self, row_id, error):
+        """Count a rejection of one row; park it once it reaches max_attempts"""
+        self.rejected_total += 1
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'UPDATE journal SET attempts = attempts + 1, last_error = ? WHERE id = ?', (str(error), row_id)
+                )
+                moved = self._conn.execute(
+                    'INSERT INTO dead_letters '
+                    '(id, idempotency_key, table_name, payload, created_at, attempts, last_error, dead_at) '
+                    'SELECT id, idempotency_key, table_name, payload, created_at, attempts, last_error, ? '
+                    'FROM journal WHERE id = ? AND attempts >= ?',
+                    (time.time(), row_id, self.max_attempts)
+                ).rowcount
+                if moved:
+                    self._conn.execute('DELETE FROM journal WHERE id = ?', (row_id,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        if moved:
+            self.dead_lettered_total += 1
+            print(f"Attendance row {row_id} moved to dead letters after {self.max_attempts} attempts: {error}")
+
+    def dead_letters(self, limit=100):
+        """Parked rows, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, idempotency_key, table_name, payload, attempts, last_error, dead_at '
+                'FROM dead_letters ORDER BY dead_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [
+            {'id': row_id, 'idempotency_key': key, 'table_name': table_name, 'payload': json.loads(payload),
+             'attempts': attempts, 'last_error': last_error, 'dead_at': dead_at}
+            for row_id, key, table_name, payload, attempts, last_error, dead_at in rows
+        ]
+
+    def purge(self):
+        """Forget rows flushed longer than ``retention`` seconds ago"""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM journal WHERE flushed_at IS NOT NULL AND flushed_at < ?',
+                (time.time() - self.retention,)
+            )
+
+    def _run(self):
+        backoff = self.interval
+        last_purge = 0
+        while not self._stop_event.is_set():
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            try:
+                while self.flush_once() == self.batch_size:
+                    pass
+                backoff = self.interval
+                if time.time() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.time()
+            except Exception as e:
+                print(f"Error flushing attendance journal: {e}")
+                # Back off exponentially while Supabase is unavailable
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='attendance-journal')
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def stats(self):
+        """Pending rows and flush lag (age of the oldest unflushed row)"""
+        with self._lock:
+            pending, oldest = self._conn.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM journal WHERE flushed_at IS NULL'
+            ).fetchone()
+            dead_letters = self._conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+        return {
+            'pending': pending,
+            'flush_lag_seconds': time.time() - oldest if oldest else 0.0,
+            'flushed_total': self.flushed_total,
+            'failures': self.failures,
+            'rejected_total': self.rejected_total,
+            'dead_letters': dead_letters,
+            'dead_lettered_total': self.dead_lettered_total,
+            'last_flush_at': self.last_flush_at,
+            'last_error': self.last_error,
+        }
+
+
+class LocalTableClient:
+    """Stand-in for the subset of the Supabase table API the backend uses
+
+    Rows are kept as JSON in a SQLite file, one table per name. Point the
+    journal at it (ATTENDANCE_FLUSH_TARGET=local:<path>) to exercise the
+    write-behind path without a Supabase project.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.Lock()
+        self._tables = set()
+
+    def _ensure_table(self, name):
+        if name not in self._tables:
+            with self._lock:
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'conflict_key TEXT UNIQUE, row TEXT NOT NULL)'
+                )
+            self._tables.add(name)
+
+    def table(self, name):
+        self._ensure_table(name)
+        return _LocalQuery(self, name)
+
+
+class _LocalQuery:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+        self._action = None
+        self._rows = []
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._filters = []
+
+    def insert(self, rows):
+        self._action = 'insert'
+        self._rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict='', ignore_duplicates=False, **kwargs):
+        self._action = 'upsert'
+        self._rows = rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict or None
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def select(self, *columns, **kwargs):
+        self._action = 'select'
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, value))
+        return self
+
+    def execute(self):
+        conn, lock = self._client._conn, self._client._lock
+        if self._action == 'select':
+            with lock:
+                rows = [json.loads(row) for (row,) in conn.execute(f'SELECT row FROM "{self._name}" ORDER BY id')]
+            data = [row for row in rows if all(row.get(column) == value for column, value in self._filters)]
+            return _LocalResponse(data)
+
+        verb = 'INSERT'
+        if self._action == 'upsert' and self._on_conflict:
+            verb = 'INSERT OR IGNORE' if self._ignore_duplicates else 'INSERT OR REPLACE'
+        with lock:
+            conn.execute('BEGIN')
+            for row in self._rows:
+                conflict_key = row.get(self._on_conflict) if self._on_conflict else None
+                conn.execute(
+                    f'{verb} INTO "{self._name}" (conflict_key, row) VALUES (?, ?)',
+                    (conflict_key, json.dumps(row))
+                )
+            conn.execute('COMMIT')
+        return _LocalResponse(self._rows)
+
+
+class _LocalResponse:
+    def __init__(self, data):
+        self.data = data
@@ -0,0 +1,235 @@
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+
+class RollupState:
+    """Counters derived from student attendance marks
+
+    A session of a subject is a (date, time_slot) in which at least one
+    student of that subject was marked present; it is the denominator of
+    the attendance percentage.
+    """
+
+    def __init__(self):
+        self.attended = defaultdict(int)             # (student, subject) -> sessions attended
+        self.subjects_by_student = defaultdict(set)  # student -> subjects
+        self.students_by_subject = defaultdict(set)  # subject -> students
+        self.sessions = defaultdict(set)             # subject -> {(date, time_slot)}
+        self.daily = defaultdict(lambda: defaultdict(int))  # subject -> date -> students present
+        self.marks = 0
+
+    def add(self, student_id, subject_id, date, time_slot):
+        self.attended[(student_id, subject_id)] += 1
+        self.subjects_by_student[student_id].add(subject_id)
+        self.students_by_subject[subject_id].add(student_id)
+        self.sessions[subject_id].add((date, time_slot))
+        self.daily[subject_id][date] += 1
+        self.marks += 1
+
+
+def _codes(values):
+    """Factorize a list of strings into (uniques, integer codes)"""
+    uniques, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return uniques.tolist(), codes
+
+
+def build_state(students, subjects, dates, slots):
+    """Vectorized RollupState from parallel columns of historical marks"""
+    state = RollupState()
+    if not students:
+        return state
+    student_names, student_codes = _codes(students)
+    subject_names, subject_codes = _codes(subjects)
+    date_names, date_codes = _codes(dates)
+    slot_names, slot_codes = _codes(slots)
+    n_subjects, n_dates, n_slots = len(subject_names), len(date_names), len(slot_names)
+
+    pairs, counts = np.unique(student_codes.astype(np.int64) * n_subjects + subject_codes, return_counts=True)
+    for pair, count in zip(pairs.tolist(), counts.tolist()):
+        student, subject = student_names[pair // n_subjects], subject_names[pair % n_subjects]
+        state.attended[(student, subject)] = count
+        state.subjects_by_student[student].add(subject)
+        state.students_by_subject[subject].add(student)
+
+    sessions = np.unique((subject_codes.astype(np.int64) * n_dates + date_codes) * n_slots + slot_codes)
+    for code in sessions.tolist():
+        subject, rest = divmod(code, n_dates * n_slots)
+        date, slot = divmod(rest, n_slots)
+        state.sessions[subject_names[subject]].add((date_names[date], slot_names[slot]))
+
+    days, counts = np.unique(subject_codes.astype(np.int64) * n_dates + date_codes, return_counts=True)
+    for code, count in zip(days.tolist(), counts.tolist()):
+        state.daily[subject_names[code // n_dates]][date_names[code % n_dates]] = count
+    state.marks = len(students)
+    return state
+
+
+class AttendanceRollups:
+    """Per-student, per-subject and per-day attendance counters
+
+    ``record`` is called for every new mark; ``rebuild`` recomputes all of
+    the counters from history with numpy and swaps them in atomically,
+    replaying any marks recorded while it ran that history did not include.
+
+    ``record`` only sees the marks made by this process, so with several
+    workers the counters are made whole by rebuilding from the database
+    every ``interval`` seconds (see ``start``).
+    """
+
+    def __init__(self, threshold=75.0):
+        self.threshold = threshold
+        self.rebuilt_at = None
+        self.rebuild_failures = 0
+        self.last_error = None
+        self._state = RollupState()
+        self._replay = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def record(self, student_id, subject_id, date, time_slot, key=None):
+        if not subject_id:
+            return
+        with self._lock:
+            self._state.add(student_id, subject_id, date, time_slot or '')
+            if self._replay is not None:
+                self._replay.append((key, student_id, subject_id, date, time_slot or ''))
+
+    def rebuild(self, rows, recent_since):
+        """Recompute from ``rows`` (dicts with user_id, subject_id, date,
+        time_slot and optionally idempotency_key)
+
+        Keys of rows dated ``recent_since`` or later are remembered, so a
+        recent mark that appears twice (flushed from the journal while the
+        rebuild ran) or was recorded during the rebuild is counted once.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                self._replay = []
+            try:
+                students, subjects, dates, slots = [], [], [], []
+                recent_keys = set()
+                for row in rows:
+                    if not row.get('subject_id'):
+                        continue
+                    key = row.get('idempotency_key')
+                    if key and str(row['date']) >= recent_since:
+                        # Seen both in history and in the local journal
+                        if key in recent_keys:
+                            continue
+                        recent_keys.add(key)
+                    students.append(str(row['user_id']))
+                    subjects.append(str(row['subject_id']))
+                    dates.append(str(row['date']))
+                    slots.append(str(row.get('time_slot') or ''))
+                state = build_state(students, subjects, dates, slots)
+            except Exception:
+                with self._lock:
+                    self._replay = None
+                raise
+            with self._lock:
+                for key, student_id, subject_id, date, time_slot in self._replay:
+                    if key is None or key not in recent_keys:
+                        state.add(student_id, subject_id, date, time_slot)
+                self._state = state
+                self._replay = None
+            self.rebuilt_at = datetime.now().isoformat()
+
+    def student_summary(self, student_id):
+        """Attended/held/percentage for each of a student's subjects"""
+        subjects = []
+        with self._lock:
+            state = self._state
+            for subject_id in sorted(state.subjects_by_student.get(student_id, ())):
+                attended = state.attended.get((student_id, subject_id), 0)
+                held = len(state.sessions.get(subject_id, ()))
+                subjects.append({
+                    'subject_id': subject_id,
+                    'attended': attended,
+                    'held': held,
+                    'percentage': round(100.0 * attended / held, 2) if held else 0.0,
+                })
+        attended = sum(subject['attended'] for subject in subjects)
+        held = sum(subject['held'] for subject in subjects)
+        return {
+            'student_id': student_id,
+            'subjects': subjects,
+            'overall_percentage': round(100.0 * attended / held, 2) if held else 0.0,
+        }
+
+    def defaulters(self, subject_id, threshold=None, students=None):
+        """Students of a subject below ``threshold`` percent, lowest first
+
+        ``students`` (e.g. the class roster) adds students who never
+        attended and so have no counters yet.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            state = self._state
+            held = len(state.sessions.get(subject_id, ()))
+            candidates = set(state.students_by_subject.get(subject_id, ())) | set(students or ())
+            attended_by_student = {
+                student_id: state.attended.get((student_id, subject_id), 0) for student_id in candidates
+            }
+        result = []
+        for student_id, attended in attended_by_student.items():
+            percentage = 100.0 * attended / held if held else 0.0
+            if percentage < threshold:
+                result.append({
+                    'student_id': student_id,
+                    'attended': attended,
+                    'held': held,
+                    'percentage': round(percentage, 2),
+                })
+        return sorted(result, key=lambda row: (row['percentage'], row['student_id']))
+
+    def trend(self, subject_id, date_from=None, date_to=None):
+        """Per-day present count and sessions held for a subject"""
+        sessions_per_day = defaultdict(int)
+        with self._lock:
+            state = self._state
+            for date, _ in state.sessions.get(subject_id, ()):
+                sessions_per_day[date] += 1
+            daily = dict(state.daily.get(subject_id, {}))
+        return [
+            {'date': date, 'present': present, 'sessions': sessions_per_day[date]}
+            for date, present in sorted(daily.items())
+            if (not date_from or date >= date_from) and (not date_to or date <= date_to)
+        ]
+
+    def _run(self, rebuild, interval):
+        while not self._stop_event.wait(interval):
+            try:
+                rebuild()
+                self.last_error = None
+            except Exception as e:
+                self.rebuild_failures += 1
+                self.last_error = str(e)
+                print(f"Error rebuilding rollups: {e}")
+
+    def start(self, rebuild, interval):
+        """Call ``rebuild()`` every ``interval`` seconds (0 disables)"""
+        if self._thread is None and interval:
+            self._thread = threading.Thread(
+                target=self._run, args=(rebuild, interval), daemon=True, name='attendance-rollups'
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        with self._lock:
+            state = self._state
+            return {
+                'marks': state.marks,
+                'students': len(state.subjects_by_student),
+                'subjects': len(state.sessions),
+                'rebuilt_at': self.rebuilt_at,
+                'rebuild_failures': self.rebuild_failures,
+                'last_error': self.last_error,
+            }
@@ -0,0 +1,142 @@
+"""Accuracy/latency benchmark for the reduced-resolution detection policy.
+
+Runs every image through full-resolution detection (the reference) and
+through ``detect_faces`` at each requested short side, then reports the
+median detect and encode time and how closely the results agree with the
+reference: face count, box IoU and the euclidean distance between the
+encodings (anything well under the 0.6 match tolerance is harmless).
+
+    python bench_detection.py photos/ --short-sides 320,480,640,960 --json out.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+from encoding_engine import detect_faces
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - inter
+    return inter / union if union else 0.0
+
+
+def timed(fn, repeat):
+    """Run fn `repeat` times; return its last result and the median ms"""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(durations)
+
+
+def compare(reference, candidate):
+    """Pair candidate faces with reference faces by best IoU"""
+    ious = []
+    distances = []
+    ref_locations, ref_encodings = reference
+    locations, encodings = candidate
+    for location, encoding in zip(locations, encodings):
+        if not ref_locations:
+            break
+        scores = [iou(location, ref) for ref in ref_locations]
+        best = int(np.argmax(scores))
+        ious.append(scores[best])
+        distances.append(float(np.linalg.norm(encoding - ref_encodings[best])))
+    return ious, distances
+
+
+def collect_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            images.append(path)
+    return images
+
+
+def run_benchmark(image_paths, short_sides, repeat):
+    results = {side: {'detect_ms': [], 'encode_ms': [], 'count_match': 0, 'ious': [], 'distances': []}
+               for side in short_sides}
+    for path in image_paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Skipping unreadable image {path}")
+            continue
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        reference = None
+        for side in short_sides:
+            locations, detect_ms = timed(lambda: detect_faces(rgb_image, side), repeat)
+            encodings, encode_ms = timed(lambda: face_recognition.face_encodings(rgb_image, locations), repeat)
+            if reference is None:
+                reference = (locations, encodings)
+            entry = results[side]
+            entry['detect_ms'].append(detect_ms)
+            entry['encode_ms'].append(encode_ms)
+            entry['count_match'] += len(locations) == len(reference[0])
+            ious, distances = compare(reference, (locations, encodings))
+            entry['ious'].extend(ious)
+            entry['distances'].extend(distances)
+
+    report = []
+    for side in short_sides:
+        entry = results[side]
+        if not entry['detect_ms']:
+            continue
+        report.append({
+            'short_side': side or 'full',
+            'images': len(entry['detect_ms']),
+            'detect_ms_p50': statistics.median(entry['detect_ms']),
+            'encode_ms_p50': statistics.median(entry['encode_ms']),
+            'face_count_agreement': entry['count_match'] / len(entry['detect_ms']),
+            'mean_iou': statistics.mean(entry['ious']) if entry['ious'] else None,
+            'max_encoding_distance': max(entry['distances']) if entry['distances'] else None,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark reduced-resolution face detection')
+    parser.add_argument('paths', nargs='+', help='Image files or directories')
+    parser.add_argument('--short-sides', default='320,480,640,960',
+                        help='Comma-separated detection short sides to compare with full resolution')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write the report to this file as JSON')
+    args = parser.parse_args()
+
+    # The first entry (0 = full resolution) is the reference
+    short_sides = [0] + [int(side) for side in args.short_sides.split(',') if side]
+    report = run_benchmark(collect_images(args.paths), short_sides, args.repeat)
+    for row in report:
+        mean_iou = '-' if row['mean_iou'] is None else f"{row['mean_iou']:.3f}"
+        max_dist = '-' if row['max_encoding_distance'] is None else f"{row['max_encoding_distance']:.3f}"
+        print(
+            f"short_side={row['short_side']!s:>5}  detect={row['detect_ms_p50']:.1f}ms  "
+            f"encode={row['encode_ms_p50']:.1f}ms  count_agree={row['face_count_agreement']:.2f}  "
+            f"iou={mean_iou}  max_enc_dist={max_dist}"
+        )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Recognition benchmark on synthetic galleries, with per-stage percentiles.
+
+For every gallery size (random unit-norm 128-d encodings) a fresh process
+times the stages behind ``load_known_faces`` (decoding the stored text and
+loading the gallery, writing and attaching a snapshot), ``recognize_face``
+(1:N match) and the local part of ``mark_attendance`` (geofence, 1:1
+verify, duplicate check, journal append with fsync). Sample images, if
+given, are run through decode/detect/encode once, as that cost does not
+depend on the gallery. Every stage reports p50/p95/p99 in milliseconds and
+each size its peak RSS.
+
+    python bench_recognition.py --sizes 1000,10000,100000,1000000 --images photos/ --json bench.json
+    python bench_recognition.py --baseline bench.json --max-regression 1.25
+
+With --baseline the p95 of every stage is compared against an earlier
+--json report and the exit status is 1 if any grew past --max-regression.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from attendance_journal import AttendanceJournal, LocalTableClient, idempotency_key
+from face_codec import decode_face_encoding, encode_face_encoding
+from face_gallery import ENCODING_DIM, FaceGallery
+from gallery_snapshot import read_snapshot, write_snapshot
+from geofence import GeofenceIndex
+from marked_index import MarkedIndex
+
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=np.float64)
+    return {
+        'n': int(len(samples)),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Timer:
+    """Collects repeated timings per stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, stage, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.samples.setdefault(stage, []).append((time.perf_counter() - started) * 1000)
+        return result
+
+    def report(self):
+        return {stage: percentiles(samples) for stage, samples in self.samples.items()}
+
+
+def synthetic_gallery(size, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(size, ENCODING_DIM)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return [('student', str(i)) for i in range(size)], encodings
+
+
+def decode_all(stored):
+    return [decode_face_encoding(text) for text in stored]
+
+
+def bench_size(size, queries, noise, stored_format, load_repeat):
+    """All gallery-dependent stages for one size; runs in its own process"""
+    timer = Timer()
+    keys, encodings = synthetic_gallery(size)
+
+    # load_known_faces: stored text -> vectors -> gallery matrix
+    stored = [encode_face_encoding(encoding, stored_format) for encoding in encodings]
+    for _ in range(max(1, load_repeat)):
+        decoded = timer.time('load_decode', decode_all, stored)
+        gallery = FaceGallery()
+        timer.time('load_gallery', gallery.load, keys, decoded)
+
+    with tempfile.TemporaryDirectory() as directory:
+        timer.time('snapshot_write', write_snapshot, directory, keys, encodings, None)
+        snapshot = timer.time('snapshot_read', read_snapshot, directory)
+        attached = FaceGallery()
+        timer.time(
+            'snapshot_attach', attached.attach, snapshot['keys'], snapshot['encodings'], snapshot['sq_norms'],
+            snapshot['index']
+        )
+        del attached, snapshot
+
+        if gallery.index is None and len(gallery) >= gallery.ann_min_size:
+            timer.time('ann_build', gallery.build_index)
+
+        rng = np.random.default_rng(1)
+        picks = rng.choice(size, min(queries, size), replace=False)
+        probes = encodings[picks] + rng.normal(scale=noise, size=(len(picks), ENCODING_DIM)).astype(np.float32)
+
+        # recognize_face: 1:N match of one probe
+        correct = 0
+        for pick, probe in zip(picks, probes):
+            result = timer.time('recognize_match', gallery.match_many, [probe], 0.6)[0]
+            correct += result['matched'] and result['user_id'] == str(pick)
+
+        # mark_attendance without the network: geofence, verify, duplicate
+        # check and a durable journal append
+        geofence = GeofenceIndex([{'id': 'campus', 'center': [19.90194, 74.49428], 'radius_meters': 500}])
+        marked = MarkedIndex(lambda date: iter(()))
+        marked.warm('2026-01-01')
+        journal = AttendanceJournal(
+            os.path.join(directory, 'journal.db'), LocalTableClient(os.path.join(directory, 'tables.db'))
+        )
+        for pick, probe in zip(picks, probes):
+            started = time.perf_counter()
+            timer.time('mark_geofence', geofence.locate, 19.902, 74.494)
+            timer.time('mark_verify', gallery.verify, 'student', str(pick), [probe], 0.6)
+            key = idempotency_key('student', str(pick), '2026-01-01', 'sub', 'slot')
+            timer.time('mark_duplicate_check', marked.is_marked, key, '2026-01-01')
+            timer.time('mark_journal_append', journal.append, 'student_attendance', {'user_id': str(pick)}, key)
+            marked.add(key, '2026-01-01')
+            timer.samples.setdefault('mark_local_total', []).append((time.perf_counter() - started) * 1000)
+
+    return {
+        'size': size,
+        'search': 'ann' if gallery.index is not None else 'exact',
+        'recognize_accuracy': correct / len(picks),
+        'stages': timer.report(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_images(paths, repeat, detect_short_side):
+    """decode/detect/encode per sample image (needs face_recognition)"""
+    from bench_detection import collect_images
+    from encoding_engine import process_image
+
+    timer = Timer()
+    for path in collect_images(paths):
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = process_image(image_bytes, 'encode', time.time(), detect_short_side)
+            timer.samples.setdefault('pipeline_total', []).append((time.perf_counter() - started) * 1000)
+            for stage in ('decode_ms', 'detect_ms', 'encode_ms'):
+                if stage in result['timings']:
+                    timer.samples.setdefault(stage[:-3], []).append(result['timings'][stage])
+    return {'stages': timer.report(), 'peak_rss_mb': peak_rss_mb()}
+
+
+def compare(report, baseline, max_regression):
+    """p95 ratios against a baseline report; returns the regressed stages"""
+    regressions = []
+    previous = {row['size']: row for row in baseline.get('galleries', [])}
+    sections = [(f"size={row['size']}", row['stages'], previous.get(row['size'], {}).get('stages', {}))
+                for row in report['galleries']]
+    if report.get('images') and baseline.get('images'):
+        sections.append(('images', report['images']['stages'], baseline['images']['stages']))
+    for label, stages, old_stages in sections:
+        for stage, stats in stages.items():
+            old = old_stages.get(stage)
+            if not old or not old['p95_ms']:
+                continue
+            ratio = stats['p95_ms'] / old['p95_ms']
+            flag = '  REGRESSION' if ratio > max_regression else ''
+            print(f"{label:>14} {stage:<22} p95 {old['p95_ms']:9.3f} -> {stats['p95_ms']:9.3f} ms  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append((label, stage, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recognition benchmark on synthetic galleries')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--queries', type=int, default=200, help='Probes per gallery size')
+    parser.add_argument('--noise', type=float, default=0.02, help='Per-component probe noise')
+    parser.add_argument('--stored-format', default=os.getenv('FACE_ENCODING_FORMAT', 'f16'))
+    parser.add_argument('--load-repeat', type=int, default=3, help='Gallery loads to time (at least 1)')
+    parser.add_argument('--images', nargs='*', default=[], help='Sample images or directories')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per sample image')
+    parser.add_argument('--detect-short-side', type=int, default=int(os.getenv('FACE_DETECT_SHORT_SIDE', '640')))
+    parser.add_argument('--json', help='Write the report to this file as JSON')
+    parser.add_argument('--baseline', help='Earlier --json report to compare p95s against')
+    parser.add_argument('--max-regression', type=float, default=1.25)
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'stored_format': args.stored_format,
+        },
+        'galleries': [],
+        'images': None,
+    }
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        # A fresh process per size so peak RSS belongs to that size alone
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            row = pool.submit(bench_size, size, args.queries, args.noise, args.stored_format, args.load_repeat).result()
+        report['galleries'].append(row)
+        stages = row['stages']
+        print(
+            f"size={size:>8} ({row['search']})  rss={row['peak_rss_mb']:.0f}MB  "
+            f"acc={row['recognize_accuracy']:.3f}  " + '  '.join(
+                f"{stage}={stages[stage]['p50_ms']:.2f}/{stages[stage]['p95_ms']:.2f}/{stages[stage]['p99_ms']:.2f}"
+                for stage in ('load_decode', 'load_gallery', 'recognize_match', 'mark_local_total')
+            )
+        )
+    if args.images:
+        report['images'] = bench_images(args.images, args.repeat, args.detect_short_side)
+        for stage, stats in report['images']['stages'].items():
+            print(f"image {stage:<15} p50={stats['p50_ms']:.1f}  p95={stats['p95_ms']:.1f}  p99={stats['p99_ms']:.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import face_recognition
+import numpy as np
+
+from result_cache import content_key
+
+
+class EngineBusy(Exception):
+    """Raised when the encoding queue is full; callers should answer 429"""
+
+    def __init__(self, retry_after):
+        super().__init__('Face engine is busy, retry later')
+        self.retry_after = retry_after
+
+
+def detection_scale(height, width, detect_short_side):
+    """Factor to shrink an image by so its short side is detect_short_side"""
+    short_side = min(height, width)
+    if not detect_short_side or short_side <= detect_short_side:
+        return 1.0
+    return detect_short_side / short_side
+
+
+def detect_faces(rgb_image, detect_short_side=None, upsample=1):
+    """HOG face detection on a downscaled copy, boxes in full-image pixels
+
+    Detection cost grows with the pixel count while faces in attendance
+    photos stay large, so the detector runs on a copy resized to
+    ``detect_short_side`` and the boxes are mapped back to the original.
+    """
+    height, width = rgb_image.shape[:2]
+    scale = detection_scale(height, width, detect_short_side)
+    if scale == 1.0:
+        return face_recognition.face_locations(rgb_image, upsample)
+    small = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small, upsample):
+        locations.append((
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale))),
+        ))
+    return locations
+
+
+def frame_quality(image_bytes, reference_pixels=640 * 480):
+    """Cheap sharpness/size score for ordering the frames of a burst
+
+    Decodes a quarter-scale grayscale copy (JPEG is scaled while it is
+    decoded, so this costs a fraction of a full decode) and takes the
+    variance of its Laplacian: blurred frames lose the high frequencies.
+    Frames with fewer than ``reference_pixels`` are scaled down in
+    proportion, since small frames carry small faces. Returns
+    ``{'score', 'sharpness', 'pixels'}``; undecodable frames score 0.
+    """
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    gray = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return {'score': 0.0, 'sharpness': 0.0, 'pixels': 0}
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    pixels = gray.shape[0] * gray.shape[1] * 16
+    return {
+        'score': sharpness * min(1.0, pixels / reference_pixels),
+        'sharpness': sharpness,
+        'pixels': pixels,
+    }
+
+
+def process_image(image_bytes, mode, submitted_at, detect_short_side=None, known_locations=None):
+    """Decode, detect and (optionally) encode faces in one image
+
+    Runs inside a worker process. ``mode`` is 'detect' for face locations
+    only or 'encode' for locations plus 128-d encodings. Detection may run
+    on a downscaled copy (see ``detect_faces``) and is skipped when
+    ``known_locations`` are given; encodings are always computed from the
+    full-resolution image.
+    """
+    timings = {'queue_ms': (time.time() - submitted_at) * 1000}
+
+    started = time.perf_counter()
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('Could not decode image')
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    timings['decode_ms'] = (time.perf_counter() - started) * 1000
+
+    if known_locations is not None:
+        face_locations = known_locations
+    else:
+        started = time.perf_counter()
+        face_locations = detect_faces(rgb_image, detect_short_side)
+        timings['detect_ms'] = (time.perf_counter() - started) * 1000
+
+    face_encodings = []
+    if mode == 'encode' and face_locations:
+        started = time.perf_counter()
+        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        timings['encode_ms'] = (time.perf_counter() - started) * 1000
+
+    return {'locations': face_locations, 'encodings': face_encodings, 'timings': timings}
+
+
+def _pool_context():
+    """Forkserver context whose server preloads only this module
+
+    Forking the threaded app process could copy locks held by its journal,
+    sync or revocation threads into the workers.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def result_size(value):
+    """Approximate bytes held by a cached engine result"""
+    return 256 + 64 * len(value['locations']) + sum(e.nbytes for e in value['encodings'] or [])
+
+
+class StageStats:
+    """Thread-safe count/total/max latency per pipeline stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                entry = self._stages.setdefault(stage, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                entry['count'] += 1
+                entry['total_ms'] += ms
+                entry['max_ms'] = max(entry['max_ms'], ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: dict(entry, mean_ms=entry['total_ms'] / entry['count'])
+                for stage, entry in self._stages.items()
+            }
+
+
+class EncodingEngine:
+    """Runs the CPU-bound dlib pipeline on a pool of worker processes
+
+    At most ``workers + max_queue`` images are in flight; beyond that
+    ``run`` raises EngineBusy immediately instead of letting requests pile up
+    behind the GIL. An image that timed out keeps its slot until the worker
+    is done with it. ``workers=0`` runs the pipeline inline (handy when
+    debugging).
+
+    Workers are forked from a forkserver that has only imported this
+    module, never from the threaded server process, and a pool broken by a
+    crashed worker is replaced on the next request.
+
+    ``detect_short_side`` is the default detection resolution policy; 0 or
+    None detects on the full image.
+
+    With a ``cache`` (a ResultCache), results are remembered by a hash of
+    the image bytes: a repeated frame skips the worker pool entirely, and a
+    frame that was only detected before is encoded without detecting again.
+    """
+
+    def __init__(self, workers=None, max_queue=None, timeout=30, retry_after=1, detect_short_side=None,
+                 cache=None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = self.workers * 2 if max_queue is None else max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.detect_short_side = detect_short_side
+        self.cache = cache
+        self.stats = StageStats()
+        self.rejected = 0
+        self.pool_restarts = 0
+        self._slots = threading.BoundedSemaphore(max(1, self.workers) + self.max_queue)
+        self._in_flight = 0
+        self._counter_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _get_pool(self):
+        # Created lazily so importing the app (or the Flask reloader) does
+        # not start workers
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+        return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self.pool_restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, *args):
+        pool = self._get_pool()
+        try:
+            return pool, pool.submit(process_image, *args)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            pool = self._get_pool()
+            return pool, pool.submit(process_image, *args)
+
+    def run(self, image_bytes, mode='encode', detect_short_side=None):
+        """Process one image and return its locations, encodings and timings"""
+        if detect_short_side is None:
+            detect_short_side = self.detect_short_side
+
+        started = time.perf_counter()
+        cache_key = None
+        known_locations = None
+        if self.cache is not None:
+            cache_key = content_key(image_bytes, detect_short_side)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if mode == 'detect' or cached['encodings'] is not None:
+                    timings = {'cache_ms': (time.perf_counter() - started) * 1000}
+                    self.stats.record(timings)
+                    return {'locations': cached['locations'], 'encodings': cached['encodings'] or [],
+                            'timings': timings}
+                known_locations = cached['locations']
+
+        result = self._process(image_bytes, mode, detect_short_side, known_locations)
+        result['timings']['total_ms'] = (time.perf_counter() - started) * 1000
+        self.stats.record(result['timings'])
+        if cache_key is not None:
+            self.cache.put(cache_key, {
+                'locations': result['locations'],
+                'encodings': result['encodings'] if mode == 'encode' else None,
+            })
+        return result
+
+    def _process(self, image_bytes, mode, detect_short_side, known_locations):
+        if not self._slots.acquire(blocking=False):
+            with self._counter_lock:
+                self.rejected += 1
+            raise EngineBusy(self.retry_after)
+        with self._counter_lock:
+            self._in_flight += 1
+        if self.workers == 0:
+            try:
+                return process_image(image_bytes, mode, time.time(), detect_short_side, known_locations)
+            finally:
+                self._release()
+        try:
+            pool, future = self._submit(image_bytes, mode, time.time(), detect_short_side, known_locations)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is only free once the worker is: a timed-out image keeps
+        # running, and cancel() cannot stop it
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def _release(self):
+        with self._counter_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def status(self):
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'in_flight': self._in_flight,
+            'rejected': self.rejected,
+            'pool_restarts': self.pool_restarts,
+            'stages': self.stats.snapshot(),
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,150 @@
+"""Text formats for stored face encodings.
+
+Legacy rows hold base64 of the raw float64 vector (1,024 bytes, ~1,368
+characters). Compact rows are versioned with a ``fe2:<kind>:`` prefix, which
+can never start a legacy value because ':' is not a base64 character:
+
+    fe2:f16:<base64 of float16 x 128>                       256 bytes, 352 chars
+    fe2:i8:<base64 of float32 scale + int8 x 128>           132 bytes, 183 chars
+
+int8 rows are quantized symmetrically per vector (scale = max|x| / 127), so
+every component is off by at most scale / 2. Run this module for an accuracy
+report of each format against float64 match decisions:
+
+    python face_codec.py --identities 5000 --probes 2000 --json report.json
+"""
+import argparse
+import base64
+import json
+
+import numpy as np
+
+PREFIX = 'fe2'
+FORMATS = ('f64', 'f16', 'i8')
+
+
+def encode_face_encoding(encoding, fmt='i8'):
+    """Stored text for an encoding in format ``fmt`` ('f64' is the legacy form)"""
+    encoding = np.asarray(encoding, dtype=np.float64).reshape(-1)
+    if fmt == 'f64':
+        return base64.b64encode(encoding.tobytes()).decode('utf-8')
+    if fmt == 'f16':
+        payload = encoding.astype('<f2').tobytes()
+    elif fmt == 'i8':
+        peak = float(np.abs(encoding).max())
+        scale = peak / 127 if peak > 0 else 1.0
+        quantized = np.clip(np.rint(encoding / scale), -127, 127).astype(np.int8)
+        payload = np.float32(scale).astype('<f4').tobytes() + quantized.tobytes()
+    else:
+        raise ValueError(f'Unknown face encoding format {fmt!r}')
+    return f"{PREFIX}:{fmt}:{base64.b64encode(payload).decode('utf-8')}"
+
+
+def encoding_format(encoded):
+    """Format name of a stored encoding"""
+    if encoded.startswith(PREFIX + ':'):
+        return encoded.split(':', 2)[1]
+    return 'f64'
+
+
+def decode_face_encoding(encoded):
+    """Vector from any stored format
+
+    Legacy values decode to float64 as before; compact ones to float32,
+    which is what the gallery keeps anyway.
+    """
+    if not encoded.startswith(PREFIX + ':'):
+        return np.frombuffer(base64.b64decode(encoded), dtype=np.float64)
+    _, fmt, body = encoded.split(':', 2)
+    raw = base64.b64decode(body)
+    if fmt == 'f16':
+        return np.frombuffer(raw, dtype='<f2').astype(np.float32)
+    if fmt == 'i8':
+        scale = np.frombuffer(raw[:4], dtype='<f4')[0]
+        return np.frombuffer(raw[4:], dtype=np.int8).astype(np.float32) * scale
+    raise ValueError(f'Unknown face encoding format {fmt!r}')
+
+
+def roundtrip(encodings, fmt):
+    """Encodings as they read back after being stored in ``fmt``"""
+    return np.stack([decode_face_encoding(encode_face_encoding(e, fmt)) for e in encodings]).astype(np.float64)
+
+
+def _decisions(gallery, probes, tolerance):
+    """Nearest identity and accept/reject for each probe (1:N, exact)"""
+    distances = np.sqrt(np.maximum(
+        (probes ** 2).sum(1)[:, None] - 2 * probes @ gallery.T + (gallery ** 2).sum(1)[None, :], 0
+    ))
+    nearest = distances.argmin(axis=1)
+    best = distances[np.arange(len(probes)), nearest]
+    return nearest, best, best <= tolerance
+
+
+def accuracy_report(gallery, probes, tolerance=0.6, formats=FORMATS):
+    """Compare 1:N match decisions of each stored format with float64
+
+    A decision flips when the accept/reject outcome changes or an accepted
+    probe resolves to a different identity.
+    """
+    gallery = np.asarray(gallery, dtype=np.float64)
+    probes = np.asarray(probes, dtype=np.float64)
+    ref_nearest, ref_best, ref_accept = _decisions(gallery, probes, tolerance)
+    report = []
+    for fmt in formats:
+        stored = roundtrip(gallery, fmt)
+        nearest, best, accept = _decisions(stored, probes, tolerance)
+        flips = (accept != ref_accept) | (accept & ref_accept & (nearest != ref_nearest))
+        report.append({
+            'format': fmt,
+            'chars_per_row': len(encode_face_encoding(gallery[0], fmt)),
+            'max_vector_error': float(np.linalg.norm(stored - gallery, axis=1).max()),
+            'max_distance_error': float(np.abs(best - ref_best).max()),
+            'decision_agreement': float(1 - flips.mean()),
+            'decision_flips': int(flips.sum()),
+        })
+    return report
+
+
+def synthetic_faces(identities, probes, noise, seed=0):
+    """Gallery and probes shaped like dlib encodings (norm ~0.9, small noise)"""
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(size=(identities, 128))
+    gallery *= 0.9 / np.linalg.norm(gallery, axis=1, keepdims=True)
+    picks = rng.integers(0, identities, probes)
+    # Half the probes are enrolled people, half are strangers
+    strangers = rng.normal(size=(probes, 128))
+    strangers *= 0.9 / np.linalg.norm(strangers, axis=1, keepdims=True)
+    known = gallery[picks] + rng.normal(scale=noise, size=(probes, 128))
+    return gallery, np.where((np.arange(probes) % 2 == 0)[:, None], known, strangers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Match-decision accuracy of compact face encoding formats')
+    parser.add_argument('--gallery', help='.npy file of real encodings (N x 128); synthetic if omitted')
+    parser.add_argument('--probes-file', help='.npy file of probe encodings to pair with --gallery')
+    parser.add_argument('--identities', type=int, default=5000)
+    parser.add_argument('--probes', type=int, default=2000)
+    parser.add_argument('--noise', type=float, default=0.04)
+    parser.add_argument('--tolerance', type=float, default=0.6)
+    parser.add_argument('--json', help='Write the report to this file as JSON')
+    args = parser.parse_args()
+
+    if args.gallery:
+        gallery = np.load(args.gallery)
+        probes = np.load(args.probes_file) if args.probes_file else gallery
+    else:
+        gallery, probes = synthetic_faces(args.identities, args.probes, args.noise)
+    report = accuracy_report(gallery, probes, args.tolerance)
+    for row in report:
+        print(
+            f"format={row['format']:>3}  chars/row={row['chars_per_row']:>4}  "
+            f"max_vec_err={row['max_vector_error']:.5f}  max_dist_err={row['max_distance_error']:.5f}  "
+            f"agreement={row['decision_agreement']:.5f}  flips={row['decision_flips']}"
+        )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ann_index import IVFIndex, list_layout
+from gallery_keys import KeyTable
+
+# face_recognition produces 128-d dlib embeddings
+ENCODING_DIM = 128
+# Seconds a replaced or removed row stays readable before it is reused, so
+# a search that started before the change never sees it half rewritten
+RETIRE_GRACE = 2.0
+# Times a search is re-run lock-free when a write overlapped it, before it
+# runs under the writers' lock instead
+READ_RETRIES = 3
+
+
+class ReadOnlyGallery(RuntimeError):
+    """Raised on writes to a gallery attached to a published snapshot; the
+    publisher applies changes instead"""
+
+
+class FaceGallery:
+    """In-memory face gallery backed by one contiguous float32 matrix.
+
+    Every enrolled encoding is a row of ``_matrix`` and its squared norm is
+    kept alongside it, so the euclidean distance from a probe to the whole
+    gallery is ``|g|^2 - 2 g.p + |p|^2``: one matrix-vector product instead of
+    a Python-level loop over the encodings.
+
+    Identities are keyed by ``(user_type, user_id)``. Searches never take
+    the lock: writers fill a fresh row, publish it by swapping the
+    identity's slot, and only then retire the old row (its squared norm is
+    set to infinity so it can never be matched again). Retired rows are
+    reused after ``RETIRE_GRACE`` seconds, so both upsert and remove stay
+    O(1) and the matrix never holds live duplicates. Writers make
+    ``version`` odd while they work; a search that overlapped a write is
+    simply run again (under the lock once it has overlapped
+    ``READ_RETRIES`` times).
+
+    Once the gallery holds ``ann_min_size`` encodings, searches go through an
+    IVF index that only scans the ``nprobe`` nearest partitions; smaller
+    galleries are always searched exactly.
+
+    ``version`` also tells derived views (see ``roster_index``) when they
+    are stale.
+
+    A gallery attached to a published snapshot (``attach``) serves the
+    shared matrix, key table and index as they are and is read-only:
+    changes go to the publisher, which publishes a new snapshot.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, capacity=1024, ann_min_size=20000, nprobe=8, n_lists=None):
+        self.dim = dim
+        self.ann_min_size = ann_min_size
+        self.nprobe = nprobe
+        self.n_lists = n_lists
+        self.version = 0
+        self._lock = threading.Lock()
+        self._reset(capacity)
+
+    def _reset(self, capacity):
+        self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        self._sq_norms = np.full(capacity, np.inf, dtype=np.float32)
+        self._keys = [None] * capacity
+        self._slots = {}
+        self._free = []
+        self._retired = deque()
+        self._size = 0
+        self._index = None
+        self.shared = False
+        self.version += 2
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    @property
+    def keys(self):
+        return list(self._slots)
+
+    @property
+    def index(self):
+        return self._index
+
+    def _ensure_capacity(self, needed):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(capacity, 1024)
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        sq_norms = np.full(capacity, np.inf, dtype=np.float32)
+        size = self._size
+        matrix[:size] = self._matrix[:size]
+        sq_norms[:size] = self._sq_norms[:size]
+        self._keys.extend([None] * (capacity - len(self._keys)))
+        # Swap in the grown buffers only once they are fully populated so a
+        # concurrent reader never sees a half-copied matrix
+        self._matrix, self._sq_norms = matrix, sq_norms
+
+    def _allocate_row(self):
+        now = time.monotonic()
+        while self._retired and self._retired[0][1] <= now:
+            row, _ = self._retired.popleft()
+            self._keys[row] = None
+            self._free.append(row)
+        if self._free:
+            return self._free.pop()
+        self._ensure_capacity(self._size + 1)
+        self._size += 1
+        return self._size - 1
+
+    def upsert(self, user_type, user_id, encoding):
+        """Insert or replace the encoding enrolled for one identity"""
+        self.upsert_many([(user_type, user_id)], [encoding])
+
+    def upsert_many(self, keys, encodings):
+        """Insert or replace a batch of ``(user_type, user_id)`` encodings"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(keys) != len(encodings):
+            raise ValueError('keys and encodings must have the same length')
+        # The last encoding wins when a key repeats within the batch
+        latest = {tuple(key): i for i, key in enumerate(keys)}
+        keys, encodings = list(latest), encodings[list(latest.values())]
+        with self._lock:
+            self._check_writable()
+            self.version += 1
+            self._ensure_capacity(self._size)
+            rows = []
+            for key in keys:
+                row = self._allocate_row()
+                self._keys[row] = key
+                rows.append(row)
+            rows = np.asarray(rows, dtype=np.int64)
+            # Fill the new rows first; they become matchable with their norm
+            self._matrix[rows] = encodings
+            self._sq_norms[rows] = np.einsum('ij,ij->i', encodings, encodings)
+            for key, row in zip(keys, rows.tolist()):
+                old_row = self._slots.get(key)
+                self._slots[key] = row
+                if old_row is not None:
+                    self._retire(old_row)
+            self._update_index(rows)
+            self.version += 1
+
+    def _retire(self, row):
+        # Tombstone first so concurrent searches stop matching the row
+        self._sq_norms[row] = np.inf
+        if self._index is not None:
+            self._index.remove(row)
+        self._retired.append((row, time.monotonic() + RETIRE_GRACE))
+
+    def remove(self, user_type, user_id):
+        """Forget one identity; returns False if it was not enrolled"""
+        return self.remove_many([(user_type, user_id)]) == 1
+
+    def remove_many(self, keys):
+        """Forget several identities; returns how many were enrolled"""
+        with self._lock:
+            self._check_writable()
+            keys = [tuple(key) for key in keys if tuple(key) in self._slots]
+            if not keys:
+                return 0
+            self.version += 1
+            for key in keys:
+                self._retire(self._slots.pop(key))
+            self.version += 1
+            return len(keys)
+
+    def _check_writable(self):
+        if self.shared:
+            raise ReadOnlyGallery('Gallery is attached to a published snapshot')
+
+    def load(self, keys, encodings):
+        """Replace the whole gallery, sizing the buffers to the new contents
+
+        The new contents are built off to the side and swapped in at once,
+        so searches see either the old gallery or the new one, never an
+        empty or partly filled one.
+        """
+        staged = FaceGallery(self.dim, max(1024, len(keys)), self.ann_min_size, self.nprobe, self.n_lists)
+        staged.upsert_many(keys, encodings)
+        with self._lock:
+            self.version += 1
+            self._matrix = staged._matrix
+            self._sq_norms = staged._sq_norms
+            self._keys = staged._keys
+            self._slots = staged._slots
+            self._free = staged._free
+            self._retired = staged._retired
+            self._size = staged._size
+            self._index = staged._index
+            self.shared = False
+            self.version += 1
+
+    def attach(self, keys, matrix, sq_norms=None, index=None):
+        """Serve an existing N x dim float32 matrix without copying it
+
+        ``matrix`` is typically a read-only memmap of a gallery snapshot or
+        a shared-memory generation, so every attached process shares one
+        copy. ``keys`` is a KeyTable (a plain sequence of
+        ``(user_type, user_id)`` tuples is turned into one) and ``index``
+        the ``publish_index`` lists published alongside; both are used as
+        they are, so nothing per-row is private. Without an index, a large
+        gallery gets one built here. The gallery is read-only until the next
+        ``load``.
+        """
+        if len(keys) != len(matrix):
+            raise ValueError('keys and matrix must have the same length')
+        if not isinstance(keys, KeyTable):
+            keys = KeyTable.from_keys(keys)
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+        if index is None:
+            index = publish_index(matrix, self.ann_min_size, self.n_lists)
+        if index is not None:
+            index = IVFIndex.from_lists(
+                index['centroids'], index['offsets'], index['rows'], self.nprobe, index['trained_size']
+            )
+        with self._lock:
+            self.version += 1
+            self._matrix = matrix
+            self._sq_norms = np.asarray(sq_norms, dtype=np.float32)
+            self._keys = keys
+            self._slots = keys
+            self._free = []
+            self._retired = deque()
+            self._size = len(keys)
+            self._index = index
+            self.shared = True
+            self.version += 1
+
+    def clear(self):
+        """Drop every encoding"""
+        self.load([], np.empty((0, self.dim), dtype=np.float32))
+
+    def _update_index(self, rows):
+        live = len(self._slots)
+        if live < self.ann_min_size:
+            return
+        index = self._index
+        if index is None or live >= 2 * index.trained_size:
+            # (Re)train when the gallery first gets big enough and whenever it
+            # has doubled since, so the partitions stay balanced
+            self.build_index()
+        else:
+            index.add(rows, self._matrix[rows])
+
+    def build_index(self):
+        """Train a fresh IVF index over the live gallery rows"""
+        rows = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+        index = IVFIndex(n_lists=self.n_lists, nprobe=self.nprobe)
+        index.train(self._matrix, np.sort(rows))
+        self._index = index
+
+    def distances(self, probes):
+        """Euclidean distances from each probe to every gallery row (M x N)
+
+        Free rows come out as infinity.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        size = self._size
+        matrix = self._matrix[:size]
+        sq_dist = self._sq_norms[:size][None, :] - 2.0 * (probes @ matrix.T)
+        sq_dist += np.einsum('ij,ij->i', probes, probes)[:, None]
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        return np.sqrt(sq_dist, out=sq_dist)
+
+    def exact_top_k(self, probes, k):
+        """Brute-force k nearest rows; returns (rows, distances), both M x k"""
+        dist = self.distances(probes)
+        k = min(k, dist.shape[1])
+        if k < dist.shape[1]:
+            top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(dist.shape[1]), dist.shape)
+        top_dist = np.take_along_axis(dist, top, axis=1)
+        order = np.argsort(top_dist, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_dist, order, axis=1)
+
+    def ann_top_k(self, probe, k, nprobe=None):
+        """Approximate k nearest rows for one probe via the IVF index"""
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        rows = self._index.candidates(probe, nprobe)
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        sq_dist = self._sq_norms[rows] - 2.0 * (self._matrix[rows] @ probe) + probe @ probe
+        dist = np.sqrt(np.maximum(sq_dist, 0.0))
+        k = min(k, len(rows))
+        if k < len(rows):
+            top = np.argpartition(dist, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(dist[top])]
+        return rows[top], dist[top]
+
+    def search(self, probes, k=2):
+        """Return the k nearest identities for each probe
+
+        Result is a list (one per probe) of ``((user_type, user_id), distance)``
+        pairs sorted by increasing distance.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        return self._read(self._search, probes, k)
+
+    def _read(self, fn, *args):
+        """Run a lock-free read, again if a write overlapped it
+
+        Under a steady stream of writes every attempt may overlap one; the
+        last attempt then waits for the writers' lock so it cannot return a
+        half-applied write.
+        """
+        for _ in range(READ_RETRIES):
+            version = self.version
+            result = fn(*args)
+            if version % 2 == 0 and self.version == version:
+                return result
+        with self._lock:
+            return fn(*args)
+
+    def _search(self, probes, k):
+        keys = self._keys
+        if not self._slots:
+            return [[] for _ in probes]
+        index = self._index
+        if index is not None and len(self._slots) >= self.ann_min_size:
+            top = [self.ann_top_k(probe, k) for probe in probes]
+        else:
+            top = zip(*self.exact_top_k(probes, k))
+        return [
+            [(keys[idx], float(d)) for idx, d in zip(row_idx, row_dist) if np.isfinite(d)]
+            for row_idx, row_dist in top
+        ]
+
+    def match(self, probe, tolerance=0.6):
+        """Find the nearest identity for a single probe encoding
+
+        Returns a dict with the best match, its distance and the margin to the
+        runner-up identity. ``matched`` is False when the nearest row is
+        farther than ``tolerance`` or the gallery is empty.
+        """
+        return self.match_many([probe], tolerance)[0]
+
+    def verify(self, user_type, user_id, probes, tolerance=0.6):
+        """1:1 check of probe encodings against one identity's enrollment
+
+        Only the claimed identity's row is touched, so the cost does not
+        depend on the gallery size. With several probes (several faces in the
+        frame) the closest one decides.
+        """
+        row = self._slots.get((user_type, user_id))
+        if row is None:
+            return {'enrolled': False, 'verified': False, 'distance': None, 'probe_index': None}
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        dist = np.linalg.norm(probes - self._matrix[row], axis=1)
+        best = int(np.argmin(dist))
+        distance = float(dist[best])
+        return {
+            'enrolled': True,
+            'verified': distance <= tolerance,
+            'distance': distance,
+            'probe_index': best,
+        }
+
+    def gather(self, keys):
+        """Copy out the enrolled rows of ``keys``
+
+        Returns ``(present_keys, encodings, sq_norms, version)``; identities
+        that are not enrolled are skipped.
+        """
+        return self._read(self._gather, keys)
+
+    def _gather(self, keys):
+        # The version is read first so a copy that still overlapped a write
+        # looks stale rather than current
+        version = self.version
+        slots = self._slots
+        present, rows = [], []
+        for key in keys:
+            row = slots.get(key)
+            if row is not None:
+                present.append(key)
+                rows.append(row)
+        rows = np.asarray(rows, dtype=np.int64)
+        return present, self._matrix[rows], self._sq_norms[rows], version
+
+    def match_subset(self, probes, keys, tolerance=0.6):
+        """Match probes against only the given identities (e.g. a class roster)
+
+        All probes are scored against the gathered roster rows in one matrix
+        product. Identities in ``keys`` that are not enrolled are ignored.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        return self._read(self._match_subset, probes, keys, tolerance)
+
+    def _match_subset(self, probes, keys, tolerance):
+        slots = self._slots
+        rows = [slots.get(key) for key in keys]
+        keys = [key for key, row in zip(keys, rows) if row is not None]
+        if not keys:
+            return [match_result([], tolerance) for _ in probes]
+        rows = np.asarray([row for row in rows if row is not None], dtype=np.int64)
+        sq_dist = self._sq_norms[rows][None, :] - 2.0 * (probes @ self._matrix[rows].T)
+        sq_dist += np.einsum('ij,ij->i', probes, probes)[:, None]
+        dist = np.sqrt(np.maximum(sq_dist, 0.0))
+        # Rosters are small, so a full sort per probe is cheap
+        top = np.argsort(dist, axis=1)[:, :2]
+        results = []
+        for row_top, row_dist in zip(top, dist):
+            results.append(match_result([(keys[i], float(row_dist[i])) for i in row_top], tolerance))
+        return results
+
+    def match_many(self, probes, tolerance=0.6):
+        """Vectorized ``match`` over a batch of probe encodings"""
+        results = []
+        for neighbours in self.search(probes, k=2):
+            results.append(match_result(neighbours, tolerance))
+        return results
+
+
+def publish_index(encodings, ann_min_size, n_lists=None, previous=None):
+    """IVF lists to publish with a gallery snapshot, or None for small ones
+
+    Returns ``{'centroids', 'offsets', 'rows', 'trained_size'}`` (see
+    ``ann_index.list_layout``). The centroids of the ``previous``
+    publication are reused until the gallery has doubled since they were
+    trained, so most publishes only re-assign rows.
+    """
+    count = len(encodings)
+    if count < max(1, ann_min_size):
+        return None
+    if previous is not None and count < 2 * previous['trained_size']:
+        centroids, trained_size = np.asarray(previous['centroids'], dtype=np.float32), previous['trained_size']
+    else:
+        centroids, trained_size = IVFIndex(n_lists=n_lists).train_centroids(encodings), count
+    offsets, rows = list_layout(encodings, centroids)
+    return {'centroids': centroids, 'offsets': offsets, 'rows': rows, 'trained_size': int(trained_size)}
+
+
+def match_result(neighbours, tolerance):
+    if not neighbours:
+        return {'matched': False, 'user_type': None, 'user_id': None, 'distance': None, 'margin': None}
+    (user_type, user_id), distance = neighbours[0]
+    margin = neighbours[1][1] - distance if len(neighbours) > 1 else None
+    return {
+        'matched': distance <= tolerance,
+        'user_type': user_type,
+        'user_id': user_id,
+        'distance': distance,
+        'margin': margin,
+    }
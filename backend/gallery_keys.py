@@ -0,0 +1,85 @@
+import numpy as np
+
+# The faces tables only hold students and faculty
+USER_TYPES = ('student', 'faculty')
+
+
+def key_arrays(keys):
+    """Arrays describing ``(user_type, user_id)`` keys for a KeyTable
+
+    Returns a dict with one user-type byte (``types``) and fixed-width
+    UTF-8 id (``ids``) per row, ``int_ids`` when every id is an int, and a
+    lookup index: ``order`` lists the rows sorted by (type, id),
+    ``sorted_ids`` holds their ids in that order and ``type_bounds`` where
+    each type's run starts.
+    """
+    types = np.array([USER_TYPES.index(user_type) for user_type, _ in keys], dtype=np.int8)
+    ids = np.array([str(user_id).encode('utf-8') for _, user_id in keys], dtype=bytes)
+    if not len(keys):
+        ids = ids.astype('S1')
+    order = np.lexsort((ids, types)).astype(np.int64)
+    type_bounds = np.zeros(len(USER_TYPES) + 1, dtype=np.int64)
+    type_bounds[1:] = np.cumsum(np.bincount(types, minlength=len(USER_TYPES)))
+    return {
+        'types': types,
+        'ids': ids,
+        'int_ids': bool(keys) and all(isinstance(user_id, int) for _, user_id in keys),
+        'order': order,
+        'sorted_ids': ids[order],
+        'type_bounds': type_bounds,
+    }
+
+
+class KeyTable:
+    """Read-only key table of a published gallery
+
+    Maps row numbers to ``(user_type, user_id)`` keys like a sequence and
+    keys to rows like a dict (``get``, ``in``), over the arrays made by
+    ``key_arrays``. The arrays can live in shared memory or a memmap, so
+    attached workers share them instead of each building a dict of every
+    key.
+    """
+
+    def __init__(self, types, ids, int_ids, order, sorted_ids, type_bounds):
+        self.types = types
+        self.ids = ids
+        self.int_ids = int_ids
+        self.order = order
+        self.sorted_ids = sorted_ids
+        self.type_bounds = type_bounds
+
+    @classmethod
+    def from_keys(cls, keys):
+        return cls(**key_arrays(keys))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        user_id = self.ids[row].decode('utf-8')
+        return USER_TYPES[self.types[row]], int(user_id) if self.int_ids else user_id
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self.ids)))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """Row of ``key``, found by binary search within its user type"""
+        user_type, user_id = key
+        if user_type not in USER_TYPES:
+            return default
+        encoded = str(user_id).encode('utf-8')
+        if len(encoded) > self.sorted_ids.dtype.itemsize:
+            return default
+        start = USER_TYPES.index(user_type)
+        lo, hi = int(self.type_bounds[start]), int(self.type_bounds[start + 1])
+        pos = lo + int(np.searchsorted(self.sorted_ids[lo:hi], encoded))
+        if pos < hi and self.sorted_ids[pos] == encoded:
+            return int(self.order[pos])
+        return default
+
+    def values(self):
+        """Every row number, like ``dict.values`` of a key -> row dict"""
+        return range(len(self.ids))
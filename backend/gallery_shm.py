@@ -0,0 +1,391 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from face_gallery import ENCODING_DIM, publish_index
+from gallery_keys import USER_TYPES, KeyTable, key_arrays
+from gallery_snapshot import apply_changes
+from gallery_sync import DEFAULT_OVERLAP, REQUEST_POLL, RecentRows, SyncRequests, checked_rows, overlap_since
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process publishes for itself
+    fcntl = None
+
+# Bump when the block layout changes; older generations are then ignored
+SHM_FORMAT = 2
+# Generations kept open after a swap so searches still running on them finish
+KEEP_GENERATIONS = 2
+_HEADER = 128
+# format, count, dim, id width, int ids, IVF lists, IVF trained size and the
+# key table's type bounds
+_HEADER_FIELDS = 7 + len(USER_TYPES) + 1
+
+
+def _open(name, create=False, size=0):
+    """SharedMemory that this process will not unlink when it exits
+
+    Before Python 3.13 every process that opens a block registers it with
+    the resource tracker, which unlinks it at exit and would pull the
+    gallery out from under the other workers. Blocks are unlinked
+    explicitly by the publisher instead.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink(name):
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if not hasattr(shm, '_track'):
+        # Before 3.13 unlink() also unregisters, which must be balanced
+        resource_tracker.register(shm._name, 'shared_memory')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _layout(count, dim, id_width, n_lists):
+    """8-byte aligned offsets of each array in a generation block, and its size"""
+    sizes = (
+        ('encodings', count * dim * 4),
+        ('sq_norms', count * 4),
+        ('order', count * 8),
+        ('centroids', n_lists * dim * 4),
+        ('offsets', (n_lists + 1) * 8 if n_lists else 0),
+        ('rows', count * 8 if n_lists else 0),
+        ('types', count),
+        ('ids', count * id_width),
+        ('sorted_ids', count * id_width),
+    )
+    offsets, position = {}, _HEADER
+    for name, size in sizes:
+        position = -(-position // 8) * 8
+        offsets[name] = position
+        position += size
+    return offsets, position
+
+
+def _arrays(buf, count, dim, id_width, n_lists):
+    """Views of every array in a generation block"""
+    offsets, _ = _layout(count, dim, id_width, n_lists)
+    shapes = {
+        'encodings': ((count, dim), np.float32),
+        'sq_norms': ((count,), np.float32),
+        'order': ((count,), np.int64),
+        'centroids': ((n_lists, dim), np.float32),
+        'offsets': ((n_lists + 1 if n_lists else 0,), np.int64),
+        'rows': ((count if n_lists else 0,), np.int64),
+        'types': ((count,), np.int8),
+        'ids': ((count,), f'S{id_width}'),
+        'sorted_ids': ((count,), f'S{id_width}'),
+    }
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=buf, offset=offsets[name])
+        for name, (shape, dtype) in shapes.items()
+    }
+
+
+def current_generation(prefix):
+    """Generation the control block points at, or None"""
+    try:
+        control = _open(f'{prefix}_ctl')
+    except FileNotFoundError:
+        return None
+    try:
+        generation = int(np.ndarray((1,), dtype=np.int64, buffer=control.buf)[0])
+    finally:
+        control.close()
+    return generation or None
+
+
+def publish_generation(prefix, keys, encodings, watermark, index=None):
+    """Write a gallery into a new shared-memory generation and make it current
+
+    A generation block starts with a 128-byte header (format, count, dim,
+    id width, whether ids are integers, IVF list count and trained size,
+    key-table type bounds) followed by the float32 encodings, their squared
+    norms, the key table of ``gallery_keys.key_arrays`` and, when
+    ``index`` is given, the ``publish_index`` lists. The watermark goes into
+    the control block's sidecar JSON.
+    It is fully written before the control block's generation number is
+    replaced, so attaching workers never see a partial gallery.
+    """
+    if len(keys):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(len(keys), -1)
+    else:
+        encodings = np.empty((0, ENCODING_DIM), dtype=np.float32)
+    count, dim = encodings.shape
+    key_table = key_arrays(keys)
+    id_width = key_table['ids'].dtype.itemsize
+    n_lists = len(index['centroids']) if index is not None else 0
+    _, size = _layout(count, dim, id_width, n_lists)
+
+    try:
+        control = _open(f'{prefix}_ctl')
+    except FileNotFoundError:
+        control = _open(f'{prefix}_ctl', create=True, size=4096)
+    try:
+        slot = np.ndarray((1,), dtype=np.int64, buffer=control.buf)
+        generation = int(slot[0]) + 1
+        name = f'{prefix}_{generation}'
+        _unlink(name)
+        block = _open(name, create=True, size=size)
+        try:
+            np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=block.buf)[:] = (
+                SHM_FORMAT, count, dim, id_width, key_table['int_ids'], n_lists,
+                index['trained_size'] if index is not None else 0, *key_table['type_bounds']
+            )
+            arrays = _arrays(block.buf, count, dim, id_width, n_lists)
+            arrays['encodings'][:] = encodings
+            arrays['sq_norms'][:] = np.einsum('ij,ij->i', encodings, encodings)
+            for field in ('types', 'ids', 'order', 'sorted_ids'):
+                arrays[field][:] = key_table[field]
+            if n_lists:
+                for field in ('centroids', 'offsets', 'rows'):
+                    arrays[field][:] = index[field]
+            del arrays
+        finally:
+            block.close()
+        meta = json.dumps({'generation': generation, 'watermark': watermark, 'published_at': time.time()}).encode()
+        control.buf[16:16 + len(meta)] = meta
+        np.ndarray((1,), dtype=np.int64, buffer=control.buf, offset=8)[0] = len(meta)
+        slot[0] = generation
+        del slot
+    finally:
+        control.close()
+    if generation > KEEP_GENERATIONS:
+        # Workers still mapping an old generation keep it alive until they
+        # detach; unlinking only removes the name
+        _unlink(f'{prefix}_{generation - KEEP_GENERATIONS}')
+    return generation
+
+
+def read_control(prefix):
+    """Sidecar metadata of the current generation (watermark and so on)"""
+    try:
+        control = _open(f'{prefix}_ctl')
+    except FileNotFoundError:
+        return None
+    try:
+        length = int(np.ndarray((1,), dtype=np.int64, buffer=control.buf, offset=8)[0])
+        return json.loads(bytes(control.buf[16:16 + length])) if length else None
+    finally:
+        control.close()
+
+
+def attach_generation(prefix, generation):
+    """Map one generation read-only
+
+    Returns a dict with ``generation``, ``block`` (keep it open while the
+    arrays are in use), ``keys`` (a KeyTable), read-only ``encodings`` and
+    ``sq_norms`` and ``index`` (the published IVF lists, or None), or None
+    when it is gone or unreadable.
+    """
+    try:
+        block = _open(f'{prefix}_{generation}')
+    except FileNotFoundError:
+        return None
+    header = [int(v) for v in np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=block.buf)]
+    fmt, count, dim, id_width, int_ids, n_lists, trained_size = header[:7]
+    if fmt != SHM_FORMAT:
+        block.close()
+        return None
+    arrays = _arrays(block.buf, count, dim, id_width, n_lists)
+    for array in arrays.values():
+        array.flags.writeable = False
+    index = None
+    if n_lists:
+        index = {field: arrays[field] for field in ('centroids', 'offsets', 'rows')}
+        index['trained_size'] = trained_size
+    return {
+        'generation': generation,
+        'block': block,
+        'keys': KeyTable(
+            arrays['types'], arrays['ids'], bool(int_ids), arrays['order'], arrays['sorted_ids'],
+            np.asarray(header[7:], dtype=np.int64)
+        ),
+        'encodings': arrays['encodings'],
+        'sq_norms': arrays['sq_norms'],
+        'index': index,
+    }
+
+
+class SharedGallerySyncer(threading.Thread):
+    """Keeps a gallery attached to the newest shared-memory generation
+
+    Works like ``gallery_snapshot.SnapshotSyncer`` without the disk: one
+    process per host (whoever holds the lock file) asks
+    ``fetch_changes(since)`` for changed face rows every ``interval``
+    seconds, or sooner when another process calls ``request_sync``
+    (re-reading an ``overlap`` before the watermark, see GallerySync), drops
+    keys missing from ``fetch_keys()`` every ``reconcile_interval`` seconds,
+    and publishes a new generation with its IVF lists when anything
+    changed. Every process re-attaches its gallery when the generation
+    moves, so the matrix, key table and index exist once per host.
+    ``on_attach(generation)`` is called after every re-attach.
+    """
+
+    def __init__(self, prefix, gallery, fetch_changes, fetch_keys=None, interval=5,
+                 reconcile_interval=600, on_attach=None, overlap=DEFAULT_OVERLAP):
+        super().__init__(daemon=True, name='face-shm-sync')
+        self.prefix = prefix
+        self.gallery = gallery
+        self.fetch_changes = fetch_changes
+        self.fetch_keys = fetch_keys
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.on_attach = on_attach
+        self.overlap = overlap
+        self.recent = RecentRows()
+        self.requests = SyncRequests(os.path.join(tempfile.gettempdir(), f'{prefix}.requests'))
+        self.attached_generation = None
+        self.attached_watermark = None
+        self.last_reconcile_at = None
+        self.publishes = 0
+        self.rows_skipped = 0
+        self._attached = []
+        self._stop_event = threading.Event()
+        self._lock_file = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _is_writer(self):
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(tempfile.gettempdir(), f'{self.prefix}.lock'), 'a')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        return True
+
+    def request_sync(self, reconcile=False):
+        """Ask the publisher to pick up a change to the face tables now"""
+        self.requests.request(reconcile)
+
+    def attach_current(self):
+        """Point the gallery at the current generation if it is newer"""
+        generation = current_generation(self.prefix)
+        if generation is None or generation == self.attached_generation:
+            return False
+        attached = attach_generation(self.prefix, generation)
+        if attached is None:
+            return False
+        self.gallery.attach(attached['keys'], attached['encodings'], attached['sq_norms'], attached['index'])
+        self.attached_generation = generation
+        self.attached_watermark = (read_control(self.prefix) or {}).get('watermark')
+        self._attached.append(attached)
+        self._release_old()
+        if self.on_attach is not None:
+            self.on_attach({'generation': generation, 'watermark': self.attached_watermark})
+        return True
+
+    def _release_old(self):
+        # Searches that started on an older generation may still hold views
+        # of it; such blocks stay open until a later swap
+        keep = []
+        for attached in self._attached[:-KEEP_GENERATIONS]:
+            attached['keys'] = attached['encodings'] = attached['sq_norms'] = attached['index'] = None
+            try:
+                attached['block'].close()
+            except BufferError:
+                keep.append(attached)
+        self._attached = keep + self._attached[-KEEP_GENERATIONS:]
+
+    def _published(self, copy):
+        """Current generation, or None when there is no readable one
+
+        Returns ``{'keys', 'encodings', 'watermark', 'index'}``; the keys,
+        encodings and IVF centroids are private copies only when ``copy`` is
+        set.
+        """
+        generation = current_generation(self.prefix)
+        attached = attach_generation(self.prefix, generation) if generation else None
+        if attached is None:
+            return None
+        try:
+            index = attached['index']
+            return {
+                'keys': list(attached['keys']) if copy else None,
+                'encodings': np.array(attached['encodings']) if copy else None,
+                'watermark': (read_control(self.prefix) or {}).get('watermark'),
+                'index': {'centroids': np.array(index['centroids']), 'trained_size': index['trained_size']}
+                if copy and index is not None else None,
+            }
+        finally:
+            attached['keys'] = attached['encodings'] = attached['sq_norms'] = attached['index'] = None
+            index = None
+            attached['block'].close()
+
+    def _reconcile_due(self):
+        return bool(self.reconcile_interval) and (
+            self.last_reconcile_at is None or time.time() - self.last_reconcile_at >= self.reconcile_interval
+        )
+
+    def sync_once(self, reconcile=False):
+        """Publish changed rows as a new generation (publisher only), then re-attach"""
+        if self._is_writer():
+            current = self._published(copy=False)
+            since = overlap_since(current['watermark'] if current else None, self.overlap)
+            rows = checked_rows(self.recent.fresh(list(self.fetch_changes(since))), self.gallery.dim)
+            self.rows_skipped += sum(encoding is None for _, encoding, _ in rows)
+            reconcile = self.fetch_keys is not None and (reconcile or self._reconcile_due())
+            present = set(self.fetch_keys()) if reconcile else None
+            if rows or present is not None or current is None:
+                # Only now copy the published gallery out to merge into it
+                published = self._published(copy=True) if current else None
+                keys, encodings, watermark, changed = apply_changes(published, rows, present)
+                if changed:
+                    index = publish_index(
+                        encodings, self.gallery.ann_min_size, self.gallery.n_lists, published and published['index']
+                    )
+                    publish_generation(self.prefix, keys, encodings, watermark, index)
+                    self.publishes += 1
+                if reconcile:
+                    self.last_reconcile_at = time.time()
+                self.recent.remember(rows, since)
+        return self.attach_current()
+
+    def run(self):
+        next_poll = time.monotonic() + self.interval
+        while not self._stop_event.wait(REQUEST_POLL):
+            try:
+                requested, reconcile = self.requests.take() if self._is_writer() else (False, False)
+                if requested or time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.interval
+                    self.sync_once(reconcile)
+                else:
+                    self.attach_current()
+            except Exception as e:
+                print(f"Error syncing shared face gallery: {e}")
+
+    def stats(self):
+        meta = read_control(self.prefix) or {}
+        return {
+            'generation': self.attached_generation,
+            'published_generation': meta.get('generation'),
+            'watermark': self.attached_watermark,
+            'gallery_size': len(self.gallery),
+            'publisher': self._lock_file is not None,
+            'publishes': self.publishes,
+            'rows_skipped': self.rows_skipped,
+            'open_generations': len(self._attached),
+        }
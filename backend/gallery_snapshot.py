@@ -0,0 +1,335 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from face_gallery import ENCODING_DIM, publish_index
+from gallery_keys import KeyTable, key_arrays
+from gallery_sync import DEFAULT_OVERLAP, REQUEST_POLL, RecentRows, SyncRequests, checked_rows, overlap_since
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process syncs for itself
+    fcntl = None
+
+# Bump when the on-disk layout changes; older snapshots are then ignored
+SNAPSHOT_FORMAT = 2
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = '.lock'
+REQUEST_FILE = 'REQUESTS'
+KEY_ARRAYS = ('types', 'ids', 'order', 'sorted_ids')
+INDEX_ARRAYS = ('centroids', 'offsets', 'rows')
+KEEP_VERSIONS = 2
+
+
+def current_version(directory):
+    """Name of the snapshot version CURRENT points at, or None"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(directory, keys, encodings, watermark, index=None):
+    """Persist a gallery as a new snapshot version and make it current
+
+    A version is a directory holding ``encodings.npy`` (float32 N x 128),
+    ``sq_norms.npy`` (their squared norms), the key table arrays of
+    ``gallery_keys.key_arrays`` (``types.npy``, ``ids.npy``, ``order.npy``,
+    ``sorted_ids.npy``), the ``publish_index`` lists when the gallery is
+    indexed (``ivf_centroids.npy``, ``ivf_offsets.npy``, ``ivf_rows.npy``)
+    and ``meta.json`` (format, row count, the rest of the key table and the
+    ``updated_at`` watermark it is current to). Every array is memory-mapped
+    by the readers.
+    It is fully written under a temporary name before being renamed into
+    place and published by atomically replacing CURRENT, so readers never
+    see a partial snapshot.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = current_version(directory)
+    number = int(previous[1:]) + 1 if previous else 1
+    version = f"v{number:06d}"
+    final_path = os.path.join(directory, version)
+    tmp_path = final_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    encodings = np.asarray(encodings, dtype=np.float32)
+    np.save(os.path.join(tmp_path, 'encodings.npy'), encodings)
+    np.save(os.path.join(tmp_path, 'sq_norms.npy'), np.einsum('ij,ij->i', encodings, encodings))
+    key_table = key_arrays(keys)
+    for name in KEY_ARRAYS:
+        np.save(os.path.join(tmp_path, f'{name}.npy'), key_table[name])
+    if index is not None:
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(tmp_path, f'ivf_{name}.npy'), index[name])
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({
+            'format': SNAPSHOT_FORMAT,
+            'version': version,
+            'count': len(keys),
+            'int_ids': key_table['int_ids'],
+            'type_bounds': key_table['type_bounds'].tolist(),
+            'ivf_trained_size': index['trained_size'] if index is not None else None,
+            'watermark': watermark,
+            'created_at': time.time(),
+        }, f)
+    os.rename(tmp_path, final_path)
+
+    current_tmp = os.path.join(directory, CURRENT_FILE + '.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+
+    _prune_versions(directory, version)
+    return version
+
+
+def _prune_versions(directory, keep_from):
+    versions = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith('v') and not name.endswith('.tmp')
+    )
+    for name in versions[:-KEEP_VERSIONS]:
+        if name != keep_from:
+            # Workers may still have the old files mapped; POSIX keeps them
+            # alive until unmapped, elsewhere removal simply waits a round
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def read_snapshot(directory):
+    """Memory-map the current snapshot
+
+    Returns a dict with ``version``, ``watermark``, ``keys`` (a KeyTable),
+    read-only ``encodings`` and ``sq_norms`` memmaps and ``index`` (the
+    ``publish_index`` lists, or None), or None when there is no usable
+    snapshot.
+    """
+    version = current_version(directory)
+    if version is None:
+        return None
+    path = os.path.join(directory, version)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            return None
+        # Empty arrays cannot be mapped
+        mmap_mode = 'r' if meta['count'] else None
+
+        def load(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        keys = KeyTable(
+            load('types'), load('ids'), meta['int_ids'], load('order'), load('sorted_ids'),
+            np.asarray(meta['type_bounds'], dtype=np.int64)
+        )
+        index = None
+        if meta.get('ivf_trained_size') is not None:
+            index = {name: load(f'ivf_{name}') for name in INDEX_ARRAYS}
+            index['trained_size'] = meta['ivf_trained_size']
+        encodings = load('encodings')
+        sq_norms = load('sq_norms')
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error reading face snapshot {version}: {e}")
+        return None
+    return {
+        'version': version,
+        'watermark': meta.get('watermark'),
+        'keys': keys,
+        'encodings': encodings,
+        'sq_norms': sq_norms,
+        'index': index,
+    }
+
+
+def merge_rows(snapshot, rows):
+    """Apply changed ``(key, encoding, updated_at)`` rows to a snapshot
+
+    Returns ``(keys, encodings, watermark)`` for the merged gallery. Rows
+    with a None encoding (see ``gallery_sync.checked_rows``) only move the
+    watermark.
+    """
+    keys = list(snapshot['keys']) if snapshot else []
+    base = snapshot['encodings'] if snapshot else np.empty((0, ENCODING_DIM), dtype=np.float32)
+    watermark = snapshot['watermark'] if snapshot else None
+    positions = {key: i for i, key in enumerate(keys)}
+    updates = {}
+    appended = []
+    for key, encoding, updated_at in rows:
+        if encoding is None:
+            pass
+        elif key in positions:
+            updates[positions[key]] = encoding
+        else:
+            positions[key] = len(keys)
+            keys.append(key)
+            appended.append(encoding)
+        if updated_at and (watermark is None or updated_at > watermark):
+            watermark = updated_at
+    parts = [np.asarray(base, dtype=np.float32)] if len(base) else []
+    if appended:
+        parts.append(np.asarray(appended, dtype=np.float32))
+    if len(parts) > 1:
+        encodings = np.concatenate(parts)
+    else:
+        encodings = np.array(parts[0] if parts else base, dtype=np.float32)
+    for position, encoding in updates.items():
+        encodings[position] = encoding
+    return keys, encodings, watermark
+
+
+def apply_changes(published, rows, present=None):
+    """Merge changed rows into a published gallery and drop deleted keys
+
+    ``published`` is None or a dict with ``keys``, ``encodings`` and
+    ``watermark``; ``present`` is the set of keys still in the face tables,
+    or None to skip the deletion check. Returns
+    ``(keys, encodings, watermark, changed)``.
+    """
+    if rows:
+        keys, encodings, watermark = merge_rows(published, rows)
+    elif published:
+        keys, encodings, watermark = list(published['keys']), published['encodings'], published['watermark']
+    else:
+        keys, encodings, watermark = [], np.empty((0, ENCODING_DIM), dtype=np.float32), None
+    changed = bool(rows) or published is None
+    if present is not None:
+        live = [i for i, key in enumerate(keys) if key in present]
+        if len(live) < len(keys):
+            keys, encodings = [keys[i] for i in live], np.asarray(encodings)[live]
+            changed = True
+    return keys, encodings, watermark, changed
+
+
+class SnapshotSyncer(threading.Thread):
+    """Keeps a gallery attached to the newest on-disk snapshot
+
+    One process per host (whoever holds the directory lock) is the
+    publisher: every ``interval`` seconds, or sooner when another process
+    asks with ``request_sync``, it asks ``fetch_changes(since)`` for face
+    rows updated since the snapshot's watermark (less an ``overlap``, see
+    GallerySync), drops keys missing from ``fetch_keys()`` every
+    ``reconcile_interval`` seconds, and writes a new version with its IVF
+    lists when anything changed (rows with unusable encodings are logged,
+    counted and only move the watermark). Every process re-attaches its
+    gallery when CURRENT moves, so all workers map the same files and share
+    one page-cache copy of the matrix, key table and index; attached galleries
+    are never written to. ``on_attach(snapshot)`` is called after every
+    re-attach.
+    """
+
+    def __init__(self, directory, gallery, fetch_changes, fetch_keys=None, interval=5,
+                 reconcile_interval=600, on_attach=None, overlap=DEFAULT_OVERLAP):
+        super().__init__(daemon=True, name='face-snapshot-sync')
+        self.directory = directory
+        self.gallery = gallery
+        self.fetch_changes = fetch_changes
+        self.fetch_keys = fetch_keys
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.on_attach = on_attach
+        self.overlap = overlap
+        self.recent = RecentRows()
+        self.requests = SyncRequests(os.path.join(directory, REQUEST_FILE))
+        self.attached_version = None
+        self.attached_watermark = None
+        self.last_reconcile_at = None
+        self.publishes = 0
+        self.rows_skipped = 0
+        self._stop_event = threading.Event()
+        self._lock_file = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _is_writer(self):
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(os.path.join(self.directory, LOCK_FILE), 'a')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        return True
+
+    def request_sync(self, reconcile=False):
+        """Ask the publisher to pick up a change to the face tables now"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.requests.request(reconcile)
+
+    def attach_current(self):
+        """Point the gallery at the current snapshot if it is newer"""
+        version = current_version(self.directory)
+        if version is None or version == self.attached_version:
+            return False
+        snapshot = read_snapshot(self.directory)
+        if snapshot is None:
+            return False
+        self.gallery.attach(snapshot['keys'], snapshot['encodings'], snapshot['sq_norms'], snapshot['index'])
+        self.attached_version = snapshot['version']
+        self.attached_watermark = snapshot['watermark']
+        if self.on_attach is not None:
+            self.on_attach(snapshot)
+        return True
+
+    def _reconcile_due(self):
+        return bool(self.reconcile_interval) and (
+            self.last_reconcile_at is None or time.time() - self.last_reconcile_at >= self.reconcile_interval
+        )
+
+    def sync_once(self, reconcile=False):
+        """Write changed rows into a new snapshot (publisher only), then re-attach"""
+        if self._is_writer():
+            snapshot = read_snapshot(self.directory)
+            since = overlap_since(snapshot['watermark'] if snapshot else None, self.overlap)
+            rows = checked_rows(self.recent.fresh(list(self.fetch_changes(since))), self.gallery.dim)
+            self.rows_skipped += sum(encoding is None for _, encoding, _ in rows)
+            reconcile = self.fetch_keys is not None and (reconcile or self._reconcile_due())
+            present = set(self.fetch_keys()) if reconcile else None
+            if rows or present is not None or snapshot is None:
+                keys, encodings, watermark, changed = apply_changes(snapshot, rows, present)
+                if changed:
+                    index = publish_index(
+                        encodings, self.gallery.ann_min_size, self.gallery.n_lists, snapshot and snapshot['index']
+                    )
+                    write_snapshot(self.directory, keys, encodings, watermark, index)
+                    self.publishes += 1
+                if reconcile:
+                    self.last_reconcile_at = time.time()
+                self.recent.remember(rows, since)
+        return self.attach_current()
+
+    def run(self):
+        next_poll = time.monotonic() + self.interval
+        while not self._stop_event.wait(REQUEST_POLL):
+            try:
+                requested, reconcile = self.requests.take() if self._is_writer() else (False, False)
+                if requested or time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.interval
+                    self.sync_once(reconcile)
+                else:
+                    self.attach_current()
+            except Exception as e:
+                print(f"Error syncing face snapshot: {e}")
+
+    def stats(self):
+        return {
+            'version': self.attached_version,
+            'published_version': current_version(self.directory),
+            'watermark': self.attached_watermark,
+            'gallery_size': len(self.gallery),
+            'publisher': self._lock_file is not None,
+            'publishes': self.publishes,
+            'rows_skipped': self.rows_skipped,
+        }
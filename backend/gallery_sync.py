@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Seconds before the watermark that every poll reads again: rows stamped by
+# a transaction that committed after a later one, or with an equal
+# timestamp, are still picked up
+DEFAULT_OVERLAP = 30
+# Seconds between a publisher's checks for sync requests (and a follower's
+# checks for a newly published snapshot)
+REQUEST_POLL = 0.5
+
+
+def _parse_timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def overlap_since(watermark, overlap):
+    """Lower bound (inclusive) to read changes from: ``overlap`` seconds
+    before the watermark"""
+    at = _parse_timestamp(watermark) if watermark else None
+    if at is None:
+        return watermark
+    return datetime.fromtimestamp(at - overlap, timezone.utc).isoformat()
+
+
+def row_problem(encoding, dim):
+    """Why a change-feed encoding cannot go into a ``dim``-d gallery, or None
+
+    ``fetch_changes`` yields None for rows whose stored text did not decode.
+    """
+    if encoding is None:
+        return 'encoding could not be decoded'
+    shape = np.shape(encoding)
+    if shape != (dim,):
+        return f'encoding has shape {shape}, expected ({dim},)'
+    if not np.isfinite(encoding).all():
+        return 'encoding has non-finite values'
+    return None
+
+
+def checked_rows(rows, dim):
+    """``rows`` with every unusable encoding logged and replaced by None
+
+    The rows are kept rather than dropped so their ``updated_at`` still
+    moves the watermark: a bad row is skipped once, not on every poll.
+    """
+    checked = []
+    for key, encoding, updated_at in rows:
+        problem = row_problem(encoding, dim)
+        if problem is not None:
+            print(f"Skipping face row {key} updated at {updated_at}: {problem}")
+            encoding = None
+        checked.append((key, encoding, updated_at))
+    return checked
+
+
+class RecentRows:
+    """Change-feed rows already applied from the overlap window
+
+    Because every poll re-reads the window, the same rows come back until
+    the watermark has moved past them. They are recognised by key and
+    ``updated_at`` and forgotten once they are older than the window.
+    """
+
+    def __init__(self):
+        self._seen = {}
+
+    def fresh(self, rows):
+        return [row for row in rows if row[2] is None or self._seen.get(row[0]) != row[2]]
+
+    def remember(self, rows, since):
+        for key, _, updated_at in rows:
+            if updated_at is not None:
+                self._seen[key] = updated_at
+        horizon = _parse_timestamp(since) if since else None
+        if horizon is not None:
+            self._seen = {
+                key: updated_at for key, updated_at in self._seen.items()
+                if (_parse_timestamp(updated_at) or horizon) >= horizon
+            }
+
+    def clear(self):
+        self._seen = {}
+
+
+class SyncRequests:
+    """Requests from any process for the gallery publisher to sync now
+
+    Requesters append one byte to a file (``r`` when a deletion should be
+    reconciled too); the publisher looks at what was appended since its
+    last check. Requests only shorten the wait, the publisher still polls
+    on its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.handled = 0
+
+    def request(self, reconcile=False):
+        with open(self.path, 'ab') as f:
+            f.write(b'r' if reconcile else b's')
+
+    def take(self):
+        """``(requested, reconcile)`` for requests made since the last call"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size <= self.handled:
+            self.handled = size
+            return False, False
+        with open(self.path, 'rb') as f:
+            f.seek(self.handled)
+            data = f.read(size - self.handled)
+        self.handled = size
+        return True, b'r' in data
+
+
+class GallerySync(threading.Thread):
+    """Change-feed sync of a FaceGallery with the face tables
+
+    Every ``interval`` seconds ``fetch_changes(since)`` is asked for the
+    ``(key, encoding, updated_at)`` rows updated at or after ``overlap``
+    seconds before the newest ``updated_at`` applied so far, and the rows
+    not applied yet are upserted (in batches of ``batch_size``). The gallery
+    publishes each changed row with a slot swap, so searches keep running
+    without a lock while it applies. Rows whose encoding is unusable (see
+    ``row_problem``) are logged, counted in ``rows_skipped`` and stepped
+    over.
+
+    Deleted rows leave no ``updated_at`` behind, so every
+    ``reconcile_interval`` seconds ``fetch_keys()`` lists the keys still in
+    the tables and enrolled keys missing from it are removed.
+    """
+
+    def __init__(self, gallery, fetch_changes, fetch_keys=None, interval=5,
+                 reconcile_interval=600, batch_size=1000, overlap=DEFAULT_OVERLAP):
+        super().__init__(daemon=True, name='face-gallery-sync')
+        self.gallery = gallery
+        self.fetch_changes = fetch_changes
+        self.fetch_keys = fetch_keys
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.watermark = None
+        self.recent = RecentRows()
+        self.polls = 0
+        self.failures = 0
+        self.rows_applied = 0
+        self.rows_removed = 0
+        self.rows_skipped = 0
+        self.last_batch_rows = 0
+        self.last_sync_at = None
+        self.last_reconcile_at = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._sync_lock = threading.Lock()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def prime(self, watermark):
+        """Start the feed after rows already loaded up to ``watermark``"""
+        if watermark and (self.watermark is None or watermark > self.watermark):
+            self.watermark = watermark
+
+    def rewind(self, watermark):
+        """Re-read changes after ``watermark``, e.g. once the gallery has been
+        replaced by an older snapshot"""
+        with self._sync_lock:
+            self.watermark = watermark
+            self.recent.clear()
+
+    def sync_once(self):
+        """Apply every row changed since the watermark; returns how many"""
+        with self._sync_lock:
+            applied = 0
+            since = overlap_since(self.watermark, self.overlap)
+            watermark = self.watermark
+            batch = []
+            for row in self.fetch_changes(since):
+                batch.append(row)
+                if row[2] and (watermark is None or row[2] > watermark):
+                    watermark = row[2]
+                if len(batch) >= self.batch_size:
+                    applied += self._apply(batch, since)
+                    batch = []
+            if batch:
+                applied += self._apply(batch, since)
+            # Only advance once everything up to it has been applied
+            self.watermark = watermark
+            self.polls += 1
+            self.rows_applied += applied
+            self.last_batch_rows = applied
+            self.last_sync_at = time.time()
+            return applied
+
+    def _apply(self, rows, since):
+        rows = checked_rows(self.recent.fresh(rows), self.gallery.dim)
+        usable = [row for row in rows if row[1] is not None]
+        self.rows_skipped += len(rows) - len(usable)
+        if usable:
+            self.gallery.upsert_many([key for key, _, _ in usable], [encoding for _, encoding, _ in usable])
+        self.recent.remember(rows, since)
+        return len(usable)
+
+    def reconcile(self):
+        """Drop enrolled identities whose face row no longer exists"""
+        with self._sync_lock:
+            # Keys are listed before the tables are read: a face enrolled in
+            # between is in the table but not in this list, never the reverse
+            enrolled = self.gallery.keys
+            present = set(self.fetch_keys())
+            removed = self.gallery.remove_many([key for key in enrolled if key not in present])
+            self.rows_removed += removed
+            self.last_reconcile_at = time.time()
+            return removed
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sync_once()
+                if self.fetch_keys is not None and self.reconcile_interval and (
+                    self.last_reconcile_at is None
+                    or time.time() - self.last_reconcile_at >= self.reconcile_interval
+                ):
+                    self.reconcile()
+                self.last_error = None
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"Error syncing face gallery: {e}")
+
+    def stats(self):
+        now = time.time()
+        watermark_at = _parse_timestamp(self.watermark) if self.watermark else None
+        return {
+            'gallery_size': len(self.gallery),
+            'watermark': self.watermark,
+            # Seconds since the last successful poll, and since the newest
+            # face change that has been applied
+            'sync_lag_seconds': now - self.last_sync_at if self.last_sync_at else None,
+            'watermark_age_seconds': now - watermark_at if watermark_at else None,
+            'polls': self.polls,
+            'failures': self.failures,
+            'rows_applied': self.rows_applied,
+            'rows_removed': self.rows_removed,
+            'rows_skipped': self.rows_skipped,
+            'last_batch_rows': self.last_batch_rows,
+            'last_error': self.last_error,
+        }
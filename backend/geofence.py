@@ -0,0 +1,191 @@
+import json
+import math
+from collections import defaultdict
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters; all arguments broadcast as arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def unit_vectors(lats, lons):
+    """Points on the unit sphere; chord length between them gives distance"""
+    lats, lons = np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+def invalid_points(lats, lons):
+    """Indices of points that are not real coordinates: NaN, infinite, or
+    latitude beyond 90 / longitude beyond 180 degrees"""
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(lats) & np.isfinite(lons) & (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+    return np.flatnonzero(~valid)
+
+
+class Fence:
+    """One boundary of a campus: a circle or a polygon (building, hostel, ...)
+
+    Polygons are stored in a local equirectangular frame (meters east/north
+    of their first vertex). Over a few kilometres that projection is far
+    more accurate than a phone's GPS fix, and it turns the containment test
+    into plain planar ray casting.
+    """
+
+    def __init__(self, campus_index, zone_id, center=None, radius_meters=None, polygon=None):
+        self.campus_index = campus_index
+        self.zone_id = zone_id
+        self.radius_meters = radius_meters
+        if polygon is not None:
+            vertices = np.asarray(polygon, dtype=np.float64)
+            self.origin = vertices[0]
+            self.cos_lat = math.cos(math.radians(self.origin[0]))
+            self.xs, self.ys = self._project(vertices[:, 0], vertices[:, 1])
+            self.bbox = (vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max())
+            self.center = None
+        else:
+            self.center = (float(center[0]), float(center[1]))
+            dlat = radius_meters / METERS_PER_DEGREE
+            dlon = dlat / max(math.cos(math.radians(self.center[0])), 1e-6)
+            self.bbox = (self.center[0] - dlat, self.center[1] - dlon, self.center[0] + dlat, self.center[1] + dlon)
+
+    @property
+    def is_polygon(self):
+        return self.center is None
+
+    def _project(self, lats, lons):
+        xs = (np.asarray(lons) - self.origin[1]) * METERS_PER_DEGREE * self.cos_lat
+        ys = (np.asarray(lats) - self.origin[0]) * METERS_PER_DEGREE
+        return xs, ys
+
+    def contains(self, lats, lons):
+        """Boolean mask of which points fall inside this fence"""
+        if not self.is_polygon:
+            return haversine_m(lats, lons, self.center[0], self.center[1]) <= self.radius_meters
+        px, py = self._project(lats, lons)
+        x1, y1 = self.xs, self.ys
+        x2, y2 = np.roll(self.xs, -1), np.roll(self.ys, -1)
+        # Even-odd ray casting, points x edges in one broadcast
+        px, py = px[:, None], py[:, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        return np.count_nonzero(crosses & (px < x_at), axis=1) % 2 == 1
+
+
+class GeofenceIndex:
+    """Many campuses, each a circle plus optional polygon zones
+
+    Fences are bucketed into a lat/lon grid of ``cell_degrees`` cells, so a
+    point is only tested against the handful of fences overlapping its cell
+    and the per-point cost does not grow with the number of campuses.
+    """
+
+    def __init__(self, campuses, cell_degrees=0.01):
+        self.campuses = campuses
+        self.cell_degrees = cell_degrees
+        self.fences = []
+        for campus_index, campus in enumerate(campuses):
+            if campus.get('center') and campus.get('radius_meters'):
+                self.fences.append(Fence(campus_index, None, campus['center'], campus['radius_meters']))
+            for zone in campus.get('zones', []):
+                self.fences.append(Fence(campus_index, zone['id'], polygon=zone['polygon']))
+        centers = np.asarray(
+            [campus.get('center') or _polygon_centroid(campus) for campus in campuses], dtype=np.float64
+        ).reshape(-1, 2)
+        self.center_vectors = unit_vectors(centers[:, 0], centers[:, 1])
+        self.grid = defaultdict(list)
+        for fence_index, fence in enumerate(self.fences):
+            min_lat, min_lon, max_lat, max_lon = fence.bbox
+            for i in range(self._cell(min_lat), self._cell(max_lat) + 1):
+                for j in range(self._cell(min_lon), self._cell(max_lon) + 1):
+                    self.grid[(i, j)].append(fence_index)
+
+    def _cell(self, degrees):
+        return int(math.floor(degrees / self.cell_degrees))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load campuses from a JSON file: {"campuses": [{"id", "name",
+        "center": [lat, lon], "radius_meters", "zones": [{"id", "polygon":
+        [[lat, lon], ...]}]}]}"""
+        with open(path) as f:
+            return cls(json.load(f)['campuses'])
+
+    def locate_many(self, lats, lons):
+        """Vectorized lookup for many points
+
+        Returns ``(campus_index, zone_ids, distances)``: the campus each point
+        is inside (-1 if none), the polygon zone it is in (None for the campus
+        circle or outside), and the distance in meters to the nearest campus
+        center. Raises ValueError if any point is not a real coordinate
+        (see ``invalid_points``).
+        """
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        lons = np.asarray(lons, dtype=np.float64).reshape(-1)
+        invalid = invalid_points(lats, lons)
+        if len(invalid):
+            raise ValueError(f'Point {int(invalid[0])} is not a valid latitude/longitude')
+        campus_index = np.full(len(lats), -1, dtype=np.int64)
+        zone_ids = [None] * len(lats)
+
+        # Group points by grid cell, then test each candidate fence once
+        # against all of the points in the cells it overlaps
+        cells_i = np.floor(lats / self.cell_degrees).astype(np.int64)
+        cells_j = np.floor(lons / self.cell_degrees).astype(np.int64)
+        # Pack (i, j) into one integer so grouping is a 1-D sort
+        packed = (cells_i << 32) + (cells_j + (1 << 31))
+        order = np.argsort(packed, kind='stable')
+        cells, bounds = np.unique(packed[order], return_index=True)
+        bounds = np.append(bounds, len(order))
+        points_by_fence = defaultdict(list)
+        for cell_number, cell in enumerate(cells.tolist()):
+            i, j = cell >> 32, (cell & 0xFFFFFFFF) - (1 << 31)
+            for fence_index in self.grid.get((i, j), ()):
+                points_by_fence[fence_index].append(order[bounds[cell_number]:bounds[cell_number + 1]])
+        for fence_index, point_groups in points_by_fence.items():
+            fence = self.fences[fence_index]
+            points = np.concatenate(point_groups)
+            inside = points[fence.contains(lats[points], lons[points])]
+            if fence.is_polygon:
+                # Zones are more specific than the campus circle, so they win
+                campus_index[inside] = fence.campus_index
+                for point in inside.tolist():
+                    zone_ids[point] = fence.zone_id
+            else:
+                unset = inside[campus_index[inside] < 0]
+                campus_index[unset] = fence.campus_index
+
+        if len(self.center_vectors):
+            # Nearest center = largest dot product of unit vectors, one GEMM;
+            # the chord length then converts exactly to great-circle meters
+            dots = unit_vectors(lats, lons) @ self.center_vectors.T
+            chord = np.sqrt(np.maximum(2.0 - 2.0 * dots.max(axis=1), 0.0))
+            distances = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord / 2, 1.0))
+        else:
+            distances = np.full(len(lats), np.inf)
+        return campus_index, zone_ids, distances
+
+    def locate(self, latitude, longitude):
+        """Single-point lookup returning a dict"""
+        campus_index, zone_ids, distances = self.locate_many([latitude], [longitude])
+        index = int(campus_index[0])
+        campus = self.campuses[index] if index >= 0 else None
+        return {
+            'is_within_campus': index >= 0,
+            'campus_id': campus.get('id') if campus else None,
+            'zone_id': zone_ids[0],
+            'distance': float(distances[0]),
+        }
+
+
+def _polygon_centroid(campus):
+    vertices = np.asarray([v for zone in campus.get('zones', []) for v in zone['polygon']], dtype=np.float64)
+    return vertices.mean(axis=0) if len(vertices) else (0.0, 0.0)
@@ -0,0 +1,27 @@
+"""Gunicorn settings for the attendance API
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master and forked into the workers, which
+then load the gallery and start their background jobs in ``post_fork``
+(threads and process pools do not survive a fork).
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+# Every worker has its own face engine pool and admission slots; the app
+# sizes them to an equal share of the cores
+os.environ['SERVER_PROCESSES'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+preload_app = True
+# Loading the gallery and warming the indexes happens before a worker
+# answers its first request
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+
+def post_fork(server, worker):
+    import app
+
+    app.init_app()
@@ -0,0 +1,146 @@
+import base64
+import struct
+
+# JPEG start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and
+# CC (DAC) share the range but are not frames
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+
+class ImageRejected(Exception):
+    """Uploaded image is missing, too large or not a supported format"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _jpeg_dimensions(data):
+    pos = 2
+    while pos + 9 < len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        pos += 2 + segment_length
+    return None
+
+
+def _webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    return None
+
+
+def image_dimensions(data):
+    """(width, height) read from a JPEG, PNG or WebP header, or None"""
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_dimensions(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _webp_dimensions(data)
+    return None
+
+
+def check_image(data, max_bytes, max_side):
+    """Reject oversized payloads and images before they are decoded"""
+    if not data:
+        raise ImageRejected('No image provided')
+    if len(data) > max_bytes:
+        raise ImageRejected(f'Image exceeds {max_bytes} bytes', 413)
+    dimensions = image_dimensions(data)
+    if dimensions is None:
+        raise ImageRejected('Unsupported or corrupt image (JPEG, PNG or WebP expected)')
+    if max(dimensions) > max_side:
+        raise ImageRejected(f'Image is {dimensions[0]}x{dimensions[1]}, largest side allowed is {max_side}px', 413)
+    return data
+
+
+def decode_data_url(image_data, max_bytes):
+    """Bytes of a base64 image or data URL, size-checked before decoding"""
+    if not image_data:
+        raise ImageRejected('No image provided')
+    encoded = image_data.split(',', 1)[-1]
+    # base64 carries 3 bytes in every 4 characters
+    if len(encoded) * 3 // 4 > max_bytes + 2:
+        raise ImageRejected(f'Image exceeds {max_bytes} bytes', 413)
+    return base64.b64decode(encoded)
+
+
+def read_image_bytes(request, data, field, max_bytes, max_side, files=None, body=None):
+    """Raw image bytes from a Flask (or Quart) request
+
+    Accepts a multipart upload in ``field``, a raw ``image/*`` body, or the
+    legacy JSON base64 data URL in ``data[field]``. The byte limit is applied
+    before the upload is read or the base64 text is decoded. Quart callers
+    await the request's files or body themselves and pass them as ``files``
+    and ``body``.
+    """
+    content_type = request.mimetype or ''
+    if content_type == 'multipart/form-data':
+        upload = (request.files if files is None else files).get(field)
+        if upload is None:
+            raise ImageRejected('No image provided')
+        image_bytes = upload.stream.read(max_bytes + 1)
+    elif content_type in RAW_IMAGE_TYPES:
+        if request.content_length is not None and request.content_length > max_bytes:
+            raise ImageRejected(f'Image exceeds {max_bytes} bytes', 413)
+        image_bytes = request.get_data(cache=False) if body is None else body
+    else:
+        image_bytes = decode_data_url(data.get(field), max_bytes)
+    return check_image(image_bytes, max_bytes, max_side)
+
+
+def read_burst_frames(request, data, field, max_frames, max_bytes, max_side, max_total_bytes):
+    """Encoded frames of a burst from a Flask request
+
+    Accepts repeated multipart uploads named ``field`` or a JSON list of
+    base64 data URLs in ``data[field]``. The frame count is checked before
+    anything is read, and the total size before every frame is read.
+    """
+    if (request.mimetype or '') == 'multipart/form-data':
+        uploads = request.files.getlist(field)
+        sources = [upload.stream for upload in uploads]
+    else:
+        sources = data.get(field) or []
+        if not isinstance(sources, list):
+            raise ImageRejected(f'{field} must be a list of images')
+    if not sources:
+        raise ImageRejected('No frames provided')
+    if len(sources) > max_frames:
+        raise ImageRejected(f'At most {max_frames} frames per burst', 413)
+
+    frames, total = [], 0
+    for source in sources:
+        if isinstance(source, str) or source is None:
+            frame = decode_data_url(source, max_bytes)
+        else:
+            frame = source.read(max_bytes + 1)
+        total += len(frame)
+        if total > max_total_bytes:
+            raise ImageRejected(f'Burst exceeds {max_total_bytes} bytes', 413)
+        frames.append(check_image(frame, max_bytes, max_side))
+    return frames
+
+
+def request_fields(request):
+    """Form fields of a JSON body, a multipart form or a raw-body query string"""
+    if request.is_json:
+        return request.get_json() or {}
+    data = request.args.to_dict()
+    data.update(request.form.to_dict())
+    return data
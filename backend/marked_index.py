@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime, timedelta
+
+from attendance_journal import idempotency_key
+
+
+def today_string():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def stored_marked_keys(client, tables, date, page_size=1000):
+    """Yield the idempotency key of every mark stored in the database for ``date``
+
+    ``tables`` lists the ``(user_type, table, id column)`` of each
+    attendance table; rows keep their day in ``date``.
+    """
+    for user_type, table_name, id_field in tables:
+        start = 0
+        while True:
+            response = client.table(table_name).select('*').eq('date', date) \
+                .range(start, start + page_size - 1).execute()
+            for row in response.data:
+                yield idempotency_key(user_type, row[id_field], date, row.get('subject_id'), row.get('time_slot'))
+            if len(response.data) < page_size:
+                break
+            start += page_size
+
+
+def marked_query(client, table_name, id_field, user_id, date, subject_id=None):
+    """Query for a user's stored mark on ``date`` (sync or async client)"""
+    query = client.table(table_name).select('*').eq(id_field, user_id).eq('date', date)
+    if subject_id:
+        query = query.eq('subject_id', subject_id)
+    return query
+
+
+class MarkedIndex:
+    """In-process set of the attendance marks already made today
+
+    Holds the idempotency keys (see ``attendance_journal.idempotency_key``)
+    of one day only. ``load_day(date)`` yields every key for a date; it is
+    called at startup and again just after midnight. Past ``max_entries``
+    keys the index stops answering and callers fall back to querying the
+    database, so memory stays bounded however busy the day gets.
+    """
+
+    def __init__(self, load_day, max_entries=200000):
+        self.load_day = load_day
+        self.max_entries = max_entries
+        self.date = None
+        self.complete = False
+        self.warmed_at = None
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def warm(self, date=None):
+        """Rebuild the index from every mark recorded for ``date``"""
+        date = date or today_string()
+        keys = set()
+        complete = True
+        for key in self.load_day(date):
+            if len(keys) >= self.max_entries:
+                complete = False
+                break
+            keys.add(key)
+        with self._lock:
+            self.date = date
+            self._keys = keys
+            self.complete = complete
+            self.warmed_at = datetime.now()
+
+    def is_marked(self, key, date):
+        """True/False from memory, or None when the index cannot answer"""
+        with self._lock:
+            if date != self.date:
+                return None
+            if key in self._keys:
+                return True
+            return False if self.complete else None
+
+    def add(self, key, date):
+        with self._lock:
+            if date != self.date:
+                return
+            if len(self._keys) >= self.max_entries:
+                self.complete = False
+                return
+            self._keys.add(key)
+
+    def _run(self):
+        while True:
+            now = datetime.now()
+            midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=1, microsecond=0)
+            threading.Event().wait((midnight - now).total_seconds())
+            try:
+                self.warm()
+            except Exception as e:
+                print(f"Error warming attendance index: {e}")
+
+    def start(self):
+        """Re-warm the index for the new day at every midnight"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='marked-index')
+            self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'date': self.date,
+                'entries': len(self._keys),
+                'max_entries': self.max_entries,
+                'complete': self.complete,
+                'warmed_at': self.warmed_at.isoformat() if self.warmed_at else None,
+            }
@@ -0,0 +1,241 @@
+"""Minimal Prometheus metrics: counters, gauges and histograms with labels.
+
+Rendered in the Prometheus text exposition format by ``Registry.render``.
+Histograms created with a ``timing_prefix`` also hand every observation to
+the request being timed (``start_request``), so it can be returned in a
+``Server-Timing`` header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(Metric):
+    """A gauge set directly, or read from ``function`` at scrape time
+
+    With labels, ``function`` returns a dict of label values (a tuple, or
+    a plain value for a single label) to gauge values.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+                if not self.labelnames:
+                    return [(self.name, '', value)]
+                return [
+                    (self.name, _labels(self.labelnames, key if isinstance(key, tuple) else (key,)), item)
+                    for key, item in sorted(value.items())
+                ]
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, timing_prefix=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.timing_prefix = timing_prefix
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += seconds
+            entry[2] += 1
+        if self.timing_prefix is not None:
+            record_stage(self.timing_prefix + '_'.join(key), seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames, key, [('le', _number(bound))])
+                samples.append((f'{self.name}_bucket', labels, cumulative))
+            samples.append((f'{self.name}_sum', _labels(self.labelnames, key), total))
+            samples.append((f'{self.name}_count', _labels(self.labelnames, key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, timing_prefix=None):
+        return self.register(Histogram(name, documentation, labelnames, buckets, timing_prefix))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+def start_request():
+    """Begin collecting stage timings for the current request/context"""
+    return _request_stages.set([])
+
+
+def end_request(token):
+    """Stop collecting; returns the [(stage, seconds)] seen by the request"""
+    stages = _request_stages.get()
+    _request_stages.reset(token)
+    return stages or []
+
+
+def record_stage(stage, seconds):
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+def server_timing(stages, total_seconds):
+    """Server-Timing header value; repeated stages are summed"""
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in totals.items()]
+    parts.append(f'total;dur={total_seconds * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _request_labels(request):
+    # PostgREST paths end in the table (or rpc function) name
+    return {'table': request.url.path.rstrip('/').rsplit('/', 1)[-1] or '/', 'method': request.method}
+
+
+def instrument_httpx(session, histogram, errors):
+    """Time every request of an httpx client by table and method
+
+    Uses the client's event hooks, so it works for the postgrest sessions of
+    both the sync and async Supabase clients. Responses with status >= 400
+    are counted as errors; requests that fail before a response surface as
+    exceptions to the caller and show up only in its own error counters.
+    """
+    import httpx
+
+    def on_request(request):
+        request.extensions['metrics_started'] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get('metrics_started')
+        labels = _request_labels(response.request)
+        if started is not None:
+            histogram.observe(time.perf_counter() - started, **labels)
+        if response.status_code >= 400:
+            errors.inc(**labels)
+
+    if isinstance(session, httpx.AsyncClient):
+        async def async_request(request):
+            on_request(request)
+
+        async def async_response(response):
+            on_response(response)
+
+        hooks = {'request': [async_request], 'response': [async_response]}
+    else:
+        hooks = {'request': [on_request], 'response': [on_response]}
+    session.event_hooks = {
+        name: session.event_hooks.get(name, []) + hooks[name] for name in ('request', 'response')
+    }
+    return session
@@ -0,0 +1,84 @@
+"""Re-encode stored face encodings into a compact format.
+
+Pages through student_faces and faculty_faces and rewrites every row whose
+encoding is not already in the target format (see face_codec). Each
+rewrite only applies if the row still holds the encoding that was read, so
+a face re-enrolled meanwhile is never overwritten; such rows are reported
+as skipped. The face tables' trigger bumps updated_at on every rewrite, so
+live backends pick the re-encoded vectors up through their change feed.
+The backend reads old and new rows alike, so this can run while it is live.
+
+    python migrate_face_encodings.py --format f16 --dry-run
+    python migrate_face_encodings.py --format f16
+"""
+import argparse
+import os
+
+from face_codec import FORMATS, decode_face_encoding, encode_face_encoding, encoding_format
+
+FACE_TABLES = [
+    ('student_faces', 'student_id'),
+    ('faculty_faces', 'faculty_id'),
+]
+
+
+def migrate_table(supabase, table_name, id_field, fmt, page_size, dry_run):
+    """Returns (rows seen, rows rewritten, rows skipped, characters before, characters after)"""
+    seen = rewritten = skipped = chars_before = chars_after = 0
+    start = 0
+    while True:
+        response = supabase.table(table_name).select(f'{id_field}, face_encoding') \
+            .order(id_field).range(start, start + page_size - 1).execute()
+        for row in response.data:
+            seen += 1
+            encoded = row['face_encoding']
+            chars_before += len(encoded)
+            if encoding_format(encoded) == fmt:
+                chars_after += len(encoded)
+                continue
+            compact = encode_face_encoding(decode_face_encoding(encoded), fmt)
+            chars_after += len(compact)
+            if dry_run:
+                rewritten += 1
+                continue
+            # Compare-and-set: no row comes back if the encoding changed since
+            updated = supabase.table(table_name).update({'face_encoding': compact}) \
+                .eq(id_field, row[id_field]).eq('face_encoding', encoded).execute()
+            if updated.data:
+                rewritten += 1
+            else:
+                skipped += 1
+                print(f"{table_name}: skipped {id_field}={row[id_field]}, its encoding changed during the migration")
+        if len(response.data) < page_size:
+            break
+        # Rewrites keep the row order by id, so paging stays stable
+        start += page_size
+    return seen, rewritten, skipped, chars_before, chars_after
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-encode stored face encodings into a compact format')
+    parser.add_argument('--format', choices=FORMATS, default=os.getenv('FACE_ENCODING_FORMAT', 'f16'))
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    for table_name, id_field in FACE_TABLES:
+        seen, rewritten, skipped, before, after = migrate_table(
+            supabase, table_name, id_field, args.format, args.page_size, args.dry_run
+        )
+        ratio = before / after if after else 1.0
+        print(
+            f"{table_name}: {seen} rows, {rewritten} {'to rewrite' if args.dry_run else 'rewritten'}, "
+            f"{skipped} skipped (changed meanwhile; run again to convert them), "
+            f"{before} -> {after} chars ({ratio:.1f}x smaller)"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from face_gallery import match_result
+from marked_index import today_string
+
+
+class RosterIndex:
+    """Candidate encodings for one class session
+
+    Holds a private copy of the roster's gallery rows, so a 1:N match
+    against a class only scans the few dozen students who can be in it.
+    """
+
+    def __init__(self, roster, keys, encodings, sq_norms, version):
+        self.roster = roster
+        self.keys = keys
+        self.encodings = encodings
+        self.sq_norms = sq_norms
+        self.version = version
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match_many(self, probes, tolerance=0.6):
+        """Nearest roster identity for each probe (same result shape as
+        ``FaceGallery.match_many``)"""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        if not self.keys:
+            return [match_result([], tolerance) for _ in probes]
+        sq_dist = self.sq_norms[None, :] - 2.0 * (probes @ self.encodings.T)
+        sq_dist += np.einsum('ij,ij->i', probes, probes)[:, None]
+        dist = np.sqrt(np.maximum(sq_dist, 0.0))
+        top = np.argsort(dist, axis=1)[:, :2]
+        return [
+            match_result([(self.keys[i], float(row_dist[i])) for i in row_top], tolerance)
+            for row_top, row_dist in zip(top, dist)
+        ]
+
+
+class RosterIndexes:
+    """Lazily built ``RosterIndex`` per (subject_id, time_slot, date)
+
+    ``load_roster(subject_id, time_slot)`` returns the student ids of a
+    session. An index is built on first use, rebuilt when the gallery has
+    changed since, and reloaded from the roster table after ``ttl``
+    seconds. Sessions of earlier days are dropped as soon as the date
+    rolls over, and beyond ``max_sessions`` the least recently used
+    session is evicted.
+    """
+
+    def __init__(self, gallery, load_roster, max_sessions=256, ttl=900, clock=None):
+        self.gallery = gallery
+        self.load_roster = load_roster
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock or time.monotonic
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict_ended(self, date):
+        for key in [key for key in self._sessions if key[2] != date]:
+            del self._sessions[key]
+            self.evictions += 1
+
+    def get(self, subject_id, time_slot, date=None):
+        """Index for a session, or None when its roster is empty"""
+        date = date or today_string()
+        key = (subject_id, time_slot or None, date)
+        with self._lock:
+            self._evict_ended(date)
+            entry = self._sessions.get(key)
+            if entry is not None:
+                index, roster, loaded_at = entry
+                self._sessions.move_to_end(key)
+                fresh = self.clock() - loaded_at < self.ttl
+                if fresh and (index is None or index.version == self.gallery.version):
+                    self.hits += 1
+                    return index
+        # Build outside the lock; concurrent builds of one session are
+        # harmless, the last one wins
+        if entry is not None and self.clock() - loaded_at < self.ttl:
+            roster = entry[1]
+        else:
+            roster, loaded_at = list(self.load_roster(subject_id, time_slot)), self.clock()
+        index = self._build(roster) if roster else None
+        with self._lock:
+            self.builds += 1
+            self._sessions[key] = (index, roster, loaded_at)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return index
+
+    def _build(self, roster):
+        keys, encodings, sq_norms, version = self.gallery.gather([('student', student_id) for student_id in roster])
+        return RosterIndex(roster, keys, encodings, sq_norms, version)
+
+    def invalidate(self, subject_id=None):
+        """Forget every session, or the sessions of one subject"""
+        with self._lock:
+            for key in [key for key in self._sessions if subject_id is None or key[0] == subject_id]:
+                del self._sessions[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'candidates': sum(len(index) for index, _, _ in self._sessions.values() if index is not None),
+                'builds': self.builds,
+                'hits': self.hits,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+
+# Tokens are standard HS256 JWTs, so any JWT library can read them
+HEADER = {'alg': 'HS256', 'typ': 'JWT'}
+
+
+class TokenError(Exception):
+    """Missing, malformed, expired or revoked session token"""
+
+    def __init__(self, message, status_code=401):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class RevocationList:
+    """Token ids revoked before their expiry
+
+    Entries are dropped once the token they name would have expired anyway,
+    so the list only ever holds tokens that are still otherwise valid.
+    """
+
+    def __init__(self):
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, jti):
+        return jti in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self._prune()
+
+    def update(self, entries):
+        """Merge (jti, expires_at) pairs, e.g. loaded from shared storage"""
+        with self._lock:
+            self._revoked.update(entries)
+            self._prune()
+
+    def _prune(self):
+        now = time.time()
+        for jti in [jti for jti, expires_at in self._revoked.items() if expires_at < now]:
+            del self._revoked[jti]
+
+
+class TokenIssuer:
+    """Issues and verifies signed access/refresh token pairs
+
+    Verification is an HMAC and a dict lookup: no database call and no
+    password hashing. Callers revoke a refresh token when they ``reissue``
+    from it, so each refresh token works once.
+    """
+
+    def __init__(self, secret, access_ttl=900, refresh_ttl=7 * 86400, revoked=None):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.revoked = revoked if revoked is not None else RevocationList()
+
+    def _sign(self, signing_input):
+        return hmac.new(self.secret, signing_input.encode(), hashlib.sha256).digest()
+
+    def encode(self, claims):
+        signing_input = '.'.join(
+            _b64encode(json.dumps(part, separators=(',', ':')).encode()) for part in (HEADER, claims)
+        )
+        return f'{signing_input}.{_b64encode(self._sign(signing_input))}'
+
+    def decode(self, token):
+        """Claims of a correctly signed token (expiry is not checked here)"""
+        try:
+            header, payload, signature = token.split('.')
+            expected = self._sign(f'{header}.{payload}')
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                raise TokenError('Invalid token signature')
+            if json.loads(_b64decode(header)).get('alg') != HEADER['alg']:
+                raise TokenError('Unsupported token algorithm')
+            return json.loads(_b64decode(payload))
+        except TokenError:
+            raise
+        except Exception:
+            raise TokenError('Malformed token')
+
+    def issue(self, subject, user_type, **extra):
+        """New access and refresh tokens for a user"""
+        now = int(time.time())
+        tokens = {}
+        for kind, ttl in (('access', self.access_ttl), ('refresh', self.refresh_ttl)):
+            claims = dict(extra, sub=str(subject), user_type=user_type, typ=kind,
+                          iat=now, exp=now + ttl, jti=uuid.uuid4().hex)
+            tokens[f'{kind}_token'] = self.encode(claims)
+        tokens['expires_in'] = self.access_ttl
+        return tokens
+
+    def verify(self, token, kind='access'):
+        """Claims of a valid, unexpired, unrevoked token of the given kind"""
+        claims = self.decode(token)
+        if claims.get('typ') != kind:
+            raise TokenError(f'Expected a {kind} token')
+        if claims.get('exp', 0) < time.time():
+            raise TokenError('Token expired')
+        if claims.get('jti') in self.revoked:
+            raise TokenError('Token revoked')
+        return claims
+
+    def reissue(self, claims):
+        """New token pair for the user named by verified ``claims``"""
+        extra = {k: v for k, v in claims.items() if k not in ('sub', 'user_type', 'typ', 'iat', 'exp', 'jti')}
+        return self.issue(claims['sub'], claims['user_type'], **extra)
+
+    def revoke(self, claims):
+        self.revoked.add(claims['jti'], claims['exp'])
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Shed, TokenBucket
+
+
+def controller(capacity=1, reserved=0, **lanes):
+    shed = []
+    admission = AdmissionController(capacity, reserved, on_shed=lambda *args: shed.append(args))
+    for name, (priority, max_queue, timeout) in lanes.items():
+        admission.add_lane(name, priority, max_queue, timeout)
+    return admission, shed
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def test_full_queue_sheds_immediately():
+    admission, shed = controller(mark=(0, 0, 1))
+    admission.acquire('mark')
+
+    with pytest.raises(Shed) as excinfo:
+        admission.acquire('mark', 'mark-attendance')
+    assert excinfo.value.reason == 'queue_full'
+    assert shed == [('mark', 'mark-attendance', 'queue_full')]
+
+    admission.release('mark')
+    admission.acquire('mark')
+    assert admission.stats()['running'] == 1
+
+
+def test_waiter_times_out_and_is_skipped_later():
+    admission, _ = controller(mark=(0, 1, 0.05))
+    admission.acquire('mark')
+
+    with pytest.raises(Shed) as excinfo:
+        admission.acquire('mark')
+    assert excinfo.value.reason == 'timeout'
+    lane = admission.stats()['lanes']['mark']
+    assert lane['queue_depth'] == 0 and lane['shed']['timeout'] == 1
+
+    # The abandoned waiter must not be handed the freed slot
+    admission.release('mark')
+    assert admission.stats()['running'] == 0
+    admission.acquire('mark')
+
+
+def test_freed_slot_goes_to_the_highest_priority_waiter():
+    admission, _ = controller(mark=(0, 5, 5), enroll=(2, 5, 5))
+    admission.acquire('mark')
+    order = []
+
+    def wait_for(lane):
+        with admission.slot(lane):
+            order.append(lane)
+
+    threads = []
+    for lane in ('enroll', 'enroll', 'mark'):
+        threads.append(threading.Thread(target=wait_for, args=(lane,)))
+        threads[-1].start()
+        wait_until(lambda: admission.stats()['queue_depth'] == len(threads))
+
+    admission.release('mark')
+    for thread in threads:
+        thread.join()
+    assert order == ['mark', 'enroll', 'enroll']
+    assert admission.stats()['running'] == 0
+
+
+def test_reserved_slots_are_kept_for_priority_zero():
+    admission, _ = controller(capacity=2, reserved=1, mark=(0, 0, 1), enroll=(2, 0, 1))
+    admission.acquire('enroll')
+
+    with pytest.raises(Shed):
+        admission.acquire('enroll')
+    admission.acquire('mark')
+    assert admission.stats()['lanes']['mark']['running'] == 1
+
+
+def test_rate_limited_endpoint_is_shed_with_retry_after():
+    admission, shed = controller(capacity=4, detect=(1, 0, 1))
+    admission.limit('detect-faces', rate=0.5, burst=1)
+
+    admission.acquire('detect', 'detect-faces')
+    with pytest.raises(Shed) as excinfo:
+        admission.acquire('detect', 'detect-faces')
+    assert excinfo.value.reason == 'rate_limited'
+    assert excinfo.value.retry_after == 2
+    # Other endpoints in the lane are not limited
+    admission.acquire('detect', 'other')
+    assert shed == [('detect', 'detect-faces', 'rate_limited')]
+
+
+def test_token_bucket_refills_at_its_rate():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0
+    # Idle time refills no more than the burst
+    now[0] += 10
+    assert [bucket.take() for _ in range(3)] == [0, 0, pytest.approx(0.5)]
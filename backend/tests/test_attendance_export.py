@@ -0,0 +1,86 @@
+import base64
+import json
+import re
+
+import pytest
+
+from attendance_export import InvalidCursor, decode_cursor, encode_cursor, iter_rows, page_query
+
+KEYSET_FILTER = re.compile(r'date\.gt\.([^,]+),and\(date\.eq\.([^,]+),id\.gt\.([^)]+)\)')
+
+
+class FakeQuery:
+    """Ordered (date, id) rows with just enough of the PostgREST builder"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.limit_count = None
+
+    def or_(self, filters):
+        self.filters.append(filters)
+        date, same_date, row_id = KEYSET_FILTER.fullmatch(filters).groups()
+        assert date == same_date
+        self.rows = [
+            row for row in self.rows
+            if row['date'] > date or (row['date'] == date and row['id'] > int(row_id))
+        ]
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def execute(self):
+        return type('Response', (), {'data': sorted(self.rows, key=lambda r: (r['date'], r['id']))[:self.limit_count]})
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('row_id', [42, '42', '0f8fad5b-d9cb-469f-a165-70867728950e'])
+def test_cursor_round_trip(row_id):
+    cursor = encode_cursor({'date': '2026-01-05', 'id': row_id})
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == ('2026-01-05', str(row_id))
+
+
+def test_uuid_ids_are_normalised():
+    cursor = encode_cursor({'date': '2026-01-05', 'id': '0F8FAD5B-D9CB-469F-A165-70867728950E'})
+    assert decode_cursor(cursor)[1] == '0f8fad5b-d9cb-469f-a165-70867728950e'
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    raw_cursor(['2026-01-05']),
+    raw_cursor({'date': '2026-01-05', 'id': 1}),
+    raw_cursor(['2026-01-05', '1),id.gt.0']),
+    raw_cursor(['2026-01-05', '1,user_id.eq.someone']),
+    raw_cursor(['2026-01-05)', 1]),
+    raw_cursor(['2026-13-40', 1]),
+    raw_cursor(['05/01/2026', 1]),
+    raw_cursor(['2026-01-05', -1]),
+    raw_cursor(['2026-01-05', True]),
+    raw_cursor(['2026-01-05', None]),
+    raw_cursor(['2026-01-05', 1.5]),
+    raw_cursor([20260105, 1]),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_filter_only_carries_validated_values():
+    query = page_query(lambda select: FakeQuery([]), ['date'], 10, encode_cursor({'date': '2026-01-05', 'id': 7}))
+    assert query.filters == ['date.gt.2026-01-05,and(date.eq.2026-01-05,id.gt.7)']
+
+
+def test_pages_cover_every_row_once():
+    rows = [{'date': f'2026-01-0{1 + i // 4}', 'id': i, 'status': 'present'} for i in range(10)]
+    streamed = list(iter_rows(lambda select: FakeQuery(list(rows)), ['id', 'status'], 3))
+    assert [row['id'] for row in streamed] == list(range(10))
+    assert streamed[0] == {'id': 0, 'status': 'present'}
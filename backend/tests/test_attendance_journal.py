@@ -0,0 +1,202 @@
+import pytest
+
+from attendance_journal import AttendanceJournal, idempotency_key, row_rejected
+
+# Columns of the attendance tables in app/sql/create_python_attendance_tables.sql
+TABLE_COLUMNS = {
+    'student_attendance': {'student_id', 'date', 'time', 'subject_id', 'time_slot', 'latitude', 'longitude',
+                           'face_confidence', 'geo_verified', 'idempotency_key'},
+    'faculty_attendance': {'faculty_id', 'date', 'time', 'latitude', 'longitude', 'face_confidence',
+                           'geo_verified', 'idempotency_key'},
+}
+
+
+class APIError(Exception):
+    """Shape of a postgrest APIError: the SQLSTATE or PostgREST code in ``code``"""
+
+    def __init__(self, code):
+        super().__init__(f'database error {code}')
+        self.code = code
+
+
+class FakeClient:
+    """Upserts into a dict keyed by idempotency key
+
+    ``down`` fails every request like a network outage. Columns the table
+    does not have are refused like PostgREST does (PGRST204), and rows with
+    a NULL id column like a NOT NULL violation.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = []
+        self.down = False
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.payloads = []
+
+    def upsert(self, payloads, on_conflict='', ignore_duplicates=False):
+        self.payloads = payloads
+        return self
+
+    def execute(self):
+        self.client.calls.append(len(self.payloads))
+        if self.client.down:
+            raise ConnectionError('connection refused')
+        columns = TABLE_COLUMNS[self.name]
+        if any(set(payload) - columns for payload in self.payloads):
+            raise APIError('PGRST204')
+        id_column = 'student_id' if self.name == 'student_attendance' else 'faculty_id'
+        if any(payload.get(id_column) is None for payload in self.payloads):
+            raise APIError('23502')
+        for payload in self.payloads:
+            self.client.rows.setdefault(payload['idempotency_key'], payload)
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def journal(tmp_path, client):
+    return AttendanceJournal(str(tmp_path / 'journal.db'), client, batch_size=10, max_attempts=3)
+
+
+def attendance_data(user_type, user_id, subject='math'):
+    """A mark as record_mark builds it"""
+    return {
+        'user_id': user_id,
+        'user_type': user_type,
+        'date': '2026-01-05',
+        'time': '09:05:00',
+        'latitude': 18.5,
+        'longitude': 73.8,
+        'face_confidence': 0.93,
+        'geo_verified': True,
+        'subject_id': subject if user_type == 'student' else None,
+        'time_slot': '09:00' if user_type == 'student' else None,
+    }
+
+
+def mark(journal, user_id, subject='math', user_type='student'):
+    row = attendance_data(user_type, user_id, subject)
+    key = idempotency_key(user_type, user_id, row['date'], row['subject_id'], row['time_slot'])
+    return journal.append(f'{user_type}_attendance', row, key)
+
+
+def test_append_is_durable_and_deduplicated(tmp_path, client, journal):
+    assert mark(journal, 's1')
+    assert not mark(journal, 's1')
+
+    reopened = AttendanceJournal(str(tmp_path / 'journal.db'), client)
+    assert reopened.stats()['pending'] == 1
+    assert reopened.pending_payloads('student_attendance')[0]['user_id'] == 's1'
+
+
+def test_flush_upserts_pending_rows(client, journal):
+    for student_id in ('s1', 's2', 's3'):
+        mark(journal, student_id)
+
+    assert journal.flush_once() == 3
+    assert client.calls == [3]
+    assert len(client.rows) == 3
+    assert journal.stats()['pending'] == 0
+    assert journal.flush_once() == 0
+
+
+def test_outage_retries_the_batch_without_counting_attempts(client, journal):
+    mark(journal, 's1')
+    client.down = True
+    for _ in range(journal.max_attempts + 2):
+        with pytest.raises(ConnectionError):
+            journal.flush_once()
+
+    stats = journal.stats()
+    assert stats['pending'] == 1
+    assert stats['dead_letters'] == 0
+    assert stats['failures'] == journal.max_attempts + 2
+
+    client.down = False
+    assert journal.flush_once() == 1
+    assert journal.stats()['pending'] == 0
+
+
+def test_rejected_row_does_not_block_the_batch(client, journal):
+    mark(journal, 's1')
+    mark(journal, None)
+    mark(journal, 's3')
+
+    # The batch is refused, then retried row by row
+    assert journal.flush_once() == 2
+    assert client.calls == [3, 1, 1, 1]
+    assert sorted(row['student_id'] for row in client.rows.values()) == ['s1', 's3']
+    stats = journal.stats()
+    assert stats['pending'] == 1
+    assert stats['rejected_total'] == 1
+
+    mark(journal, 's4')
+    assert journal.flush_once() == 1
+    assert len(client.rows) == 3
+
+
+def test_row_is_dead_lettered_after_max_attempts(client, journal):
+    mark(journal, None)
+    for _ in range(journal.max_attempts):
+        assert journal.flush_once() == 0
+
+    stats = journal.stats()
+    assert stats['pending'] == 0
+    assert stats['dead_letters'] == 1
+    assert stats['dead_lettered_total'] == 1
+    parked = journal.dead_letters()
+    assert len(parked) == 1
+    assert parked[0]['attempts'] == journal.max_attempts
+    assert parked[0]['payload']['user_id'] is None
+    assert '23502' in parked[0]['last_error']
+    assert journal.flush_once() == 0
+
+
+def test_rows_are_mapped_to_their_table_columns(client, journal):
+    mark(journal, 's1')
+    mark(journal, 'f1', user_type='faculty')
+
+    assert journal.flush_once() == 2
+    rows = {row['idempotency_key']: row for row in client.rows.values()}
+    student = rows[idempotency_key('student', 's1', '2026-01-05', 'math', '09:00')]
+    faculty = rows[idempotency_key('faculty', 'f1', '2026-01-05')]
+    assert student['student_id'] == 's1'
+    assert student['subject_id'] == 'math'
+    assert faculty['faculty_id'] == 'f1'
+    assert 'user_id' not in student and 'user_type' not in faculty
+    assert 'subject_id' not in faculty
+
+
+def test_configuration_errors_back_off_instead_of_rejecting_rows(client, journal, monkeypatch):
+    mark(journal, 's1')
+    # A schema the backend does not match: every row would be refused
+    monkeypatch.setitem(TABLE_COLUMNS, 'student_attendance', {'idempotency_key'})
+    for _ in range(journal.max_attempts + 1):
+        with pytest.raises(APIError):
+            journal.flush_once()
+
+    stats = journal.stats()
+    assert stats['pending'] == 1
+    assert stats['rejected_total'] == 0
+    assert stats['dead_letters'] == 0
+
+
+@pytest.mark.parametrize('code, rejected', [
+    ('22P02', True), ('23505', True), ('23502', True),
+    ('42501', False), ('42P01', False), ('42703', False), ('42P10', False),
+    ('PGRST204', False), ('PGRST205', False), (None, False),
+])
+def test_only_data_and_constraint_errors_are_row_errors(code, rejected):
+    assert row_rejected(APIError(code)) is rejected
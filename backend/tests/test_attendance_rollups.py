@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+
+from attendance_rollups import AttendanceRollups
+
+
+def row(student, subject, date, slot, key=None):
+    return {'user_id': student, 'subject_id': subject, 'date': date, 'time_slot': slot, 'idempotency_key': key}
+
+
+HISTORY = [
+    row('s1', 'math', '2026-01-05', 'slot_1'),
+    row('s2', 'math', '2026-01-05', 'slot_1'),
+    row('s1', 'math', '2026-01-06', 'slot_1'),
+    row('s1', 'math', '2026-01-07', 'slot_2'),
+    row('s2', 'physics', '2026-01-06', 'slot_3'),
+    row('s3', None, '2026-01-06', 'slot_3'),
+]
+
+
+@pytest.fixture
+def rollups():
+    rollups = AttendanceRollups(threshold=75)
+    rollups.rebuild(HISTORY, '2026-01-07')
+    return rollups
+
+
+def test_student_summary_counts_sessions_held(rollups):
+    summary = rollups.student_summary('s2')
+
+    assert summary['subjects'] == [
+        {'subject_id': 'math', 'attended': 1, 'held': 3, 'percentage': 33.33},
+        {'subject_id': 'physics', 'attended': 1, 'held': 1, 'percentage': 100.0},
+    ]
+    assert summary['overall_percentage'] == 50.0
+    assert rollups.student_summary('nobody') == {'student_id': 'nobody', 'subjects': [], 'overall_percentage': 0.0}
+
+
+def test_defaulters_include_roster_students_who_never_attended(rollups):
+    defaulters = rollups.defaulters('math', students=['s1', 's2', 's9'])
+
+    assert [(d['student_id'], d['attended'], d['percentage']) for d in defaulters] == [
+        ('s9', 0, 0.0), ('s2', 1, 33.33)
+    ]
+    assert [d['student_id'] for d in rollups.defaulters('math', threshold=101)] == ['s2', 's1']
+
+
+def test_trend_is_filtered_by_date(rollups):
+    assert rollups.trend('math') == [
+        {'date': '2026-01-05', 'present': 2, 'sessions': 1},
+        {'date': '2026-01-06', 'present': 1, 'sessions': 1},
+        {'date': '2026-01-07', 'present': 1, 'sessions': 1},
+    ]
+    assert [day['date'] for day in rollups.trend('math', '2026-01-06', '2026-01-06')] == ['2026-01-06']
+
+
+def test_record_adds_to_the_counters(rollups):
+    rollups.record('s2', 'math', '2026-01-08', 'slot_1')
+    rollups.record('s2', None, '2026-01-08', 'slot_1')
+
+    math = rollups.student_summary('s2')['subjects'][0]
+    assert (math['attended'], math['held']) == (2, 4)
+    assert rollups.stats()['marks'] == len(HISTORY) - 1 + 1
+
+
+def test_rebuild_counts_recent_marks_seen_twice_once():
+    rollups = AttendanceRollups()
+    flushed = row('s1', 'math', '2026-01-07', 'slot_1', 'k1')
+    # The same mark in Supabase and still in the local journal
+    rollups.rebuild([flushed, dict(flushed)], '2026-01-07')
+
+    assert rollups.student_summary('s1')['subjects'][0]['attended'] == 1
+
+
+def test_marks_recorded_during_a_rebuild_survive_it():
+    rollups = AttendanceRollups()
+    reading = threading.Event()
+
+    def history():
+        yield row('s1', 'math', '2026-01-07', 'slot_1', 'k1')
+        # A mark already in history and a new one arrive mid-rebuild
+        rollups.record('s1', 'math', '2026-01-07', 'slot_1', 'k1')
+        rollups.record('s2', 'math', '2026-01-07', 'slot_1', 'k2')
+        reading.set()
+
+    rollups.rebuild(history(), '2026-01-07')
+
+    assert reading.is_set()
+    assert rollups.stats()['marks'] == 2
+    assert rollups.student_summary('s2')['subjects'][0]['attended'] == 1
+
+
+def test_failed_rebuild_keeps_the_old_counters(rollups):
+    def broken():
+        yield row('s1', 'math', '2026-01-08', 'slot_1')
+        raise ConnectionError('connection refused')
+
+    with pytest.raises(ConnectionError):
+        rollups.rebuild(broken(), '2026-01-08')
+    assert rollups.stats()['marks'] == len(HISTORY) - 1
+
+
+def test_scheduled_rebuild_picks_up_other_workers_marks():
+    rollups = AttendanceRollups()
+    database = [row('s1', 'math', '2026-01-05', 'slot_1')]
+    rebuilt = threading.Event()
+
+    def rebuild():
+        rollups.rebuild(list(database), '2026-01-05')
+        if rollups.stats()['marks'] == 2:
+            rebuilt.set()
+
+    # Marked by another worker: only the database has it
+    database.append(row('s2', 'math', '2026-01-05', 'slot_1'))
+    rollups.start(rebuild, 0.01)
+    try:
+        assert rebuilt.wait(5)
+    finally:
+        rollups.stop()
+    assert [d['student_id'] for d in rollups.defaulters('math', threshold=101)] == ['s1', 's2']
+
+
+def test_scheduled_rebuild_failures_are_counted():
+    rollups = AttendanceRollups()
+    failed = threading.Event()
+
+    def rebuild():
+        failed.set()
+        raise ConnectionError('connection refused')
+
+    rollups.start(rebuild, 0.01)
+    try:
+        assert failed.wait(5)
+    finally:
+        rollups.stop()
+    rollups._thread.join(5)
+    assert rollups.stats()['rebuild_failures'] >= 1
+    assert rollups.stats()['last_error'] == 'connection refused'
@@ -0,0 +1,68 @@
+import base64
+import binascii
+
+import numpy as np
+import pytest
+
+from face_codec import FORMATS, PREFIX, decode_face_encoding, encode_face_encoding, encoding_format
+
+
+@pytest.fixture
+def encodings():
+    # face_recognition embeddings: 128 components of roughly +-0.3
+    return np.random.default_rng(0).normal(scale=0.1, size=(50, 128))
+
+
+def test_legacy_rows_round_trip_exactly(encodings):
+    for encoding in encodings:
+        stored = encode_face_encoding(encoding, 'f64')
+        # The historical format: base64 of the raw float64 bytes
+        assert stored == base64.b64encode(encoding.tobytes()).decode('utf-8')
+        decoded = decode_face_encoding(stored)
+        assert decoded.dtype == np.float64
+        assert np.array_equal(decoded, encoding)
+
+
+def test_f16_round_trip_is_within_half_precision(encodings):
+    for encoding in encodings:
+        decoded = decode_face_encoding(encode_face_encoding(encoding, 'f16'))
+        assert decoded.shape == (128,)
+        assert np.abs(decoded - encoding).max() <= np.abs(encoding).max() * 2 ** -11
+
+
+def test_i8_round_trip_is_within_half_a_quantization_step(encodings):
+    for encoding in encodings:
+        decoded = decode_face_encoding(encode_face_encoding(encoding, 'i8'))
+        scale = np.abs(encoding).max() / 127
+        assert decoded.shape == (128,)
+        assert np.abs(decoded - encoding).max() <= scale / 2 + 1e-6
+
+
+def test_compact_formats_keep_match_distances(encodings):
+    exact = np.linalg.norm(encodings[0] - encodings[1])
+    for fmt in FORMATS:
+        a, b = (decode_face_encoding(encode_face_encoding(e, fmt)) for e in encodings[:2])
+        assert np.linalg.norm(a - b) == pytest.approx(exact, abs=0.01)
+
+
+def test_zero_vector_survives_i8():
+    assert not decode_face_encoding(encode_face_encoding(np.zeros(128), 'i8')).any()
+
+
+def test_formats_are_detected_from_the_stored_text(encodings):
+    assert encoding_format(encode_face_encoding(encodings[0], 'f64')) == 'f64'
+    assert encoding_format(encode_face_encoding(encodings[0], 'f16')) == 'f16'
+    assert encoding_format(encode_face_encoding(encodings[0], 'i8')) == 'i8'
+    assert encode_face_encoding(encodings[0], 'f16').startswith(f'{PREFIX}:f16:')
+    # ':' is not a base64 character, so no legacy row looks versioned
+    for encoding in encodings:
+        assert ':' not in encode_face_encoding(encoding, 'f64')
+
+
+def test_unknown_and_corrupt_values_raise(encodings):
+    with pytest.raises(ValueError):
+        encode_face_encoding(encodings[0], 'f8')
+    with pytest.raises(ValueError, match='Unknown'):
+        decode_face_encoding(f'{PREFIX}:f8:AAAA')
+    with pytest.raises(binascii.Error):
+        decode_face_encoding('simulated_face_encoding_data')
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from face_gallery import ENCODING_DIM, FaceGallery
+
+
+def unit_vectors(count, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, ENCODING_DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def student_keys(count, start=0):
+    return [('student', str(i)) for i in range(start, start + count)]
+
+
+def run_readers(check, seconds=0.5, readers=3):
+    """Call ``check()`` from several threads; returns the failures seen"""
+    failures = []
+    deadline = time.monotonic() + seconds
+
+    def read():
+        while time.monotonic() < deadline:
+            failure = check()
+            if failure:
+                failures.append(failure)
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    return threads, failures
+
+
+def test_upsert_replaces_and_remove_forgets():
+    vectors = unit_vectors(3)
+    gallery = FaceGallery()
+    gallery.upsert_many(student_keys(2), vectors[:2])
+
+    gallery.upsert('student', '0', vectors[2])
+    assert len(gallery) == 2
+    assert gallery.match(vectors[2])['user_id'] == '0'
+    assert gallery.match(vectors[0])['distance'] > 0.5
+
+    assert gallery.remove('student', '0')
+    assert not gallery.remove('student', '0')
+    assert ('student', '0') not in gallery
+    assert gallery.match(vectors[2], tolerance=0.3)['matched'] is False
+
+
+def test_last_encoding_wins_within_a_batch():
+    vectors = unit_vectors(2)
+    gallery = FaceGallery()
+    gallery.upsert_many([('student', 'a'), ('student', 'a')], vectors)
+    assert len(gallery) == 1
+    assert gallery.verify('student', 'a', [vectors[1]])['distance'] == pytest.approx(0, abs=1e-5)
+
+
+@pytest.mark.parametrize('ann_min_size', [10 ** 9, 200])
+def test_searches_stay_consistent_during_writes(ann_min_size):
+    stable = unit_vectors(100, seed=1)
+    churn = unit_vectors(300, seed=2)
+    gallery = FaceGallery(capacity=16, ann_min_size=ann_min_size, nprobe=64)
+    gallery.upsert_many(student_keys(100), stable)
+    rng = np.random.default_rng(3)
+
+    def check():
+        i = int(rng.integers(100))
+        match = gallery.match(stable[i], tolerance=0.1)
+        if not match['matched'] or match['user_id'] != str(i):
+            return (i, match)
+        roster = gallery.match_subset([stable[i]], [('student', str(i)), ('student', '100')], 0.1)[0]
+        if roster['user_id'] != str(i):
+            return (i, roster)
+        return None
+
+    threads, failures = run_readers(check)
+    # Grow the matrix, re-enroll the stable faces (slot swaps) and churn others
+    writes = 0
+    while any(thread.is_alive() for thread in threads):
+        start = 100 + (writes % 3) * 100
+        gallery.upsert_many(student_keys(100, start), churn[start - 100:start])
+        gallery.upsert_many(student_keys(10, writes % 90), stable[writes % 90:writes % 90 + 10])
+        gallery.remove_many(student_keys(50, start))
+        writes += 1
+    for thread in threads:
+        thread.join()
+
+    assert writes > 1
+    assert not failures, failures[:3]
+
+
+def test_load_swaps_in_the_new_gallery_whole():
+    vectors = unit_vectors(2000)
+    keys = student_keys(2000)
+    gallery = FaceGallery()
+    gallery.load(keys, vectors)
+
+    def check():
+        size = len(gallery)
+        match = gallery.match(vectors[1234], tolerance=0.1)
+        if size != 2000 or match['user_id'] != '1234':
+            return (size, match)
+        return None
+
+    threads, failures = run_readers(check, seconds=0.3)
+    loads = 0
+    while any(thread.is_alive() for thread in threads):
+        gallery.load(keys, vectors)
+        loads += 1
+    for thread in threads:
+        thread.join()
+
+    assert loads > 1
+    assert not failures, failures[:3]
+
+
+def test_gather_returns_rows_with_their_version():
+    vectors = unit_vectors(3)
+    gallery = FaceGallery()
+    gallery.upsert_many(student_keys(3), vectors)
+
+    present, encodings, sq_norms, version = gallery.gather([('student', '2'), ('student', 'x'), ('student', '0')])
+    assert present == [('student', '2'), ('student', '0')]
+    np.testing.assert_allclose(encodings, vectors[[2, 0]])
+    np.testing.assert_allclose(sq_norms, 1.0, rtol=1e-5)
+    assert version == gallery.version and version % 2 == 0
@@ -0,0 +1,150 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from face_gallery import ENCODING_DIM, FaceGallery, ReadOnlyGallery
+from gallery_keys import KeyTable
+from gallery_shm import SharedGallerySyncer, _unlink, current_generation
+from gallery_snapshot import SnapshotSyncer
+
+
+class FaceTable:
+    """In-memory face rows with the change-feed and key-listing callbacks"""
+
+    def __init__(self, count, seed=0):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.rows = {}
+        self.clock = 0
+        for i in range(count):
+            self.put(('student' if i % 4 else 'faculty', f'u{i}'))
+
+    def put(self, key, encoding=None):
+        if encoding is None:
+            encoding = self.rng.normal(size=ENCODING_DIM).astype(np.float32)
+            encoding /= np.linalg.norm(encoding)
+        self.clock += 1
+        self.rows[key] = (encoding, f'2026-01-05T10:{self.clock // 60 % 60:02d}:{self.clock % 60:02d}+00:00')
+        return encoding
+
+    def fetch_changes(self, since=None):
+        return [(key, encoding, at) for key, (encoding, at) in self.rows.items() if since is None or at >= since]
+
+    def fetch_keys(self):
+        return list(self.rows)
+
+
+def test_key_table_maps_rows_and_keys():
+    keys = [('student', 'b'), ('faculty', 'a'), ('student', 'a'), ('faculty', 'longer-id')]
+    table = KeyTable.from_keys(keys)
+
+    assert len(table) == 4
+    assert list(table) == keys
+    assert [table.get(key) for key in keys] == [0, 1, 2, 3]
+    assert ('student', 'longer-id') not in table
+    assert table.get(('student', 'zzzzzzzzzzzzzz')) is None
+    assert table.get(('admin', 'a')) is None
+
+    int_table = KeyTable.from_keys([('student', 10), ('student', 9)])
+    assert int_table[0] == ('student', 10)
+    assert int_table.get(('student', 9)) == 1
+
+
+@pytest.fixture(params=['snapshot', 'shm'])
+def make_syncer(request, tmp_path):
+    prefix = f'test_faces_{os.getpid()}'
+
+    def make(gallery, faces):
+        if request.param == 'snapshot':
+            return SnapshotSyncer(str(tmp_path), gallery, faces.fetch_changes, faces.fetch_keys)
+        return SharedGallerySyncer(prefix, gallery, faces.fetch_changes, faces.fetch_keys)
+
+    yield make
+    if request.param == 'shm':
+        for generation in range(1, (current_generation(prefix) or 0) + 1):
+            _unlink(f'{prefix}_{generation}')
+        _unlink(f'{prefix}_ctl')
+        for suffix in ('lock', 'requests'):
+            try:
+                os.remove(os.path.join(tempfile.gettempdir(), f'{prefix}.{suffix}'))
+            except FileNotFoundError:
+                pass
+
+
+def test_followers_attach_the_published_gallery_read_only(make_syncer):
+    faces = FaceTable(600)
+    publisher_gallery, follower_gallery = FaceGallery(ann_min_size=500), FaceGallery(ann_min_size=500)
+    publisher = make_syncer(publisher_gallery, faces)
+    follower = make_syncer(follower_gallery, faces)
+    publisher.sync_once()
+    follower.sync_once()
+
+    assert follower_gallery.shared and len(follower_gallery) == 600
+    # The index and key table come with the publication, nothing is rebuilt
+    assert isinstance(follower_gallery._slots, KeyTable)
+    assert follower_gallery.index is not None and follower_gallery.index._rows is not None
+    for key, (encoding, _) in list(faces.rows.items())[::50]:
+        match = follower_gallery.match(encoding, tolerance=0.1)
+        assert (match['user_type'], match['user_id']) == key
+        assert follower_gallery.verify(*key, [encoding])['verified']
+
+    with pytest.raises(ReadOnlyGallery):
+        follower_gallery.upsert('student', 'new', np.zeros(ENCODING_DIM, dtype=np.float32))
+    with pytest.raises(ReadOnlyGallery):
+        follower_gallery.remove('student', 'u1')
+
+
+def test_requested_changes_are_published_to_followers(make_syncer):
+    faces = FaceTable(20)
+    publisher_gallery, follower_gallery = FaceGallery(), FaceGallery()
+    publisher = make_syncer(publisher_gallery, faces)
+    follower = make_syncer(follower_gallery, faces)
+    publisher.sync_once()
+    follower.sync_once()
+
+    enrolled = faces.put(('student', 'new'))
+    del faces.rows[('student', 'u1')]
+    follower.request_sync(reconcile=True)
+
+    requested, reconcile = publisher.requests.take()
+    assert requested and reconcile
+    publisher.sync_once(reconcile)
+    assert follower.attach_current()
+
+    assert follower_gallery.match(enrolled)['user_id'] == 'new'
+    assert ('student', 'u1') not in follower_gallery
+    assert len(follower_gallery) == 20
+    assert publisher.requests.take() == (False, False)
+
+
+def test_unusable_rows_are_skipped_and_the_watermark_moves_past_them(make_syncer, capsys):
+    faces = FaceTable(10)
+    # Rows that did not decode (None) or are not 128-d
+    faces.put(('student', 'undecodable'))
+    faces.rows[('student', 'undecodable')] = (None, faces.rows[('student', 'undecodable')][1])
+    faces.put(('student', 'short'), np.ones(64, dtype=np.float32))
+    gallery = FaceGallery()
+    publisher = make_syncer(gallery, faces)
+    publisher.sync_once()
+
+    assert len(gallery) == 10
+    assert ('student', 'short') not in gallery
+    assert publisher.rows_skipped == 2
+    assert publisher.attached_watermark == faces.rows[('student', 'short')][1]
+    assert 'Skipping face row' in capsys.readouterr().out
+
+    # Re-reading the overlap window does not report them again
+    publishes = publisher.publishes
+    publisher.sync_once()
+    assert publisher.publishes == publishes
+    assert publisher.rows_skipped == 2
+
+    # A good row behind a bad one still arrives
+    faces.put(('faculty', 'bad'), np.full(ENCODING_DIM, np.nan, dtype=np.float32))
+    enrolled = faces.put(('student', 'late'))
+    publisher.sync_once()
+    assert gallery.match(enrolled)['user_id'] == 'late'
+    assert publisher.rows_skipped == 3
+    assert publisher.stats()['rows_skipped'] == 3
@@ -0,0 +1,51 @@
+import numpy as np
+
+from face_gallery import ENCODING_DIM, FaceGallery
+from gallery_sync import GallerySync, checked_rows, row_problem
+
+
+def vector(seed):
+    encoding = np.random.default_rng(seed).normal(size=ENCODING_DIM).astype(np.float32)
+    return encoding / np.linalg.norm(encoding)
+
+
+def test_row_problem_names_what_is_wrong():
+    assert row_problem(vector(0), ENCODING_DIM) is None
+    assert 'decoded' in row_problem(None, ENCODING_DIM)
+    assert '(64,)' in row_problem(np.zeros(64), ENCODING_DIM)
+    assert 'non-finite' in row_problem(np.full(ENCODING_DIM, np.inf), ENCODING_DIM)
+
+
+def test_checked_rows_keep_bad_rows_without_their_encoding():
+    rows = [(('student', 'a'), vector(1), 't1'), (('student', 'b'), np.zeros(3), 't2')]
+    checked = checked_rows(rows, ENCODING_DIM)
+
+    assert [(key, at) for key, _, at in checked] == [(('student', 'a'), 't1'), (('student', 'b'), 't2')]
+    assert checked[0][1] is rows[0][1]
+    assert checked[1][1] is None
+
+
+def test_malformed_row_does_not_stop_the_feed(capsys):
+    feed = [
+        (('student', 'a'), vector(1), '2026-01-05T10:00:01+00:00'),
+        (('student', 'bad'), None, '2026-01-05T10:00:02+00:00'),
+        (('faculty', 'short'), np.ones(64, dtype=np.float32), '2026-01-05T10:00:03+00:00'),
+        (('student', 'b'), vector(2), '2026-01-05T10:00:04+00:00'),
+        (('student', 'last-bad'), None, '2026-01-05T10:00:05+00:00'),
+    ]
+    gallery = FaceGallery()
+    sync = GallerySync(gallery, lambda since: [row for row in feed if since is None or row[2] >= since],
+                       batch_size=2)
+
+    assert sync.sync_once() == 2
+    assert len(gallery) == 2
+    assert ('student', 'bad') not in gallery
+    assert gallery.match(vector(2))['user_id'] == 'b'
+    assert sync.rows_skipped == 3
+    # The watermark moved past the newest row even though it was bad
+    assert sync.watermark == '2026-01-05T10:00:05+00:00'
+    assert capsys.readouterr().out.count('Skipping face row') == 3
+
+    # The overlap window is re-read without counting the bad rows again
+    assert sync.sync_once() == 0
+    assert sync.stats()['rows_skipped'] == 3
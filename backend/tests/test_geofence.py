@@ -0,0 +1,91 @@
+import math
+
+import numpy as np
+import pytest
+
+from geofence import METERS_PER_DEGREE, GeofenceIndex, haversine_m, invalid_points
+
+CENTER = (19.90194, 74.49428)
+
+
+def offset(meters_north, meters_east=0.0, origin=CENTER):
+    """Point a given number of meters from ``origin``"""
+    lat = origin[0] + meters_north / METERS_PER_DEGREE
+    lon = origin[1] + meters_east / (METERS_PER_DEGREE * math.cos(math.radians(origin[0])))
+    return lat, lon
+
+
+@pytest.fixture
+def index():
+    # A small square hostel zone inside the main campus and a second campus
+    hostel = [offset(100, 100), offset(100, 200), offset(200, 200), offset(200, 100)]
+    return GeofenceIndex([
+        {'id': 'main', 'center': list(CENTER), 'radius_meters': 500,
+         'zones': [{'id': 'hostel', 'polygon': [list(vertex) for vertex in hostel]}]},
+        {'id': 'annex', 'center': [20.5, 75.0], 'radius_meters': 300},
+    ])
+
+
+def test_points_resolve_to_their_campus_and_zone(index):
+    assert index.locate(*CENTER) == {'is_within_campus': True, 'campus_id': 'main', 'zone_id': None, 'distance': 0.0}
+    assert index.locate(*offset(150, 150))['zone_id'] == 'hostel'
+    annex = index.locate(*offset(100, origin=(20.5, 75.0)))
+    assert annex['campus_id'] == 'annex'
+    assert annex['distance'] == pytest.approx(100, abs=0.5)
+
+
+def test_grid_only_lists_fences_near_each_cell(index):
+    main_cells = {cell for cell, fences in index.grid.items() if 0 in fences}
+    annex_cells = {cell for cell, fences in index.grid.items() if 2 in fences}
+
+    assert main_cells and annex_cells and not main_cells & annex_cells
+    # The hostel zone shares the cells of the campus circle around it
+    assert {cell for cell, fences in index.grid.items() if 1 in fences} <= main_cells
+
+
+def test_circle_boundary(index):
+    inside, outside = offset(499), offset(501)
+
+    assert index.locate(*inside)['is_within_campus']
+    assert not index.locate(*outside)['is_within_campus']
+    assert haversine_m(*inside, *CENTER) == pytest.approx(499, abs=0.5)
+
+
+def test_zone_boundary(index):
+    assert index.locate(*offset(150, 199))['zone_id'] == 'hostel'
+    just_outside = index.locate(*offset(150, 201))
+    assert just_outside['zone_id'] is None
+    assert just_outside['campus_id'] == 'main'
+
+
+def test_outside_every_campus_reports_the_nearest_center(index):
+    result = index.locate(*offset(2000))
+
+    assert result == {'is_within_campus': False, 'campus_id': None, 'zone_id': None,
+                      'distance': pytest.approx(2000, abs=1)}
+
+
+def test_locate_many_matches_locate(index):
+    points = [CENTER, offset(150, 150), offset(2000), offset(50, origin=(20.5, 75.0))]
+    campus_index, zone_ids, distances = index.locate_many([p[0] for p in points], [p[1] for p in points])
+
+    assert campus_index.tolist() == [0, 0, -1, 1]
+    assert zone_ids == [None, 'hostel', None, None]
+    for point, distance in zip(points, distances.tolist()):
+        assert index.locate(*point)['distance'] == pytest.approx(distance)
+
+
+@pytest.mark.parametrize('lat, lon', [
+    (float('nan'), CENTER[1]), (CENTER[0], float('nan')), (float('inf'), CENTER[1]),
+    (CENTER[0], float('-inf')), (91.0, CENTER[1]), (CENTER[0], 181.0),
+])
+def test_non_coordinates_are_rejected(index, lat, lon):
+    assert invalid_points([CENTER[0], lat], [CENTER[1], lon]).tolist() == [1]
+    with pytest.raises(ValueError, match='Point 1'):
+        index.locate_many([CENTER[0], lat], [CENTER[1], lon])
+    with pytest.raises(ValueError):
+        index.locate(lat, lon)
+
+
+def test_edges_of_the_coordinate_range_are_valid():
+    assert invalid_points(np.array([90.0, -90.0, 0.0]), np.array([180.0, -180.0, 0.0])).tolist() == []
@@ -0,0 +1,95 @@
+import pytest
+
+from attendance_journal import idempotency_key
+from marked_index import MarkedIndex, marked_query, stored_marked_keys
+
+# Columns of the attendance tables in app/sql/create_python_attendance_tables.sql
+TABLE_COLUMNS = {
+    'student_attendance': {'id', 'student_id', 'date', 'time', 'subject_id', 'time_slot', 'latitude', 'longitude',
+                           'face_confidence', 'geo_verified', 'created_at', 'idempotency_key'},
+    'faculty_attendance': {'id', 'faculty_id', 'date', 'time', 'latitude', 'longitude', 'face_confidence',
+                           'geo_verified', 'created_at', 'idempotency_key'},
+}
+TABLES = [('student', 'student_attendance', 'student_id'), ('faculty', 'faculty_attendance', 'faculty_id')]
+
+
+class UnknownColumn(Exception):
+    pass
+
+
+class FakeClient:
+    """Attendance rows per table; filtering on a column the table lacks
+    fails like PostgREST does"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.filters = []
+        self.bounds = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        if column not in TABLE_COLUMNS[self.name]:
+            raise UnknownColumn(f'column {self.name}.{column} does not exist')
+        self.filters.append((column, value))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        self.client.queries.append((self.name, self.filters, self.bounds))
+        data = [row for row in self.client.rows.get(self.name, [])
+                if all(row.get(column) == value for column, value in self.filters)]
+        if self.bounds:
+            data = data[self.bounds[0]:self.bounds[1] + 1]
+        return type('Response', (), {'data': data})()
+
+
+@pytest.fixture
+def client():
+    return FakeClient({
+        'student_attendance': [
+            {'student_id': f's{i}', 'date': '2026-01-05', 'subject_id': 'math', 'time_slot': 'slot_1'}
+            for i in range(5)
+        ] + [{'student_id': 's0', 'date': '2026-01-04', 'subject_id': 'math', 'time_slot': 'slot_1'}],
+        'faculty_attendance': [{'faculty_id': 'f1', 'date': '2026-01-05'}],
+    })
+
+
+def test_stored_marked_keys_read_every_page_of_the_day(client):
+    keys = list(stored_marked_keys(client, TABLES, '2026-01-05', page_size=2))
+
+    assert sorted(keys) == sorted(
+        [idempotency_key('student', f's{i}', '2026-01-05', 'math', 'slot_1') for i in range(5)]
+        + [idempotency_key('faculty', 'f1', '2026-01-05')]
+    )
+    # Student pages of 2, 2 and 1 rows
+    assert [name for name, _, _ in client.queries].count('student_attendance') == 3
+
+
+def test_marked_query_uses_each_tables_id_column(client):
+    assert marked_query(client, 'student_attendance', 'student_id', 's0', '2026-01-05', 'math').execute().data
+    assert not marked_query(client, 'student_attendance', 'student_id', 's0', '2026-01-06', 'math').execute().data
+    assert marked_query(client, 'faculty_attendance', 'faculty_id', 'f1', '2026-01-05').execute().data
+
+
+def test_index_warmed_from_stored_marks_answers_duplicates(client):
+    index = MarkedIndex(lambda date: stored_marked_keys(client, TABLES, date))
+    index.warm('2026-01-05')
+
+    assert index.is_marked(idempotency_key('student', 's3', '2026-01-05', 'math', 'slot_1'), '2026-01-05')
+    assert index.is_marked(idempotency_key('student', 's9', '2026-01-05', 'math', 'slot_1'), '2026-01-05') is False
+    assert index.is_marked(idempotency_key('student', 's3', '2026-01-06', 'math', 'slot_1'), '2026-01-06') is None
@@ -0,0 +1,109 @@
+import numpy as np
+
+from face_codec import decode_face_encoding, encode_face_encoding, encoding_format
+from migrate_face_encodings import migrate_table
+
+
+class FakeFaces:
+    """One face table with the query subset migrate_table uses
+
+    ``before_update(client)`` runs ahead of the first update, e.g. to
+    re-enroll a face between the migration's read and its write.
+    """
+
+    def __init__(self, rows, before_update=None):
+        self.rows = rows
+        self.before_update = before_update
+        self.updates = 0
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.filters = []
+        self.bounds = None
+        self.values = None
+
+    def select(self, columns):
+        return self
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def update(self, values):
+        self.values = values
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def execute(self):
+        rows = sorted(self.client.rows, key=lambda row: row['student_id'])
+        if self.values is None:
+            data = [dict(row) for row in rows[self.bounds[0]:self.bounds[1] + 1]]
+            return type('Response', (), {'data': data})()
+        if self.client.before_update is not None:
+            hook, self.client.before_update = self.client.before_update, None
+            hook(self.client)
+        self.client.updates += 1
+        matched = [row for row in rows if all(row[column] == value for column, value in self.filters)]
+        for row in matched:
+            row.update(self.values)
+        return type('Response', (), {'data': matched})()
+
+
+def vector(seed):
+    return np.random.default_rng(seed).normal(scale=0.1, size=128)
+
+
+def legacy_rows(count):
+    return [{'student_id': f's{i}', 'face_encoding': encode_face_encoding(vector(i), 'f64')} for i in range(count)]
+
+
+def test_rows_are_rewritten_in_the_target_format():
+    faces = FakeFaces(legacy_rows(5) + [{'student_id': 's9', 'face_encoding': encode_face_encoding(vector(9), 'f16')}])
+
+    seen, rewritten, skipped, before, after = migrate_table(faces, 'student_faces', 'student_id', 'f16', 2, False)
+
+    assert (seen, rewritten, skipped) == (6, 5, 0)
+    assert before > 3 * after
+    for row in faces.rows:
+        assert encoding_format(row['face_encoding']) == 'f16'
+        index = int(row['student_id'][1:])
+        assert np.abs(decode_face_encoding(row['face_encoding']) - vector(index)).max() < 1e-3
+
+
+def test_dry_run_writes_nothing():
+    faces = FakeFaces(legacy_rows(3))
+
+    assert migrate_table(faces, 'student_faces', 'student_id', 'i8', 10, True)[:3] == (3, 3, 0)
+    assert faces.updates == 0
+    assert all(encoding_format(row['face_encoding']) == 'f64' for row in faces.rows)
+
+
+def test_row_changed_during_the_migration_is_skipped_not_overwritten(capsys):
+    reenrolled = encode_face_encoding(vector(100), 'f64')
+
+    def reenroll(client):
+        client.rows[0]['face_encoding'] = reenrolled
+
+    faces = FakeFaces(legacy_rows(3), before_update=reenroll)
+    seen, rewritten, skipped, _, _ = migrate_table(faces, 'student_faces', 'student_id', 'f16', 10, False)
+
+    assert (seen, rewritten, skipped) == (3, 2, 1)
+    # The new enrollment survives; the stale compact copy was not written
+    assert faces.rows[0]['face_encoding'] == reenrolled
+    assert 'student_id=s0' in capsys.readouterr().out
+
+    # Running again converts the row that was skipped
+    assert migrate_table(faces, 'student_faces', 'student_id', 'f16', 10, False)[:3] == (3, 1, 0)
+    assert np.abs(decode_face_encoding(faces.rows[0]['face_encoding']) - vector(100)).max() < 1e-3
+
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from session_tokens import RevocationList, TokenError, TokenIssuer
+
+
+@pytest.fixture
+def issuer():
+    return TokenIssuer('test-secret', access_ttl=60, refresh_ttl=600)
+
+
+def test_issued_tokens_verify_with_their_claims(issuer):
+    tokens = issuer.issue('42', 'faculty', prn='P42')
+
+    claims = issuer.verify(tokens['access_token'])
+    assert claims['sub'] == '42'
+    assert claims['user_type'] == 'faculty'
+    assert claims['prn'] == 'P42'
+    assert claims['exp'] - claims['iat'] == 60
+    assert issuer.verify(tokens['refresh_token'], 'refresh')['typ'] == 'refresh'
+    assert tokens['expires_in'] == 60
+
+
+def test_token_kinds_are_not_interchangeable(issuer):
+    tokens = issuer.issue('42', 'student')
+    with pytest.raises(TokenError, match='Expected a access token'):
+        issuer.verify(tokens['refresh_token'])
+    with pytest.raises(TokenError, match='Expected a refresh token'):
+        issuer.verify(tokens['access_token'], 'refresh')
+
+
+def test_tampered_and_foreign_tokens_are_rejected(issuer):
+    token = issuer.issue('42', 'student')['access_token']
+    header, payload, signature = token.split('.')
+    forged = issuer.encode(dict(issuer.decode(token), user_type='admin')).split('.')[1]
+
+    with pytest.raises(TokenError, match='signature'):
+        issuer.verify(f'{header}.{forged}.{signature}')
+    with pytest.raises(TokenError, match='signature'):
+        TokenIssuer('other-secret').verify(token)
+    with pytest.raises(TokenError, match='Malformed'):
+        issuer.verify('not-a-token')
+
+
+def test_expired_tokens_are_rejected(issuer, monkeypatch):
+    tokens = issuer.issue('42', 'student')
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+
+    with pytest.raises(TokenError, match='expired'):
+        issuer.verify(tokens['access_token'])
+    # The refresh token outlives the access token
+    assert issuer.verify(tokens['refresh_token'], 'refresh')['sub'] == '42'
+
+
+def test_refresh_rotation_revokes_the_used_token(issuer):
+    tokens = issuer.issue('42', 'faculty', prn='P42')
+    claims = issuer.verify(tokens['refresh_token'], 'refresh')
+
+    # What /api/token/refresh does: revoke, then reissue
+    issuer.revoke(claims)
+    rotated = issuer.reissue(claims)
+
+    with pytest.raises(TokenError, match='revoked'):
+        issuer.verify(tokens['refresh_token'], 'refresh')
+    new_claims = issuer.verify(rotated['access_token'])
+    assert (new_claims['sub'], new_claims['user_type'], new_claims['prn']) == ('42', 'faculty', 'P42')
+    assert new_claims['jti'] != claims['jti']
+    assert issuer.verify(rotated['refresh_token'], 'refresh')
+
+
+def test_revocations_shared_between_issuers(issuer):
+    # Workers share the secret and merge each other's revocations
+    other = TokenIssuer('test-secret', revoked=RevocationList())
+    tokens = issuer.issue('42', 'student')
+    claims = issuer.verify(tokens['access_token'])
+    issuer.revoke(claims)
+
+    assert other.verify(tokens['access_token'])['sub'] == '42'
+    other.revoked.update([(claims['jti'], claims['exp'])])
+    with pytest.raises(TokenError, match='revoked'):
+        other.verify(tokens['access_token'])
+
+
+def test_revocation_list_drops_expired_entries():
+    revoked = RevocationList()
+    revoked.add('old', time.time() - 1)
+    revoked.add('live', time.time() + 60)
+
+    assert 'old' not in revoked
+    assert 'live' in revoked
+    assert len(revoked) == 1
+
+
+def test_errors_default_to_401():
+    assert TokenError('Authentication required').status_code == 401
+    assert TokenError('Faculty or admin token required', 403).status_code == 403